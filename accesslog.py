@@ -0,0 +1,105 @@
+"""
+Structured JSON access log for the web application: one line per logged
+request, with its route, status, total time and the time spent in each
+stage (normalise, lookup_table or search_number, operator, commune,
+spam_count, render).
+
+Numbers are logged as a keyed hash (HMAC-SHA256 with the application's
+secret key, truncated): the same number gives the same hash in every
+worker, but the log does not reveal it.
+
+Requests only put the entry on a bounded in-memory queue; a background
+thread (QueueListener) encodes and writes it. When the queue is full the
+entry is dropped and counted rather than blocking the request.
+"""
+import atexit
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = 'whoistel.access'
+QUEUE_SIZE = 10000
+HASH_LENGTH = 16
+
+logger = logging.getLogger(LOGGER_NAME)
+
+class JSONFormatter(logging.Formatter):
+    """Formats records whose message is a dict as one compact JSON line."""
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            return json.dumps(record.msg, ensure_ascii=False, separators=(',', ':'))
+        return super().format(record)
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: entries are queued as is (encoded by the
+    listener thread) and dropped when the queue is full.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+_listener = None
+_handler = None
+
+def start(destination=None, queue_size=QUEUE_SIZE):
+    """
+    Routes the access logger through a queue to `destination` (a file path,
+    or standard error when None). Calling it again replaces the previous
+    destination.
+
+    Returns:
+        DroppingQueueHandler: The handler requests log through (see .dropped).
+    """
+    global _listener, _handler
+    stop()
+    target = logging.FileHandler(destination, encoding='utf-8') if destination else logging.StreamHandler(sys.stderr)
+    target.setFormatter(JSONFormatter())
+    log_queue = queue.Queue(queue_size)
+    _handler = DroppingQueueHandler(log_queue)
+    _listener = QueueListener(log_queue, target)
+    logger.handlers = [_handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _listener.start()
+    return _handler
+
+def stop():
+    """Writes the queued entries and detaches the destination."""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    if _handler is not None:
+        logger.removeHandler(_handler)
+        _handler = None
+
+atexit.register(stop)
+
+def number_hash(number, key):
+    """Stable, non-reversible identifier of a phone number (None when there is no number)."""
+    if not number:
+        return None
+    return hmac.new(key.encode(), number.encode(), hashlib.sha256).hexdigest()[:HASH_LENGTH]
+
+def log(entry):
+    """Queues an access log entry (a JSON-serialisable dict)."""
+    logger.info(entry)
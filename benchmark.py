@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+#-*- encoding: Utf-8 -*-
+"""
+Benchmark suite: number cleaning, lookups, batch enrichment, database
+build stages and the Flask routes, on a synthdata.py dataset of realistic
+size built in a temporary directory (no network needed).
+
+Each benchmark reports operations per second and p50/p99 latencies. Runs
+are saved as JSON; `compare` checks a run against a baseline and exits
+with status 1 when a benchmark regressed by more than the threshold, so
+it can gate merges (baselines are only comparable on the same machine).
+
+    python3 benchmark.py run --output baseline.json
+    python3 benchmark.py run --output current.json
+    python3 benchmark.py compare baseline.json current.json --threshold 0.15
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from itertools import cycle
+
+from benchstats import quiet_logging, summarize
+import generatedb
+import history_manager
+import synthdata
+import whoistel
+
+DEFAULT_DURATION = 1.0
+DEFAULT_THRESHOLD = 0.10
+MIN_RUNS = 20
+DEFAULT_RANGES = synthdata.BASE_RANGES
+DEFAULT_COMMUNES = synthdata.BASE_COMMUNES
+DEFAULT_OPERATORS = synthdata.BASE_OPERATORS
+DEFAULT_BUILDS = 3
+BATCH_ROWS = 1000
+# Metrics where a higher value is better; for the others (latencies) lower is better.
+HIGHER_IS_BETTER = {'ops_per_sec'}
+
+def measure(func, duration=DEFAULT_DURATION, min_runs=MIN_RUNS, ops_per_run=1):
+    """Calls func repeatedly for `duration` seconds (and at least min_runs times)."""
+    samples = []
+    deadline = time.perf_counter() + duration
+    while len(samples) < min_runs or time.perf_counter() < deadline:
+        start = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - start)
+    return summarize(samples, ops_per_run)
+
+def sample_numbers(prefixes, count=2000, seed=0):
+    """Lookup inputs: numbers under known prefixes, plus unknown and overseas numbers."""
+    rng = random.Random(seed)
+    numbers = []
+    for i in range(count):
+        if i % 10 == 0:
+            numbers.append(f"08{rng.randrange(10 ** 8):08d}")      # no range
+        elif i % 10 == 1:
+            numbers.append(f"0262{rng.randrange(10 ** 6):06d}")    # overseas
+        else:
+            prefix = rng.choice(prefixes)
+            numbers.append(prefix + ''.join(rng.choice('0123456789') for _ in range(10 - len(prefix))))
+    return numbers
+
+RAW_FORMATS = ("{n}", "{d}.{r}", "+33 {s}", "0033{s}", "+33 (0) {s}", "{d}-{r}")
+
+def raw_variants(numbers):
+    """The numbers written the ways users type them."""
+    variants = []
+    for i, number in enumerate(numbers):
+        pairs = ' '.join(number[j:j + 2] for j in range(0, 10, 2))
+        variants.append(RAW_FORMATS[i % len(RAW_FORMATS)].format(
+            n=number, d=number[:2], r=pairs[3:].replace(' ', '.'), s=pairs[1:]))
+    return variants
+
+def bench_lookups(db_path, numbers, duration):
+    results = {}
+    raw = cycle(raw_variants(numbers))
+    results['clean_phone_number'] = measure(lambda: whoistel.clean_phone_number(next(raw)), duration)
+    conn = whoistel.sqlite3.connect(db_path, factory=whoistel.Connection)
+    conn.row_factory = whoistel.sqlite3.Row
+    try:
+        inputs = cycle(numbers)
+        results['search_number'] = measure(lambda: whoistel.search_number(conn, next(inputs)), duration)
+        results['get_full_info'] = measure(lambda: whoistel.get_full_info(conn, next(inputs)), duration)
+        results['get_full_info.normalized'] = measure(lambda: whoistel.normalized_full_info(conn, next(inputs)), duration)
+        cache = whoistel.LookupCache(len(numbers))
+        results['get_full_info.cached'] = measure(lambda: whoistel.get_full_info(conn, next(inputs), cache=cache), duration)
+        rows = [(number, None) for number in raw_variants(numbers)[:BATCH_ROWS]]
+        results['enrich_batch'] = measure(lambda: sum(1 for _ in whoistel.enrich_batch(conn, rows)), duration,
+                                          min_runs=3, ops_per_run=len(rows))
+        csv_input = 'numero\n' + '\n'.join(raw for raw, _ in rows) + '\n'
+        results['write_batch'] = measure(lambda: whoistel.write_batch(conn, io.StringIO(csv_input), io.StringIO()),
+                                         duration, min_runs=3, ops_per_run=len(rows))
+    finally:
+        conn.close()
+    return results
+
+def bench_build(workdir, arcep_dir, builds):
+    """Full builds: one sample per build for every generatedb stage."""
+    stage_samples = {}
+    for i in range(builds):
+        db_path = os.path.join(workdir, f'build-{i}.sqlite3')
+        for name, elapsed in generatedb.build_database(db_path, arcep_dir).items():
+            stage_samples.setdefault(name, []).append(int(elapsed * 1e9))
+    results = {f'generatedb.{name}': summarize(samples) for name, samples in stage_samples.items()}
+    results['generatedb.total'] = summarize([sum(run) for run in zip(*stage_samples.values())])
+    return results
+
+def bench_routes(workdir, db_path, numbers, duration):
+    """Flask routes through the WSGI test client, against the synthetic database."""
+    from webapp import create_app
+
+    previous = whoistel.DB_FILE, history_manager.DB_FILE
+    whoistel.DB_FILE = db_path
+    history_manager.DB_FILE = os.path.join(workdir, 'history.sqlite3')
+    try:
+        app = create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False, 'SECRET_KEY': 'benchmark',
+                          'HISTORY_RETENTION_DAYS': 0, 'REPORT_CLIENT_LIMIT': 10 ** 9,
+                          'REPORT_GLOBAL_LIMIT': 10 ** 9})
+        client = app.test_client()
+        inputs = cycle(numbers)
+        sequence = iter(range(10 ** 9))
+
+        def report():
+            client.post('/report', data={'number': next(inputs), 'is_spam': 'on',
+                                         'comment': f"benchmark {next(sequence)}"})
+        results = {
+            'route./view': measure(lambda: client.get(f'/view/{next(inputs)}'), duration),
+            'route./report': measure(report, duration),
+            'route./history': measure(lambda: client.get('/history'), duration),
+        }
+    finally:
+        whoistel.DB_FILE, history_manager.DB_FILE = previous
+    return results
+
+def run(duration=DEFAULT_DURATION, ranges=DEFAULT_RANGES, communes=DEFAULT_COMMUNES,
+        operators=DEFAULT_OPERATORS, builds=DEFAULT_BUILDS, seed=0, groups=('lookups', 'build', 'routes')):
+    """
+    Runs the benchmark groups on a fresh synthetic dataset.
+
+    Returns:
+        dict: 'meta' (sizes, environment) and 'benchmarks' (name -> stats).
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='whoistel-bench-') as workdir, quiet_logging():
+        arcep_dir = os.path.join(workdir, 'arcep')
+        dataset = synthdata.generate(arcep_dir, ranges=ranges, operators=operators, communes=communes, seed=seed)
+        numbers = sample_numbers(sorted(dataset['metro']), seed=seed)
+        db_path = os.path.join(workdir, 'whoistel.sqlite3')
+        generatedb.build_database(db_path, arcep_dir)
+        if 'build' in groups:
+            results.update(bench_build(workdir, arcep_dir, builds))
+        if 'lookups' in groups:
+            results.update(bench_lookups(db_path, numbers, duration))
+        if 'routes' in groups:
+            results.update(bench_routes(workdir, db_path, numbers, duration))
+    return {
+        'meta': {
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': whoistel.sqlite3.sqlite_version,
+            'ranges': ranges, 'communes': communes, 'operators': operators,
+            'duration': duration, 'seed': seed,
+        },
+        'benchmarks': results,
+    }
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, metric='ops_per_sec'):
+    """
+    Compares two runs on one metric.
+
+    Returns:
+        list: (name, baseline value, current value, relative change, regressed)
+        for every benchmark present in both runs. The change is signed so
+        that a negative value is always a slowdown.
+    """
+    rows = []
+    for name, stats in baseline['benchmarks'].items():
+        other = current['benchmarks'].get(name)
+        if other is None or not stats.get(metric) or other.get(metric) is None:
+            continue
+        change = (other[metric] - stats[metric]) / stats[metric]
+        if metric not in HIGHER_IS_BETTER:
+            change = -change
+        rows.append((name, stats[metric], other[metric], change, change < -threshold))
+    return rows
+
+def print_results(results, file=None):
+    file = file or sys.stdout
+    print(f"{'Benchmark':<28} {'ops/s':>12} {'p50 µs':>10} {'p99 µs':>10} {'runs':>7}", file=file)
+    for name, stats in results['benchmarks'].items():
+        print(f"{name:<28} {stats['ops_per_sec'] or 0:>12.1f} {stats['p50_us']:>10.1f} {stats['p99_us']:>10.1f} "
+              f"{stats['runs']:>7}", file=file)
+
+def main():
+    """CLI entry point for running and comparing benchmarks."""
+    parser = argparse.ArgumentParser(description="Banc d'essai des recherches, de l'enrichissement, de la génération et des routes web.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Exécute les benchmarks et enregistre les résultats en JSON.")
+    run_parser.add_argument('--output', help="Fichier JSON des résultats (défaut: sortie standard uniquement).")
+    run_parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help="Durée de mesure par benchmark (s).")
+    run_parser.add_argument('--ranges', type=int, default=DEFAULT_RANGES, help="Nombre de plages synthétiques.")
+    run_parser.add_argument('--communes', type=int, default=DEFAULT_COMMUNES, help="Nombre de communes synthétiques.")
+    run_parser.add_argument('--operators', type=int, default=DEFAULT_OPERATORS, help="Nombre d'opérateurs synthétiques.")
+    run_parser.add_argument('--builds', type=int, default=DEFAULT_BUILDS, help="Nombre de générations complètes mesurées.")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--only', nargs='+', choices=('lookups', 'build', 'routes'),
+                            default=('lookups', 'build', 'routes'), help="Groupes de benchmarks à exécuter.")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare des résultats à une référence (code 1 si régression).")
+    compare_parser.add_argument('baseline', help="Résultats de référence (JSON).")
+    compare_parser.add_argument('current', help="Résultats à vérifier (JSON).")
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help="Dégradation relative tolérée (défaut: 0.10).")
+    compare_parser.add_argument('--metric', choices=('ops_per_sec', 'p50_us', 'p99_us'), default='ops_per_sec')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args.duration, args.ranges, args.communes, args.operators, args.builds, args.seed, args.only)
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        return
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"{e}", file=sys.stderr)
+        sys.exit(1)
+    rows = compare(baseline, current, args.threshold, args.metric)
+    for name, before, after, change, regressed in rows:
+        print(f"{name:<28} {before:>12.1f} -> {after:>12.1f} {change:>+8.1%}{'  RÉGRESSION' if regressed else ''}")
+    if any(regressed for *_, regressed in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Timing helpers shared by the measuring tools (benchmark.py, loadtest.py,
+enginefuzz.py): nearest-rank percentiles, a summary of per-run durations,
+and a switch that silences INFO logs while measuring.
+"""
+import logging
+from contextlib import contextmanager
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(samples_ns, ops_per_run=1):
+    """Turns per-run durations (ns) into ops/sec and latency percentiles (µs per run)."""
+    samples = sorted(samples_ns)
+    total = sum(samples)
+    return {
+        'runs': len(samples),
+        'ops_per_sec': round(len(samples) * ops_per_run / (total / 1e9), 2) if total else None,
+        'mean_us': round(total / len(samples) / 1e3, 3),
+        'p50_us': round(percentile(samples, 50) / 1e3, 3),
+        'p99_us': round(percentile(samples, 99) / 1e3, 3),
+    }
+
+@contextmanager
+def quiet_logging():
+    """Silences the INFO logs of the build and lookup modules while measuring."""
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        root.setLevel(level)
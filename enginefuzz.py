@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#-*- encoding: Utf-8 -*-
+"""
+Differential check of the lookup engines against the SQL reference.
+
+The same ARCEP files are built into one database per variant (standard,
+--compact, --compact-schema). Every engine then looks up the same inputs,
+and its get_full_info results must equal those of the reference: the
+prefix walk over the normalised range tables (normalized_full_info).
+
+The inputs are:
+- numbers at every prefix boundary (first and last number of each range);
+- the neighbours of each range, just outside it, which fall in a shorter
+  range or in none;
+- random numbers, mostly unknown, in every block (geographic, mobile,
+  special, overseas);
+- numbers shorter than 10 digits, and repeated numbers (cache hits);
+- the raw forms users type (+33, 0033, '+33 (0)', separators, +262...),
+  which must clean back to the same national number.
+
+Compaction replaces ARCEP prefixes by their collapsed parent, so the
+compacted engine is compared on everything but the prefix. Each engine's
+throughput over the same inputs is reported next to its mismatches. A new
+engine plugs in as an ENGINES entry.
+
+    python3 enginefuzz.py --ranges 20000 --count 50000
+    python3 enginefuzz.py --arcep-dir arcep --output fuzz.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, closing
+
+from benchstats import quiet_logging, summarize
+import generatedb
+import synthdata
+import whoistel
+
+DEFAULT_RANGES = 5000
+DEFAULT_COUNT = 20000
+DEFAULT_MAX_REPORTED = 20
+REFERENCE = 'range_tables'
+# Database variant -> build_database options.
+VARIANTS = {
+    'standard': {},
+    'compact': {'compact': True},
+    'compact_schema': {'compact_schema': True},
+}
+
+def _cached(conn):
+    cache = whoistel.LookupCache(maxsize=100000)
+    cache.sync(conn)
+    return lambda tel: whoistel.get_full_info(conn, tel, cache=cache)
+
+# Engine -> (database variant, factory returning a lookup function tel -> get_full_info result).
+ENGINES = {
+    'range_tables': ('standard', lambda conn: lambda tel: whoistel.normalized_full_info(conn, tel)),
+    'lookup_table': ('standard', lambda conn: lambda tel: whoistel.get_full_info(conn, tel)),
+    'cache': ('standard', _cached),
+    'compact': ('compact', lambda conn: lambda tel: whoistel.get_full_info(conn, tel)),
+    'compact_schema': ('compact_schema', lambda conn: lambda tel: whoistel.get_full_info(conn, tel)),
+}
+# Engines answering with the compacted prefix instead of the ARCEP one.
+PREFIX_INSENSITIVE = {'compact'}
+
+def load_prefixes(db_path):
+    """ARCEP prefixes of a standard database, overseas included."""
+    prefixes = []
+    with closing(sqlite3.connect(db_path)) as conn:
+        for table in generatedb.NUMBER_TABLES:
+            prefixes.extend(row[0] for row in conn.execute(f"SELECT PlageTel FROM {table}"))
+    return sorted(set(prefixes))
+
+def _random_digits(rng, count):
+    return ''.join(rng.choice('0123456789') for _ in range(count))
+
+def _neighbours(prefix):
+    """Prefixes of the same length just before and after `prefix`."""
+    value = int(prefix)
+    return [str(n).zfill(len(prefix)) for n in (value - 1, value + 1) if 0 <= n < 10 ** len(prefix)]
+
+def edge_numbers(prefixes):
+    """First and last number of every range, and of the ranges next to it."""
+    numbers = set()
+    for prefix in prefixes:
+        for candidate in (prefix, *_neighbours(prefix)):
+            if len(candidate) <= 10:
+                numbers.add(candidate.ljust(10, '0'))
+                numbers.add(candidate.ljust(10, '9'))
+    return sorted(numbers)
+
+def random_numbers(rng, count):
+    """Random numbers over every block, overseas ones included, some of them truncated."""
+    blocks = sorted(whoistel.OVERSEAS_BLOCKS)
+    numbers = []
+    for i in range(count):
+        if i % 5 == 0:
+            number = rng.choice(blocks) + _random_digits(rng, 6)
+        else:
+            number = '0' + rng.choice('123456789') + _random_digits(rng, 8)
+        if i % 50 == 0:
+            number = number[:rng.randint(2, 9)]
+        numbers.append(number)
+    return numbers
+
+def raw_forms(number):
+    """Ways of typing a 10-digit national number that clean_phone_number must bring back to it."""
+    cc = whoistel.country_code_of(number)
+    nsn = number[1:]
+    pairs = ' '.join(number[i:i + 2] for i in range(0, 10, 2))
+    return [pairs, '.'.join(pairs.split()), '-'.join(pairs.split()), f"+{cc} {nsn}", f"00{cc}{nsn}",
+            f"+{cc} (0) {nsn}", f"({number[:2]}) {number[2:]}"]
+
+def generate_inputs(prefixes, count=DEFAULT_COUNT, seed=0):
+    """
+    Returns:
+        tuple: (numbers to look up, [(raw form, expected cleaned number)]).
+    """
+    rng = random.Random(seed)
+    numbers = edge_numbers(prefixes) + random_numbers(rng, count)
+    raw = [(form, number) for number in rng.sample(numbers, min(len(numbers), count // 10 or 1))
+           if len(number) == 10 and number.startswith('0') for form in raw_forms(number)]
+    # Repeated numbers, so that the cache engine also answers from its entries
+    numbers += rng.choices(numbers, k=len(numbers) // 5)
+    return numbers, raw
+
+def _comparable(result, engine):
+    if engine in PREFIX_INSENSITIVE and result is not None:
+        return {key: value for key, value in result.items() if key != 'prefix'}
+    return result
+
+def check_cleaning(raw):
+    """Raw forms whose cleaned number differs from the expected one: [(raw, expected, got)]."""
+    return [(form, expected, cleaned) for form, expected in raw
+            if (cleaned := whoistel.clean_phone_number(form)) != expected]
+
+def run(db_paths, numbers, engines=None, max_reported=DEFAULT_MAX_REPORTED):
+    """
+    Looks up `numbers` with every engine and compares the results with the
+    reference engine's.
+
+    Args:
+        db_paths (dict): Database variant -> path.
+        engines (list): Engine names (default: all of ENGINES).
+
+    Returns:
+        dict: Engine -> {'mismatches' (count), 'examples' (first
+        max_reported (number, expected, got)), 'stats' (summarize)}.
+    """
+    engines = list(engines or ENGINES)
+    if REFERENCE not in engines:
+        engines.insert(0, REFERENCE)
+    report = {}
+    expected = None
+    with ExitStack() as stack:
+        connections = {}
+        for engine in sorted(engines, key=lambda name: name != REFERENCE):
+            variant, factory = ENGINES[engine]
+            if variant not in connections:
+                conn = stack.enter_context(closing(sqlite3.connect(db_paths[variant], factory=whoistel.Connection)))
+                conn.row_factory = sqlite3.Row
+                connections[variant] = conn
+            lookup = factory(connections[variant])
+            results, samples = [], []
+            for number in numbers:
+                start = time.perf_counter_ns()
+                result = lookup(number)
+                samples.append(time.perf_counter_ns() - start)
+                results.append(result)
+            if expected is None:
+                expected = results
+            mismatches = [(number, _comparable(want, engine), _comparable(got, engine))
+                          for number, want, got in zip(numbers, expected, results)
+                          if _comparable(want, engine) != _comparable(got, engine)]
+            report[engine] = {'mismatches': len(mismatches), 'examples': mismatches[:max_reported],
+                              'stats': summarize(samples)}
+    return report
+
+def build_variants(workdir, arcep_dir, variants=VARIANTS):
+    """Builds one database per variant from the same ARCEP files; returns variant -> path."""
+    paths = {}
+    for variant, options in variants.items():
+        paths[variant] = os.path.join(workdir, f'{variant}.sqlite3')
+        generatedb.build_database(paths[variant], arcep_dir, **options)
+    return paths
+
+def print_report(report, cleaning, file=None):
+    print(f"clean_phone_number: {len(cleaning)} écart(s)", file=file)
+    for form, want, got in cleaning[:DEFAULT_MAX_REPORTED]:
+        print(f"  {form!r}: attendu {want!r}, obtenu {got!r}", file=file)
+    for engine, entry in report.items():
+        stats = entry['stats']
+        print(f"{engine:16} {entry['mismatches']:6d} écart(s) {stats['ops_per_sec']:12.0f} ops/s "
+              f"p50 {stats['p50_us']:8.1f} µs  p99 {stats['p99_us']:8.1f} µs", file=file)
+        for number, want, got in entry['examples']:
+            print(f"  {number}: attendu {want}\n  {' ' * len(number)}  obtenu  {got}", file=file)
+
+def main():
+    """CLI entry point for the engine equivalence check."""
+    parser = argparse.ArgumentParser(description="Vérifie que tous les moteurs de recherche donnent les mêmes résultats que la référence SQL.")
+    parser.add_argument('--arcep-dir', help="Fichiers ARCEP/INSEE à utiliser (défaut: jeu synthétique).")
+    parser.add_argument('--ranges', type=int, default=DEFAULT_RANGES, help="Nombre de plages du jeu synthétique.")
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT, help="Nombre de numéros aléatoires en plus des bornes de plages.")
+    parser.add_argument('--engines', help=f"Moteurs à comparer, séparés par des virgules (défaut: {','.join(ENGINES)}).")
+    parser.add_argument('--seed', type=int, default=0, help="Graine aléatoire.")
+    parser.add_argument('--output', help="Enregistre le rapport en JSON.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    engines = args.engines.split(',') if args.engines else None
+    unknown = set(engines or ()) - set(ENGINES)
+    if unknown:
+        parser.error(f"Moteur(s) inconnu(s): {', '.join(sorted(unknown))}")
+    with tempfile.TemporaryDirectory(prefix='whoistel-fuzz-') as workdir, quiet_logging():
+        arcep_dir = args.arcep_dir
+        if arcep_dir is None:
+            arcep_dir = os.path.join(workdir, 'arcep')
+            synthdata.generate(arcep_dir, ranges=args.ranges, operators=max(1, args.ranges // 100),
+                               communes=max(1, args.ranges // 2), seed=args.seed)
+        variants = {ENGINES[engine][0] for engine in engines or ENGINES} | {ENGINES[REFERENCE][0]}
+        db_paths = build_variants(workdir, arcep_dir, {variant: VARIANTS[variant] for variant in variants})
+        numbers, raw = generate_inputs(load_prefixes(db_paths['standard']), args.count, args.seed)
+        cleaning = check_cleaning(raw)
+        report = run(db_paths, numbers, engines)
+
+    print(f"{len(numbers)} numéros, {len(raw)} formes brutes")
+    print_report(report, cleaning)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'numbers': len(numbers), 'cleaning': cleaning, 'engines': report}, f, indent=2, ensure_ascii=False)
+    if cleaning or any(entry['mismatches'] for entry in report.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,136 @@
 #!/usr/bin/env python3
 #-*- encoding: Utf-8 -*-
+"""
+Builds the whoistel SQLite database from the ARCEP and INSEE CSV files.
+The database is built in a temporary file, checked, and then atomically
+swapped into place so running lookups never see a partial database.
+"""
 import sqlite3
-import pandas as pd
+import argparse
+import csv
+import json
 import os
+import re
+import shutil
+import sys
 import logging
+import time
+import unicodedata
+import uuid
+from contextlib import closing, contextmanager
+from itertools import islice
+from operator import itemgetter
+import memprofile
+import whoistel
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-DB_FILE = 'whoistel.sqlite3'
+DB_FILE = os.environ.get('WHOISTEL_DB_FILE', 'whoistel.sqlite3')
+ARCEP_DIR = 'arcep'
+BUILD_SUFFIX = '.building'
+BACKUP_SUFFIX = '.bak'
 
-def setup_database():
-    if os.path.exists(DB_FILE):
-        logger.info(f"Removing old database {DB_FILE}...")
-        os.remove(DB_FILE)
+# Sanity checks run on the new database before it replaces the current one.
+# A table smaller than this ratio of its previous size is taken as a truncated download.
+MIN_ROW_RATIO = 0.5
+# Share of prefixes sampled from the previous database that must still resolve.
+MIN_KNOWN_PREFIX_RATIO = 0.9
+SANITY_SAMPLE_SIZE = 50
+RANGE_TABLES = ('PlagesNumerosGeographiques', 'PlagesNumeros')
+REQUIRED_TABLES = (*RANGE_TABLES, 'Operateurs', 'Communes')
+# Overseas ranges, partitioned by country code (the metropolitan range tables
+# are the '33' partition). Optional: some datasets carry no overseas ranges.
+OVERSEAS_TABLE = 'PlagesOutreMer'
+NUMBER_TABLES = (*RANGE_TABLES, OVERSEAS_TABLE)
+# ARCEP 'Territoire' values (see _territory_key) -> country code.
+TERRITORY_CODES = {
+    'metropole': whoistel.METROPOLE_CODE,
+    'la-reunion': '262', 'reunion': '262', 'mayotte': '262',
+    'guadeloupe': '590', 'saint-martin': '590', 'saint-barthelemy': '590',
+    'guyane': '594', 'martinique': '596',
+    'saint-pierre-et-miquelon': '508',
+}
+KEY_COLUMNS = {
+    'PlagesNumerosGeographiques': 'PlageTel',
+    'PlagesNumeros': 'PlageTel',
+    'Operateurs': 'CodeOperateur',
+    'Communes': 'CodeInsee',
+}
+GEO_PREFIX = re.compile(r'^0[1-5]')
+# Prefix lengths probed by whoistel.search_number (longest first).
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 9
+# Rows read and written per batch by the streaming importers.
+CHUNK_SIZE = 10000
+# Matches the usual OS page: a point lookup reads no more than it needs.
+BUILD_PAGE_SIZE = 4096
+# Range assignment history: ISO dates, with sentinels so every interval is
+# half-open [ValidFrom, ValidTo) and the validity index stays usable.
+HISTORY_OPEN_END = '9999-12-31'
+HISTORY_UNKNOWN_START = '0001-01-01'
 
-    conn = sqlite3.connect(DB_FILE)
+class BuildError(Exception):
+    """Raised when a freshly built database fails its sanity checks."""
+    pass
+
+def setup_database(db_path=DB_FILE, bulk=True):
+    """
+    Creates an empty database with the whoistel schema at db_path.
+
+    In bulk mode (the default), tables are created without their key
+    constraints (see build_indexes), journaling and fsync are disabled and a
+    single transaction is left open for the whole load. This is only safe
+    because the build happens in a throwaway file that is checked before
+    being published.
+    """
+    if os.path.exists(db_path):
+        logger.info(f"Removing stale database {db_path}...")
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    if bulk:
+        conn.execute(f"PRAGMA page_size = {BUILD_PAGE_SIZE}")
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+
+    create_tables(conn, keyed=not bulk)
+    create_metadata_tables(conn)
+    conn.execute("INSERT INTO BuildInfo (Key, Value) VALUES ('build_id', ?)", (uuid.uuid4().hex,))
+
+    if not bulk:
+        conn.commit()
+    return conn
+
+def create_tables(conn, schema='main', keyed=True):
+    """Creates the range, operator, commune and range history tables in the given schema."""
     c = conn.cursor()
+    key = ' PRIMARY KEY' if keyed else ''
 
     # Create Tables
     # PlagesNumerosGeographiques: Geo numbers (01-05). PlageTel is the prefix (e.g. "01056").
     # Changed PlageTel to TEXT for consistency and flexibility.
     # Changed CodeInsee to TEXT to support 2A/2B and leading zeros.
-    c.execute('''
-    CREATE TABLE PlagesNumerosGeographiques(
-        PlageTel TEXT PRIMARY KEY,
+    c.execute(f'''
+    CREATE TABLE {schema}.PlagesNumerosGeographiques(
+        PlageTel TEXT{key},
         CodeOperateur TEXT,
         CodeInsee TEXT
     );
     ''')
 
     # PlagesNumeros: Non-Geo numbers (06, 07, 08, 09, etc.). PlageTel is the prefix.
-    c.execute('''
-    CREATE TABLE PlagesNumeros(
-        PlageTel TEXT PRIMARY KEY,
+    c.execute(f'''
+    CREATE TABLE {schema}.PlagesNumeros(
+        PlageTel TEXT{key},
         CodeOperateur TEXT
     );
     ''')
 
     # Operateurs
-    c.execute('''
-    CREATE TABLE Operateurs(
-        CodeOperateur TEXT PRIMARY KEY,
+    c.execute(f'''
+    CREATE TABLE {schema}.Operateurs(
+        CodeOperateur TEXT{key},
         NomOperateur TEXT,
         TypeOperateur TEXT,
         MailOperateur TEXT,
@@ -52,9 +140,9 @@ def setup_database():
 
     # Communes
     # Added Latitude, Longitude. Changed CodeInsee/CodePostal to TEXT.
-    c.execute('''
-    CREATE TABLE Communes(
-        CodeInsee TEXT PRIMARY KEY,
+    c.execute(f'''
+    CREATE TABLE {schema}.Communes(
+        CodeInsee TEXT{key},
         NomCommune TEXT,
         CodePostal TEXT,
         NomDepartement TEXT,
@@ -63,134 +151,920 @@ def setup_database():
     );
     ''')
 
+    create_overseas_table(conn, schema)
+    create_history_table(conn, schema, keyed)
+
+def create_overseas_table(conn, schema='main'):
+    """
+    Creates PlagesOutreMer, the overseas ranges keyed by (Indicatif, PlageTel):
+    a lookup stays within the B-tree range of its own country code. It is
+    small, so it keeps its key even in bulk mode.
+    """
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {schema}.PlagesOutreMer(
+        Indicatif TEXT,
+        PlageTel TEXT,
+        CodeOperateur TEXT,
+        Territoire TEXT,
+        PRIMARY KEY (Indicatif, PlageTel)
+    ) WITHOUT ROWID;
+    ''')
+
+def create_history_table(conn, schema='main', keyed=True):
+    """
+    Creates HistoriquePlages: one row per range assignment with its validity
+    interval [ValidFrom, ValidTo), kept across imports by merge_range_history.
+    The current assignment of a prefix has ValidTo = HISTORY_OPEN_END.
+    """
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {schema}.HistoriquePlages(
+        PlageTel TEXT,
+        CodeOperateur TEXT,
+        ValidFrom TEXT,
+        ValidTo TEXT
+    );
+    ''')
+    if keyed:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_HistoriquePlages_validity "
+                     "ON HistoriquePlages (PlageTel, ValidFrom, ValidTo)")
+
+def create_metadata_tables(conn):
+    """
+    Creates the build metadata and change-log tables. BuildInfo holds a
+    build_id that changes on every full build. ChangeLog records each
+    incremental update; lookup caches use both to invalidate entries.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS BuildInfo(
+        Key TEXT PRIMARY KEY,
+        Value TEXT
+    );
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ChangeLog(
+        Id INTEGER PRIMARY KEY AUTOINCREMENT,
+        DatasetDate TEXT,
+        AppliedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        TableName TEXT NOT NULL,
+        Action TEXT NOT NULL,
+        KeyValue TEXT NOT NULL,
+        OldValue TEXT,
+        NewValue TEXT
+    );
+    ''')
+
+def build_indexes(conn):
+    """Creates the key indexes deferred by bulk mode and commits the load."""
+    for table, column in KEY_COLUMNS.items():
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_HistoriquePlages_validity ON HistoriquePlages (PlageTel, ValidFrom, ValidTo)")
     conn.commit()
-    return conn
 
-def import_operateurs(conn):
-    logger.info('Importing Operators from arcep/identifiants_ce.csv...')
-    try:
-        # Columns: CODE_OPERATEUR;IDENTITE_OPERATEUR;...
-        df = pd.read_csv('arcep/identifiants_ce.csv', sep=';', encoding='cp1252', dtype=str)
+def build_lookup_table(conn):
+    """
+    (Re)builds LookupNumeros, a denormalised WITHOUT ROWID copy of both range
+    tables where each prefix row already carries what whoistel.get_full_info
+    returns: operator details (sanitised contact fields, 'Inconnu' for
+    unknown operators), commune details and region. It is derived data: the
+    normalised tables stay the reference and this one is rebuilt from them
+    (no commit).
 
-        # Select and rename columns
-        # We only have Code and Name basically.
-        data = df[['CODE_OPERATEUR', 'IDENTITE_OPERATEUR']].copy()
-        data.columns = ['CodeOperateur', 'NomOperateur']
-        data['TypeOperateur'] = ''
-        data['MailOperateur'] = ''
-        data['SiteOperateur'] = ''
+    Returns:
+        int: Number of rows written.
+    """
+    conn.execute("DROP TABLE IF EXISTS LookupNumeros")
+    conn.execute('''
+    CREATE TABLE LookupNumeros(
+        PlageTel TEXT PRIMARY KEY,
+        Type TEXT,
+        CodeOperateur TEXT,
+        NomOperateur TEXT,
+        TypeOperateur TEXT,
+        MailOperateur TEXT,
+        SiteOperateur TEXT,
+        CodeInsee TEXT,
+        NomCommune TEXT,
+        CodePostal TEXT,
+        NomDepartement TEXT,
+        Latitude REAL,
+        Longitude REAL,
+        Region TEXT
+    ) WITHOUT ROWID;
+    ''')
+    # CodeInsee is only kept when the commune exists, as get_commune_info would.
+    rows = conn.execute('''
+        SELECT r.PlageTel, r.Type, r.CodeOperateur, o.CodeOperateur IS NOT NULL,
+               o.NomOperateur, o.TypeOperateur, o.MailOperateur, o.SiteOperateur,
+               c.CodeInsee, c.NomCommune, c.CodePostal, c.NomDepartement, c.Latitude, c.Longitude
+        FROM (SELECT PlageTel, 'Geographique' AS Type, CodeOperateur, CodeInsee FROM PlagesNumerosGeographiques
+              UNION ALL
+              SELECT PlageTel, 'Non-Geographique', CodeOperateur, NULL FROM PlagesNumeros) r
+        LEFT JOIN Operateurs o ON o.CodeOperateur = r.CodeOperateur
+        LEFT JOIN Communes c ON c.CodeInsee = r.CodeInsee AND r.CodeInsee != '0'
+    ''').fetchall()
+
+    lookup_rows = []
+    for (prefix, number_type, code_operateur, known, nom, type_operateur, mail, site,
+         code_insee, commune, code_postal, departement, latitude, longitude) in rows:
+        if known:
+            mail, site = whoistel.sanitize_contact(mail, site)
+        else:
+            nom, type_operateur, mail, site = 'Inconnu', 'N/A', None, None
+        region = whoistel.REGION_MAP.get(prefix[:2]) if number_type == 'Geographique' else None
+        lookup_rows.append((prefix, number_type, code_operateur, nom, type_operateur, mail, site,
+                            code_insee, commune, code_postal, departement, latitude, longitude, region))
+    conn.executemany(f"INSERT INTO LookupNumeros VALUES ({', '.join('?' * 14)})", lookup_rows)
+    logger.info(f"Built LookupNumeros with {len(lookup_rows)} prefixes.")
+    return len(lookup_rows)
+
+def finalize_database(conn):
+    """Collects planner statistics and rewrites the file compactly."""
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("VACUUM")
 
-        # Clean data
-        data['CodeOperateur'] = data['CodeOperateur'].str.strip()
-        data['NomOperateur'] = data['NomOperateur'].str.strip()
+def _read_chunks(path, delimiter, encoding, chunk_size=None):
+    """
+    Streams a CSV file as lists of at most chunk_size row dicts, so memory use
+    does not depend on the file size.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    with open(path, newline='', encoding=encoding) as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        while chunk := list(islice(reader, chunk_size)):
+            yield chunk
 
-        # Drop duplicates
-        data.drop_duplicates(subset=['CodeOperateur'], inplace=True)
+def _prefix_key(prefix):
+    """Compact seen-set key for a range prefix: one small int instead of a str (length keeps leading zeros)."""
+    return int(prefix) * 16 + len(prefix) if prefix.isdigit() else prefix
+
+def _clean(value):
+    """Strips a CSV field, mapping empty values to None."""
+    if value is None:
+        return None
+    value = value.strip()
+    return value or None
+
+def _iso_date(value):
+    """Converts an ARCEP date (DD/MM/YYYY) to ISO format, HISTORY_UNKNOWN_START if missing or malformed."""
+    value = _clean(value)
+    try:
+        return time.strftime('%Y-%m-%d', time.strptime(value, '%d/%m/%Y'))
+    except (TypeError, ValueError):
+        return HISTORY_UNKNOWN_START
 
-        data.to_sql('Operateurs', conn, if_exists='append', index=False)
-        logger.info(f"Imported {len(data)} operators.")
+def import_operateurs(conn, arcep_dir=ARCEP_DIR, chunk_size=None, schema='main'):
+    logger.info(f'Importing Operators from {arcep_dir}/identifiants_ce.csv...')
+    try:
+        # Columns: CODE_OPERATEUR;IDENTITE_OPERATEUR;...
+        # We only have Code and Name basically.
+        seen = set()
+        count = 0
+        for chunk in _read_chunks(os.path.join(arcep_dir, 'identifiants_ce.csv'), ';', 'cp1252', chunk_size):
+            rows = []
+            for row in chunk:
+                code = _clean(row['CODE_OPERATEUR'])
+                if code is None or code in seen:
+                    continue
+                seen.add(code)
+                rows.append((code, _clean(row['IDENTITE_OPERATEUR']), '', '', ''))
+            rows.sort()
+            conn.executemany(f'''
+                INSERT INTO {schema}.Operateurs (CodeOperateur, NomOperateur, TypeOperateur, MailOperateur, SiteOperateur)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            count += len(rows)
+        logger.info(f"Imported {count} operators.")
 
     except Exception as e:
         logger.error(f"Error importing operators: {e}")
 
-def import_numeros(conn):
-    logger.info('Importing Numbering Resources from arcep/majournums.csv...')
+def _territory_key(name):
+    """'Saint-Barthélemy', 'SAINT BARTHELEMY' -> 'saint-barthelemy'."""
+    name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode()
+    return re.sub(r'[\s_\-]+', '-', name.strip().lower())
+
+def import_numeros(conn, arcep_dir=ARCEP_DIR, chunk_size=None, schema='main'):
+    logger.info(f'Importing Numbering Resources from {arcep_dir}/majournums.csv...')
     try:
         # Columns: EZABPQM;Tranche_Debut;Tranche_Fin;Mnémo;Territoire;Date_Attribution
-        df = pd.read_csv('arcep/majournums.csv', sep=';', encoding='cp1252', dtype=str)
+        # +33 is Metropole and fills the two range tables; the DOM have their own
+        # country codes (+262, +590...) and go to PlagesOutreMer, keyed by code.
+        # Ranges of an unknown territory are skipped.
+        # Geo: starts with 01, 02, 03, 04, 05 (CodeInsee '0' placeholder as TEXT).
+        # First occurrence of a prefix wins.
+        # Each kept range also gets an open HistoriquePlages interval starting at
+        # its Date_Attribution (merged with the previous history afterwards).
+        seen = set()
+        geo_count = non_geo_count = overseas_count = 0
+        unknown = set()
+        for chunk in _read_chunks(os.path.join(arcep_dir, 'majournums.csv'), ';', 'cp1252', chunk_size):
+            geo_rows = []
+            non_geo_rows = []
+            overseas_rows = []
+            history_rows = []
+            for row in chunk:
+                code = TERRITORY_CODES.get(_territory_key(row['Territoire']))
+                if code is None:
+                    unknown.add(row['Territoire'])
+                    continue
+                prefix = _clean(row['EZABPQM'])
+                if prefix is None:
+                    continue
+                key = _prefix_key(prefix)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if code != whoistel.METROPOLE_CODE:
+                    overseas_rows.append((code, prefix, row['Mnémo'], _clean(row['Territoire'])))
+                elif GEO_PREFIX.match(prefix):
+                    geo_rows.append((prefix, row['Mnémo'], '0'))
+                else:
+                    non_geo_rows.append((prefix, row['Mnémo']))
+                history_rows.append((prefix, row['Mnémo'], _iso_date(row.get('Date_Attribution')), HISTORY_OPEN_END))
 
-        # Rename columns for clarity
-        df.rename(columns={'EZABPQM': 'PlageTel', 'Mnémo': 'CodeOperateur'}, inplace=True)
+            # Each chunk is inserted in key order (tuples start with the key), so
+            # B-tree inserts append to the same pages instead of splitting random ones.
+            for rows in (geo_rows, non_geo_rows, overseas_rows, history_rows):
+                rows.sort()
+            conn.executemany(f"INSERT INTO {schema}.PlagesNumerosGeographiques (PlageTel, CodeOperateur, CodeInsee) VALUES (?, ?, ?)", geo_rows)
+            conn.executemany(f"INSERT INTO {schema}.PlagesNumeros (PlageTel, CodeOperateur) VALUES (?, ?)", non_geo_rows)
+            conn.executemany(f"INSERT INTO {schema}.PlagesOutreMer (Indicatif, PlageTel, CodeOperateur, Territoire) VALUES (?, ?, ?, ?)", overseas_rows)
+            conn.executemany(f"INSERT INTO {schema}.HistoriquePlages (PlageTel, CodeOperateur, ValidFrom, ValidTo) VALUES (?, ?, ?, ?)", history_rows)
+            geo_count += len(geo_rows)
+            non_geo_count += len(non_geo_rows)
+            overseas_count += len(overseas_rows)
 
-        # Filter for Metropole? (User wants +33, usually implies Metropole but Overseas is also +262 etc. +33 is Metropole)
-        # However, checking +33 numbers implies we mostly care about Metropole.
-        # But we can keep all. "Territoire" column.
-        # Let's keep all for now, or filter 'Métropole' if we only want +33.
-        # +33 is France. DOM have their own codes (+262, +590...).
-        # Arcep file contains all.
-        # Ideally we should filter by Territoire = Métropole for +33.
+        logger.info(f"Imported {geo_count} geographic number ranges.")
+        logger.info(f"Imported {non_geo_count} non-geographic number ranges.")
+        logger.info(f"Imported {overseas_count} overseas number ranges.")
+        if unknown:
+            logger.warning(f"Skipped ranges of unknown territories: {sorted(unknown)}")
 
-        df_metro = df[df['Territoire'] == 'Métropole'].copy()
-        logger.info(f"Filtered {len(df_metro)} entries for Métropole.")
+    except Exception as e:
+        logger.error(f"Error importing numbers: {e}")
 
-        # Separate Geo and Non-Geo
-        # Geo: Starts with 01, 02, 03, 04, 05.
-        mask_geo = df_metro['PlageTel'].str.match(r'^0[1-5]')
-        df_geo = df_metro[mask_geo].copy()
-        df_non_geo = df_metro[~mask_geo].copy()
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
 
-        # Prepare Geo Table
-        # PlageTel, CodeOperateur, CodeInsee (0 placeholder as TEXT)
-        df_geo = df_geo[['PlageTel', 'CodeOperateur']]
-        df_geo['CodeInsee'] = '0'
+def import_communes(conn, arcep_dir=ARCEP_DIR, chunk_size=None, schema='main'):
+    logger.info(f'Importing Communes from {arcep_dir}/communes-france.csv...')
+    try:
+        # Columns: code_commune_INSEE,nom_commune_postal,code_postal,libelle_acheminement,ligne_5,latitude,longitude,code_commune,article,nom_commune,nom_commune_complet,code_departement,nom_departement,code_region,nom_region
+        # Separator is comma.
+        # One row per CodeInsee: the main entry (empty ligne_5) wins over
+        # secondary delivery lines (e.g. 'LOMME'). Rows get explicit rowids so a
+        # secondary line stored first can be replaced in place without an index.
+        seen = {}  # CodeInsee -> rowid of a secondary line, or 0 once the main entry is stored
+        next_rowid = 1
+        for chunk in _read_chunks(os.path.join(arcep_dir, 'communes-france.csv'), ',', 'utf-8-sig', chunk_size):
+            inserts = []
+            updates = []
+            for row in chunk:
+                code_insee = _clean(row['code_commune_INSEE'])
+                if code_insee is None:
+                    continue
+                code_insee = code_insee.zfill(5)
+                is_main = not _clean(row['ligne_5'])
+                code_postal = _clean(row['code_postal'])
+                values = (
+                    _clean(row['nom_commune']),
+                    code_postal.zfill(5) if code_postal else None,
+                    _clean(row['nom_departement']),
+                    _to_float(row['latitude']),
+                    _to_float(row['longitude']),
+                )
+                stored = seen.get(code_insee)
+                if stored is None:
+                    seen[code_insee] = 0 if is_main else next_rowid
+                    inserts.append((next_rowid, code_insee, *values))
+                    next_rowid += 1
+                elif stored and is_main:
+                    seen[code_insee] = 0
+                    updates.append((*values, stored))
 
-        # Drop duplicates
-        df_geo.drop_duplicates(subset=['PlageTel'], inplace=True)
+            inserts.sort(key=itemgetter(1))
+            conn.executemany(f'''
+                INSERT INTO {schema}.Communes (rowid, CodeInsee, NomCommune, CodePostal, NomDepartement, Latitude, Longitude)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', inserts)
+            conn.executemany(f'''
+                UPDATE {schema}.Communes SET NomCommune = ?, CodePostal = ?, NomDepartement = ?, Latitude = ?, Longitude = ?
+                WHERE rowid = ?
+            ''', updates)
 
-        df_geo.to_sql('PlagesNumerosGeographiques', conn, if_exists='append', index=False)
-        logger.info(f"Imported {len(df_geo)} geographic number ranges.")
+        logger.info(f"Imported {len(seen)} communes.")
 
-        # Prepare Non-Geo Table
-        # PlageTel, CodeOperateur
-        df_non_geo = df_non_geo[['PlageTel', 'CodeOperateur']]
+    except Exception as e:
+        logger.error(f"Error importing communes: {e}")
 
-        # Drop duplicates
-        df_non_geo.drop_duplicates(subset=['PlageTel'], inplace=True)
+def _table_count(conn, table):
+    """Row count of a table; range tables are counted in PlagesCompactes under the compact schema."""
+    if table in RANGE_TABLES and has_compact_schema(conn):
+        return conn.execute("SELECT COUNT(*) FROM PlagesCompactes WHERE Geographique = ?",
+                            (table == 'PlagesNumerosGeographiques',)).fetchone()[0]
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
 
-        df_non_geo.to_sql('PlagesNumeros', conn, if_exists='append', index=False)
-        logger.info(f"Imported {len(df_non_geo)} non-geographic number ranges.")
+def _sample_numbers(conn, limit=SANITY_SAMPLE_SIZE):
+    """Returns 10-digit numbers built from a random sample of range prefixes."""
+    numbers = []
+    if has_compact_schema(conn):
+        for geographic in (1, 0):
+            rows = conn.execute("SELECT Longueur, Prefixe FROM PlagesCompactes WHERE Geographique = ? "
+                                "ORDER BY random() LIMIT ?", (geographic, limit)).fetchall()
+            numbers.extend(str(prefix).zfill(length).ljust(10, '0') for length, prefix in rows)
+        return numbers
+    for table in RANGE_TABLES:
+        rows = conn.execute(f"SELECT PlageTel FROM {table} ORDER BY random() LIMIT ?", (limit,)).fetchall()
+        numbers.extend(row[0].ljust(10, '0') for row in rows if row[0])
+    return numbers
 
-    except Exception as e:
-        logger.error(f"Error importing numbers: {e}")
+def check_database(conn, previous_db=None):
+    """
+    Sanity checks a freshly built database before it is published:
+    integrity check, non-empty tables (and no more than a (1 - MIN_ROW_RATIO)
+    shrink compared to the previous database), a sample of new ranges
+    resolving through whoistel.search_number (with the same answer from
+    LookupNumeros), and a sample of prefixes from the previous database
+    still resolving.
 
-def import_communes(conn):
-    logger.info('Importing Communes from arcep/communes-france.csv...')
+    Raises:
+        BuildError: If any check fails.
+    """
+    result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    if result != 'ok':
+        raise BuildError(f"Integrity check failed: {result}")
+
+    counts = {table: _table_count(conn, table) for table in REQUIRED_TABLES}
+    compacted = is_compacted(conn)
+    for table, count in counts.items():
+        if count == 0:
+            raise BuildError(f"Table {table} is empty.")
+    logger.info(f"Row counts: {counts}")
+
+    conn.row_factory = sqlite3.Row
+    for number in _sample_numbers(conn):
+        if not whoistel.search_number(conn, number):
+            raise BuildError(f"Sample number {number} does not resolve in the new database.")
+        lookup = whoistel.lookup_full_info(conn, number)
+        if lookup is not None and lookup != whoistel.normalized_full_info(conn, number):
+            raise BuildError(f"LookupNumeros disagrees with the normalised tables for {number}.")
+
+    if previous_db and os.path.exists(previous_db):
+        with closing(sqlite3.connect(f"file:{previous_db}?mode=ro", uri=True)) as previous:
+            try:
+                for table, count in counts.items():
+                    if table in RANGE_TABLES and is_compacted(previous) != compacted:
+                        # Row counts of compacted and plain range tables are not comparable.
+                        continue
+                    previous_count = _table_count(previous, table)
+                    if count < previous_count * MIN_ROW_RATIO:
+                        raise BuildError(f"Table {table} shrank from {previous_count} to {count} rows.")
+                known = _sample_numbers(previous)
+            except sqlite3.DatabaseError as e:
+                logger.warning(f"Previous database {previous_db} is unreadable, skipping comparison: {e}")
+                known = []
+        if known:
+            resolved = sum(1 for number in known if whoistel.search_number(conn, number))
+            if resolved < len(known) * MIN_KNOWN_PREFIX_RATIO:
+                raise BuildError(f"Only {resolved}/{len(known)} known prefixes still resolve.")
+
+def publish_database(build_path, db_path=DB_FILE):
+    """
+    Atomically replaces db_path with build_path. The current database is
+    kept as db_path + BACKUP_SUFFIX for rollback. db_path is never missing:
+    the backup is a hard link (or copy) and the swap is a single os.replace.
+    Open connections keep reading the old file; new ones see the new file.
+    """
+    backup_path = db_path + BACKUP_SUFFIX
+    if os.path.exists(db_path):
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        try:
+            os.link(db_path, backup_path)
+        except OSError:
+            shutil.copy2(db_path, backup_path)
+    os.replace(build_path, db_path)
+    logger.info(f"Published {db_path} (previous database kept as {backup_path}).")
+
+def rollback_database(db_path=DB_FILE):
+    """Atomically restores the backup kept by the last publish."""
+    backup_path = db_path + BACKUP_SUFFIX
+    if not os.path.exists(backup_path):
+        raise BuildError(f"No backup to roll back to ({backup_path}).")
+    os.replace(backup_path, db_path)
+    logger.info(f"Rolled back {db_path} to the previous database.")
+
+def compact_prefixes(entries):
+    """
+    Collapses complete sibling groups: when the ten children p0..p9 of a
+    prefix p are all present with identical values, they are replaced by p
+    with that value. Any previous value of p was shadowed by its children,
+    so the longest-prefix-match answer of every number is unchanged. Runs
+    from the longest prefixes up, so merged parents can merge in turn.
+
+    Args:
+        entries (dict): Prefix -> tuple of values.
+
+    Returns:
+        dict: The compacted prefix -> values mapping.
+    """
+    compacted = dict(entries)
+    lengths = [len(p) for p in compacted if p.isdigit()]
+    top = min(max(lengths, default=0), MAX_PREFIX_LENGTH)
+    for length in range(top, MIN_PREFIX_LENGTH, -1):
+        groups = {}
+        for prefix, values in compacted.items():
+            if len(prefix) == length and prefix.isdigit():
+                groups.setdefault(prefix[:-1], []).append(values)
+        for parent, values in groups.items():
+            if len(values) == 10 and values.count(values[0]) == 10:
+                for digit in '0123456789':
+                    del compacted[parent + digit]
+                compacted[parent] = values[0]
+    return compacted
+
+def _longest_match(entries, number):
+    """Value of the longest prefix of number in entries, with the prefix lengths probed by whoistel.search_number."""
+    for length in range(min(len(number), MAX_PREFIX_LENGTH), MIN_PREFIX_LENGTH - 1, -1):
+        values = entries.get(number[:length])
+        if values is not None:
+            return values
+    return None
+
+def verify_compaction(original, compacted):
+    """
+    Proves that two prefix tables give the same longest-prefix-match answer
+    for every number. Build the trie of all prefixes of both tables: the
+    answer for a number only depends on the deepest trie node on its path.
+    Numbers stopping at node t exist iff t lacks one of its ten children d,
+    and they all get the answer of t + d. Checking that representative for
+    every such node therefore covers the whole number space.
+
+    Raises:
+        BuildError: On the first representative whose answers differ.
+    """
+    prefixes = [p for p in original.keys() | compacted.keys() if p.isdigit() and len(p) <= MAX_PREFIX_LENGTH]
+    children = {}
+    for prefix in prefixes:
+        for length in range(len(prefix)):
+            children.setdefault(prefix[:length], set()).add(prefix[length])
+        children.setdefault(prefix, set())
+    for node, digits in children.items():
+        missing = next((d for d in '0123456789' if d not in digits), None)
+        if missing is None:
+            continue
+        number = node + missing
+        before = _longest_match(original, number)
+        after = _longest_match(compacted, number)
+        if before != after:
+            raise BuildError(f"Compaction changed the answer for numbers starting with {number}: {before} -> {after}.")
+
+def compact_ranges(conn):
+    """
+    Compacts both range tables (see compact_prefixes), verifies the result
+    and rewrites the tables (no commit). Records 'compacted' in BuildInfo so
+    incremental updates know the tables no longer hold ARCEP prefixes.
+
+    Returns:
+        dict: Per-table (rows before, rows after).
+    """
+    stats = {}
+    for table in RANGE_TABLES:
+        _, columns = DIFF_TABLES[table]
+        rows = conn.execute(f"SELECT PlageTel, {', '.join(columns)} FROM {table}").fetchall()
+        original = {row[0]: tuple(row[1:]) for row in rows}
+        compacted = compact_prefixes(original)
+        verify_compaction(original, compacted)
+        conn.execute(f"DELETE FROM {table}")
+        conn.executemany(f"INSERT INTO {table} (PlageTel, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))})",
+                         [(prefix, *values) for prefix, values in compacted.items()])
+        stats[table] = (len(original), len(compacted))
+        ratio = len(original) / len(compacted) if compacted else 1.0
+        logger.info(f"Compacted {table}: {len(original)} -> {len(compacted)} prefixes (ratio {ratio:.2f}x), verified.")
+    conn.execute("INSERT OR REPLACE INTO BuildInfo (Key, Value) VALUES ('compacted', '1')")
+    return stats
+
+def _build_info(conn, key):
+    """Value of a BuildInfo key, None if unset (or the database predates BuildInfo)."""
     try:
-        # Columns: code_commune_INSEE,nom_commune_postal,code_postal,libelle_acheminement,ligne_5,latitude,longitude,code_commune,article,nom_commune,nom_commune_complet,code_departement,nom_departement,code_region,nom_region
-        # Separator is comma.
-        df = pd.read_csv('arcep/communes-france.csv', sep=',', dtype=str)
+        row = conn.execute("SELECT Value FROM BuildInfo WHERE Key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
 
-        # Select and rename
-        # We need CodeInsee, NomCommune, CodePostal, NomDepartement, Latitude, Longitude
-        data = df[['code_commune_INSEE', 'nom_commune', 'code_postal', 'nom_departement', 'latitude', 'longitude', 'ligne_5']].copy()
-        data.columns = ['CodeInsee', 'NomCommune', 'CodePostal', 'NomDepartement', 'Latitude', 'Longitude', 'Ligne_5']
+def is_compacted(conn):
+    return _build_info(conn, 'compacted') == '1'
 
-        # Clean CodeInsee (pad to 5)
-        data['CodeInsee'] = data['CodeInsee'].str.zfill(5)
+def has_compact_schema(conn):
+    return _build_info(conn, 'schema') == 'compact'
+
+def _btree_bytes(conn, tables):
+    """Bytes used by the given tables and their indexes, None if SQLite lacks the dbstat virtual table."""
+    placeholders = ', '.join('?' * len(tables))
+    try:
+        return conn.execute(f'''
+            SELECT COALESCE(SUM(pgsize), 0) FROM dbstat
+            WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name IN ({placeholders}))
+        ''', tables).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
 
-        # Clean CodePostal (pad to 5)
-        data['CodePostal'] = data['CodePostal'].str.zfill(5)
+def convert_to_compact_schema(conn):
+    """
+    Replaces both range tables by PlagesCompactes, a WITHOUT ROWID table
+    keyed by (Longueur, Prefixe): the prefix length and its integer value
+    (the length keeps leading zeros). Operator codes are interned into the
+    CodesOperateurs dimension table. Prefixes that are not all digits can
+    never match a number and are dropped. whoistel.search_number reads
+    either schema with identical results (no commit).
+
+    Returns:
+        tuple: Approximate byte size of the range data before and after.
+    """
+    before = _btree_bytes(conn, RANGE_TABLES)
+    conn.execute('''
+    CREATE TABLE CodesOperateurs(
+        Id INTEGER PRIMARY KEY,
+        CodeOperateur TEXT UNIQUE
+    );
+    ''')
+    conn.execute('''
+    CREATE TABLE PlagesCompactes(
+        Longueur INTEGER,
+        Prefixe INTEGER,
+        Geographique INTEGER,
+        OperateurId INTEGER,
+        CodeInsee TEXT,
+        PRIMARY KEY (Longueur, Prefixe)
+    ) WITHOUT ROWID;
+    ''')
+    conn.execute('''
+        INSERT INTO CodesOperateurs (CodeOperateur)
+        SELECT DISTINCT CodeOperateur FROM (
+            SELECT CodeOperateur FROM PlagesNumerosGeographiques
+            UNION SELECT CodeOperateur FROM PlagesNumeros)
+        ORDER BY CodeOperateur
+    ''')
+    for table, geographic, insee in (('PlagesNumerosGeographiques', 1, 'r.CodeInsee'), ('PlagesNumeros', 0, 'NULL')):
+        conn.execute(f'''
+            INSERT INTO PlagesCompactes (Longueur, Prefixe, Geographique, OperateurId, CodeInsee)
+            SELECT length(r.PlageTel), CAST(r.PlageTel AS INTEGER), {geographic}, o.Id, {insee}
+            FROM {table} r LEFT JOIN CodesOperateurs o ON o.CodeOperateur IS r.CodeOperateur
+            WHERE r.PlageTel != '' AND r.PlageTel NOT GLOB '*[^0-9]*'
+        ''')
+        conn.execute(f"DROP TABLE {table}")
+    conn.execute("INSERT OR REPLACE INTO BuildInfo (Key, Value) VALUES ('schema', 'compact')")
 
-        # Handle Coordinates
-        # Convert to numeric, errors='coerce' to handle missing/invalid
-        data['Latitude'] = pd.to_numeric(data['Latitude'], errors='coerce')
-        data['Longitude'] = pd.to_numeric(data['Longitude'], errors='coerce')
+    after = _btree_bytes(conn, ('PlagesCompactes', 'CodesOperateurs'))
+    if before and after:
+        logger.info(f"Compact schema: range data {before / 1e3:.0f} kB -> {after / 1e3:.0f} kB "
+                    f"({before / after:.1f}x smaller).")
+    return before, after
 
-        # Prioritize main entry (empty Ligne_5)
-        # Sort by Ligne_5 (Ascending). NaN or Empty should be first?
-        # Pandas sort_values treats NaNs as last by default.
-        # But here they are empty strings or NaNs.
-        data['Ligne_5'] = data['Ligne_5'].fillna('')
-        # We want entries with empty Ligne_5 first.
-        # Sort values: '' comes before 'LOMME'.
-        data.sort_values(by='Ligne_5', ascending=True, inplace=True)
+def dataset_date_of(arcep_dir=ARCEP_DIR):
+    """Default dataset date: the modification date of majournums.csv (ISO format)."""
+    mtime = os.path.getmtime(os.path.join(arcep_dir, 'majournums.csv'))
+    return time.strftime('%Y-%m-%d', time.gmtime(mtime))
 
-        # Remove duplicates by CodeInsee, keeping the first (which is the main one due to sort)
-        data.drop_duplicates(subset=['CodeInsee'], inplace=True)
+def merge_range_history(conn, fresh, dataset_date):
+    """
+    Merges the current assignments of an import (open intervals in the
+    `fresh` table, e.g. 'staging.HistoriquePlages') into main.HistoriquePlages
+    (no commit). Open intervals whose operator changed or whose range
+    disappeared are closed, at the new Date_Attribution when it is plausible
+    and at dataset_date otherwise; new assignments are opened without
+    overlapping the intervals they follow.
 
-        # Drop Ligne_5 column as we don't store it
-        data.drop(columns=['Ligne_5'], inplace=True)
+    Returns:
+        tuple: Number of intervals closed and opened.
+    """
+    closed = conn.execute(f'''
+        UPDATE main.HistoriquePlages SET ValidTo = MAX(ValidFrom, COALESCE(
+            (SELECT f.ValidFrom FROM {fresh} f
+             WHERE f.PlageTel = HistoriquePlages.PlageTel
+               AND f.ValidFrom > HistoriquePlages.ValidFrom AND f.ValidFrom <= :date),
+            :date))
+        WHERE ValidTo = :open AND NOT EXISTS (
+            SELECT 1 FROM {fresh} f
+            WHERE f.PlageTel = HistoriquePlages.PlageTel AND f.CodeOperateur IS HistoriquePlages.CodeOperateur)
+    ''', {'date': dataset_date, 'open': HISTORY_OPEN_END}).rowcount
+    opened = conn.execute(f'''
+        INSERT INTO main.HistoriquePlages (PlageTel, CodeOperateur, ValidFrom, ValidTo)
+        SELECT f.PlageTel, f.CodeOperateur, MAX(f.ValidFrom, COALESCE(
+            (SELECT MAX(h.ValidTo) FROM main.HistoriquePlages h WHERE h.PlageTel = f.PlageTel), '')), :open
+        FROM {fresh} f
+        WHERE NOT EXISTS (
+            SELECT 1 FROM main.HistoriquePlages h WHERE h.PlageTel = f.PlageTel AND h.ValidTo = :open)
+    ''', {'open': HISTORY_OPEN_END}).rowcount
+    return closed, opened
 
-        data.to_sql('Communes', conn, if_exists='append', index=False)
-        logger.info(f"Imported {len(data)} communes.")
+def carry_range_history(conn, previous_db, dataset_date):
+    """
+    Carries the assignment history of the previous database into a fresh
+    build, whose HistoriquePlages only holds the current assignments.
 
-    except Exception as e:
-        logger.error(f"Error importing communes: {e}")
+    An unreadable previous database only restarts the history. Once the
+    fresh history has been replaced, errors are raised: bulk builds run
+    without a rollback journal, so build_database must drop the build
+    rather than publish a partial history.
+    """
+    if not os.path.exists(previous_db):
+        return
+    try:
+        conn.execute("ATTACH DATABASE ? AS previous", (previous_db,))
+    except sqlite3.DatabaseError as e:
+        logger.warning(f"Previous database {previous_db} is unreadable, history starts over: {e}")
+        return
+    try:
+        try:
+            if not conn.execute("SELECT 1 FROM previous.sqlite_master WHERE name = 'HistoriquePlages'").fetchone():
+                return
+            conn.execute("SELECT PlageTel, CodeOperateur, ValidFrom, ValidTo FROM previous.HistoriquePlages LIMIT 1")
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"Could not carry range history from {previous_db}: {e}")
+            return
+        conn.execute("CREATE TEMP TABLE fresh AS SELECT * FROM main.HistoriquePlages")
+        conn.execute("CREATE INDEX temp.idx_fresh ON fresh (PlageTel)")
+        conn.execute("DELETE FROM main.HistoriquePlages")
+        conn.execute('''
+            INSERT INTO main.HistoriquePlages (PlageTel, CodeOperateur, ValidFrom, ValidTo)
+            SELECT PlageTel, CodeOperateur, ValidFrom, ValidTo FROM previous.HistoriquePlages
+        ''')
+        closed, opened = merge_range_history(conn, 'temp.fresh', dataset_date)
+        conn.execute("DROP TABLE temp.fresh")
+        conn.commit()
+        logger.info(f"Range history carried over: {closed} assignments closed, {opened} opened.")
+    finally:
+        conn.execute("DETACH DATABASE previous")
 
-if __name__ == "__main__":
-    conn = setup_database()
-    import_operateurs(conn)
-    import_numeros(conn)
-    import_communes(conn)
+@contextmanager
+def _stage(name, timings, memory=None):
+    """Times a build stage into timings[name] and logs it; also profiles its memory with a memprofile.StageMemory."""
+    start = time.perf_counter()
+    try:
+        if memory is not None:
+            with memory.stage(name):
+                yield
+        else:
+            yield
+    finally:
+        timings[name] = time.perf_counter() - start
+        logger.info(f"Stage {name}: {timings[name]:.2f}s")
+
+def build_database(db_path=DB_FILE, arcep_dir=ARCEP_DIR, bulk=True, dataset_date=None, compact=False,
+                   compact_schema=False, memory=None):
+    """
+    Builds the database into a temporary file next to db_path, checks it and
+    publishes it. On failure the temporary file is removed and db_path is
+    left untouched. The range history of the current database is carried
+    over, with dataset_date (default: see dataset_date_of) closing the
+    assignments that changed. With compact, the range tables are compacted
+    (see compact_ranges); with compact_schema, they are stored in the
+    integer-keyed schema (see convert_to_compact_schema) and LookupNumeros,
+    which would undo the savings, is not built. With memory (a
+    memprofile.StageMemory), the memory use of each stage is recorded.
+
+    Returns:
+        dict: Elapsed seconds per build stage.
+    """
+    build_path = db_path + BUILD_SUFFIX
+    timings = {}
+    with _stage('setup', timings, memory):
+        conn = setup_database(build_path, bulk=bulk)
+    try:
+        with _stage('operators', timings, memory):
+            import_operateurs(conn, arcep_dir)
+        with _stage('numbers', timings, memory):
+            import_numeros(conn, arcep_dir)
+        with _stage('communes', timings, memory):
+            import_communes(conn, arcep_dir)
+        if compact:
+            with _stage('compaction', timings, memory):
+                compact_ranges(conn)
+        if bulk:
+            with _stage('indexes', timings, memory):
+                build_indexes(conn)
+        else:
+            conn.commit()
+        with _stage('history', timings, memory):
+            carry_range_history(conn, db_path, dataset_date or dataset_date_of(arcep_dir))
+        if compact_schema:
+            with _stage('compact schema', timings, memory):
+                convert_to_compact_schema(conn)
+                conn.commit()
+        else:
+            with _stage('lookup', timings, memory):
+                build_lookup_table(conn)
+                conn.commit()
+        with _stage('analyze+vacuum', timings, memory):
+            finalize_database(conn)
+        with _stage('checks', timings, memory):
+            check_database(conn, previous_db=db_path)
+    except BaseException:
+        conn.close()
+        os.remove(build_path)
+        raise
     conn.close()
-    logger.info("Database generation complete.")
+    with _stage('publish', timings, memory):
+        publish_database(build_path, db_path)
+
+    summary = ', '.join(f"{name} {elapsed:.2f}s" for name, elapsed in timings.items())
+    logger.info(f"Build timings: {summary} (total {sum(timings.values()):.2f}s)")
+    logger.info(f"Database size: {os.path.getsize(db_path) / 1e6:.1f} MB")
+    return timings
+
+# Tables compared by incremental updates: key column and value columns.
+DIFF_TABLES = {
+    'PlagesNumerosGeographiques': ('PlageTel', ('CodeOperateur', 'CodeInsee')),
+    'PlagesNumeros': ('PlageTel', ('CodeOperateur',)),
+    'PlagesOutreMer': ('PlageTel', ('Indicatif', 'CodeOperateur', 'Territoire')),
+    'Operateurs': ('CodeOperateur', ('NomOperateur', 'TypeOperateur', 'MailOperateur', 'SiteOperateur')),
+    'Communes': ('CodeInsee', ('NomCommune', 'CodePostal', 'NomDepartement', 'Latitude', 'Longitude')),
+}
+
+def diff_table(conn, table, staging='staging'):
+    """
+    Computes the keyed diff between main.<table> and <staging>.<table>.
+
+    Returns:
+        dict: 'added' and 'removed' lists of (key, values) and a 'changed'
+        list of (key, old_values, new_values).
+    """
+    key, columns = DIFF_TABLES[table]
+    cols = ', '.join(columns)
+    old_cols = ', '.join(f"o.{col}" for col in columns)
+    new_cols = ', '.join(f"n.{col}" for col in columns)
+    differs = ' OR '.join(f"o.{col} IS NOT n.{col}" for col in columns)
+    width = len(columns)
+
+    added = conn.execute(f'''
+        SELECT {key}, {cols} FROM {staging}.{table} n
+        WHERE NOT EXISTS (SELECT 1 FROM main.{table} o WHERE o.{key} = n.{key})
+    ''').fetchall()
+    removed = conn.execute(f'''
+        SELECT {key}, {cols} FROM main.{table} o
+        WHERE NOT EXISTS (SELECT 1 FROM {staging}.{table} n WHERE n.{key} = o.{key})
+    ''').fetchall()
+    changed = conn.execute(f'''
+        SELECT o.{key}, {old_cols}, {new_cols} FROM main.{table} o
+        JOIN {staging}.{table} n ON n.{key} = o.{key}
+        WHERE {differs}
+    ''').fetchall()
+    return {
+        'added': [(row[0], tuple(row[1:])) for row in added],
+        'removed': [(row[0], tuple(row[1:])) for row in removed],
+        'changed': [(row[0], tuple(row[1:1 + width]), tuple(row[1 + width:])) for row in changed],
+    }
+
+def apply_diff(conn, table, diff, dataset_date):
+    """Applies a diff from diff_table to main.<table> and records it in ChangeLog (no commit)."""
+    key, columns = DIFF_TABLES[table]
+    # Ranges that keep their prefix but change operator are reassignments.
+    changed_action = 'reassigned' if table in NUMBER_TABLES else 'changed'
+    placeholders = ', '.join('?' * (len(columns) + 1))
+    assignments = ', '.join(f"{col} = ?" for col in columns)
+
+    def as_json(values):
+        return json.dumps(dict(zip(columns, values)), ensure_ascii=False) if values is not None else None
+
+    conn.executemany(f"DELETE FROM main.{table} WHERE {key} = ?", [(k,) for k, _ in diff['removed']])
+    conn.executemany(f"INSERT INTO main.{table} ({key}, {', '.join(columns)}) VALUES ({placeholders})",
+                     [(k, *values) for k, values in diff['added']])
+    conn.executemany(f"UPDATE main.{table} SET {assignments} WHERE {key} = ?",
+                     [(*new, k) for k, _, new in diff['changed']])
+
+    log = [(dataset_date, table, 'removed', k, as_json(old), None) for k, old in diff['removed']]
+    log += [(dataset_date, table, 'added', k, None, as_json(new)) for k, new in diff['added']]
+    log += [(dataset_date, table, changed_action, k, as_json(old), as_json(new)) for k, old, new in diff['changed']]
+    conn.executemany('''
+        INSERT INTO ChangeLog (DatasetDate, TableName, Action, KeyValue, OldValue, NewValue)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', log)
+
+# Importer filling each diffed table (import_numeros fills every range table).
+TABLE_IMPORTERS = {
+    'PlagesNumerosGeographiques': import_numeros,
+    'PlagesNumeros': import_numeros,
+    'PlagesOutreMer': import_numeros,
+    'Operateurs': import_operateurs,
+    'Communes': import_communes,
+}
+
+def update_database(db_path=DB_FILE, arcep_dir=ARCEP_DIR, dataset_date=None, tables=None):
+    """
+    Incrementally updates an existing database: the CSV files are loaded into
+    a private staging database, diffed against the current tables, and only
+    the differences are applied, in a single transaction, with one ChangeLog
+    row per change. Falls back to a full build when db_path does not exist.
+
+    Args:
+        dataset_date (str): Date recorded in ChangeLog and closing changed
+            range assignments (defaults to the modification date of majournums.csv).
+        tables (iterable): Restricts the update to these DIFF_TABLES, the
+            other source files are not read (defaults to all tables).
+
+    Returns:
+        dict: Per-table counts of 'added', 'removed' and 'changed' rows.
+    """
+    if not os.path.exists(db_path):
+        logger.info(f"{db_path} does not exist, running a full build.")
+        build_database(db_path, arcep_dir, dataset_date=dataset_date)
+        return {}
+    with closing(sqlite3.connect(db_path)) as conn:
+        options = {'compact': is_compacted(conn), 'compact_schema': has_compact_schema(conn)}
+    if any(options.values()):
+        # Compacted tables no longer hold the ARCEP prefixes, so they cannot be diffed.
+        logger.info(f"{db_path} is compacted, running a full build with the same options.")
+        build_database(db_path, arcep_dir, dataset_date=dataset_date, **options)
+        return {}
+
+    dataset_date = dataset_date or dataset_date_of(arcep_dir)
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        create_metadata_tables(conn)
+        create_history_table(conn)
+        create_overseas_table(conn)
+        conn.commit()
+        # An empty filename attaches a private temporary database.
+        conn.execute("ATTACH DATABASE '' AS staging")
+        create_tables(conn, schema='staging')
+        tables = [table for table in DIFF_TABLES if tables is None or table in tables]
+        for importer in dict.fromkeys(TABLE_IMPORTERS[table] for table in tables):
+            importer(conn, arcep_dir, schema='staging')
+        conn.commit()
+
+        for table in tables:
+            current = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+            staged = conn.execute(f"SELECT COUNT(*) FROM staging.{table}").fetchone()[0]
+            if (staged == 0 and table in REQUIRED_TABLES) or staged < current * MIN_ROW_RATIO:
+                raise BuildError(f"Staged {table} has {staged} rows (currently {current}), refusing to apply.")
+
+        diffs = {table: diff_table(conn, table) for table in tables}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table, diff in diffs.items():
+                apply_diff(conn, table, diff, dataset_date)
+            if any(table in NUMBER_TABLES for table in tables):
+                merge_range_history(conn, 'staging.HistoriquePlages', dataset_date)
+            if any(diff[action] for diff in diffs.values() for action in diff):
+                build_lookup_table(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.execute("DETACH DATABASE staging")
+
+    summary = {table: {action: len(rows) for action, rows in diff.items()} for table, diff in diffs.items()}
+    logger.info(f"Incremental update ({dataset_date}) applied: {summary}")
+    return summary
+
+def main():
+    """CLI entry point for building (or rolling back) the database."""
+    parser = argparse.ArgumentParser(description="Génère la base whoistel à partir des fichiers ARCEP/INSEE.")
+    parser.add_argument('--db', default=DB_FILE, help="Chemin de la base à générer.")
+    parser.add_argument('--arcep-dir', default=ARCEP_DIR, help="Répertoire contenant les fichiers CSV.")
+    parser.add_argument('--rollback', action='store_true', help="Restaure la base précédente.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Applique uniquement les différences avec la base existante.")
+    parser.add_argument('--dataset-date', help="Date du jeu de données (AAAA-MM-JJ), enregistrée dans ChangeLog et l'historique des attributions.")
+    parser.add_argument('--compact', action='store_true',
+                        help="Fusionne les plages sœurs de même opérateur en préfixes plus courts (vérifié).")
+    parser.add_argument('--compact-schema', action='store_true',
+                        help="Stocke les plages avec des clés entières (préfixe, longueur) et des codes opérateurs internés.")
+    parser.add_argument('--no-bulk', dest='bulk', action='store_false',
+                        help="Désactive le chargement en masse (contraintes créées d'emblée, journalisation normale).")
+    parser.add_argument('--memprofile', type=int, nargs='?', const=memprofile.DEFAULT_TOP, metavar='N',
+                        help="Mesure la mémoire de chaque étape (RSS, pic, N principales allocations tracemalloc). Ralentit la génération.")
+    parser.add_argument('--memprofile-output', help="Enregistre le rapport mémoire en JSON.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        if args.rollback:
+            rollback_database(args.db)
+        elif args.incremental:
+            update_database(args.db, args.arcep_dir, args.dataset_date)
+        else:
+            memory = memprofile.StageMemory(args.memprofile) if args.memprofile is not None else None
+            try:
+                build_database(args.db, args.arcep_dir, bulk=args.bulk, dataset_date=args.dataset_date,
+                               compact=args.compact, compact_schema=args.compact_schema, memory=memory)
+            finally:
+                if memory is not None:
+                    memory.stop()
+            logger.info("Database generation complete.")
+            if memory is not None:
+                logger.info(f"Memory per stage:\n{memory.format()}")
+                if args.memprofile_output:
+                    with open(args.memprofile_output, 'w', encoding='utf-8') as f:
+                        json.dump(memory.stages, f, indent=2)
+    except BuildError as e:
+        logger.error(f"Database generation failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
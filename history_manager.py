@@ -3,10 +3,16 @@ Management of the SQLite-based history database for storing and
 retrieving community spam reports.
 """
 import sqlite3
+import argparse
+import heapq
 import logging
 import os
+import sys
+import time
+import zlib
 from contextlib import closing
 from functools import wraps
+from itertools import islice
 import whoistel
 
 def with_db_connection(func):
@@ -23,15 +29,50 @@ def with_db_connection(func):
     return wrapper
 
 DB_FILE = os.environ.get('HISTORY_DB_FILE', 'data/history.sqlite3')
+# Optional sharded layout: reports are routed to one of HISTORY_SHARDS files
+# by a stable hash of the phone number (0 or 1 keeps the single DB_FILE).
+HISTORY_SHARDS = int(os.environ.get('HISTORY_SHARDS', '0'))
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """Establishes and returns a connection to the SQLite history database."""
+class ShardedConnection:
+    """
+    Connections to every shard of a sharded history database. Accepted as
+    `conn` by all functions of this module in place of a single connection.
+    """
+    def __init__(self, shards):
+        self.shards = shards
+
+    def for_number(self, phone_number):
+        """Returns the connection of the shard owning a phone number."""
+        return self.shards[shard_index(phone_number, len(self.shards))]
+
+    def commit(self):
+        for shard in self.shards:
+            shard.commit()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+def shard_index(phone_number, shards):
+    """Stable shard number for a phone number (CRC32, identical across processes)."""
+    return zlib.crc32(phone_number.encode('utf-8')) % shards
+
+def shard_paths(shards):
+    """Returns the shard file paths for a layout of `shards` files, e.g. history.00-of-04.sqlite3."""
+    root, ext = os.path.splitext(DB_FILE)
+    return [f"{root}.{i:02d}-of-{shards:02d}{ext}" for i in range(shards)]
+
+def shard_connections(conn):
+    """Returns the list of single-file connections behind `conn`."""
+    return conn.shards if isinstance(conn, ShardedConnection) else [conn]
+
+def _connect(path):
     try:
-        db_dir = os.path.dirname(DB_FILE)
+        db_dir = os.path.dirname(path)
         if db_dir:
             os.makedirs(db_dir, exist_ok=True)
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(path)
         conn.row_factory = sqlite3.Row
     except sqlite3.Error as e:
         msg = f"Erreur lors de la connexion à la base de données d'historique: {e}"
@@ -40,33 +81,224 @@ def get_db_connection():
     else:
         return conn
 
-def init_history_db():
-    """Initializes the history database schema and indexes."""
+def get_db_connection(shards=None):
+    """
+    Establishes and returns a connection to the SQLite history database:
+    a sqlite3.Connection, or a ShardedConnection when more than one shard
+    is configured (HISTORY_SHARDS, or the `shards` argument).
+    """
+    shards = HISTORY_SHARDS if shards is None else shards
+    if shards <= 1:
+        return _connect(DB_FILE)
+
+    conns = []
+    try:
+        for path in shard_paths(shards):
+            conns.append(_connect(path))
+    except whoistel.DatabaseError:
+        for conn in conns:
+            conn.close()
+        raise
+    return ShardedConnection(conns)
+
+# Rolling leaderboard aggregate: per-hour report counts per number, folded into
+# per-day buckets once they are old enough that hour precision no longer matters.
+BUCKET_SECONDS = 3600
+DAY_SECONDS = 86400
+LEADERBOARD_WINDOWS = {
+    '24h': 24 * 3600,
+    '7d': 7 * DAY_SECONDS,
+    '30d': 30 * DAY_SECONDS,
+}
+DEFAULT_LEADERBOARD_WINDOW = '24h'
+DEFAULT_LEADERBOARD_LIMIT = 20
+# Hourly buckets older than this are compacted into daily buckets.
+BUCKET_COMPACT_AFTER = 2 * DAY_SECONDS
+# Buckets older than the largest window (plus one day of slack) are dropped.
+BUCKET_MAX_AGE = max(LEADERBOARD_WINDOWS.values()) + DAY_SECONDS
+BUCKET_COMPACT_INTERVAL = 3600
+LEADERBOARD_CACHE_TTL = float(os.environ.get('LEADERBOARD_CACHE_TTL', '30'))
+
+_leaderboard_cache = {}
+_last_compaction = 0.0
+
+@with_db_connection
+def init_history_db(*, lookup_conn=None, conn=None):
+    """
+    Initializes the history database schema and indexes. Tables added to an
+    existing database are backfilled from its reports; the spam heatmap
+    needs lookup_conn (an ARCEP database connection) for that.
+    """
+    if isinstance(conn, ShardedConnection):
+        for shard in conn.shards:
+            init_history_db(lookup_conn=lookup_conn, conn=shard)
+        return
+
     logger.info(f"Initializing history database schema in {DB_FILE}...")
 
-    with closing(get_db_connection()) as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone_number TEXT NOT NULL,
-                report_date DATE,
-                is_spam INTEGER DEFAULT 0,
-                comment TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # Add a composite index for faster spam count lookups
-        c.execute('''
-            CREATE INDEX IF NOT EXISTS idx_reports_phone_number_spam ON reports (phone_number, is_spam);
-        ''')
-        c.execute('''
-            CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports (created_at DESC);
-        ''')
-        conn.commit()
+    c = conn.cursor()
+    # Lets the retention job give pages back in small steps. Only takes effect
+    # on a new database; existing ones are converted by history_retention.py.
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_number TEXT NOT NULL,
+            report_date DATE,
+            is_spam INTEGER DEFAULT 0,
+            comment TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Add a composite index for faster spam count lookups
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reports_phone_number_spam ON reports (phone_number, is_spam);
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports (created_at DESC);
+    ''')
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='report_buckets'")
+    buckets_exist = c.fetchone() is not None
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='spam_heatmap'")
+    heatmap_exists = c.fetchone() is not None
+    # Keyed by bucket first so a window query is a single range scan.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_buckets (
+            bucket_start INTEGER NOT NULL,
+            phone_number TEXT NOT NULL,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            spam_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket_start, phone_number)
+        ) WITHOUT ROWID
+    ''')
+    # Spam heatmap: report counters keyed by the ARCEP block the number belongs to.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS spam_heatmap (
+            prefix TEXT NOT NULL,
+            code_operateur TEXT NOT NULL,
+            region TEXT NOT NULL,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            spam_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (prefix, code_operateur, region)
+        ) WITHOUT ROWID
+    ''')
+    # Per-number totals of reports moved out by the retention job, so spam
+    # counts stay correct once the rows themselves are archived.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS archived_totals (
+            phone_number TEXT PRIMARY KEY,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            spam_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+    if not buckets_exist:
+        rebuild_report_buckets(conn=conn)
+    if not heatmap_exists and c.execute("SELECT 1 FROM reports LIMIT 1").fetchone():
+        if lookup_conn is not None:
+            rebuild_heatmap(lookup_conn, conn=conn)
+        else:
+            logger.warning("Spam heatmap created empty: run 'history_manager.py rebuild-heatmap' to backfill it.")
+
+@with_db_connection
+def rebuild_report_buckets(now=None, *, conn=None):
+    """
+    Recomputes the leaderboard buckets from the reports table.
+    Only reports within BUCKET_MAX_AGE are aggregated.
+    """
+    if isinstance(conn, ShardedConnection):
+        for shard in conn.shards:
+            rebuild_report_buckets(now, conn=shard)
+        return
+
+    now = time.time() if now is None else now
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - BUCKET_MAX_AGE))
+    c = conn.cursor()
+    c.execute("DELETE FROM report_buckets")
+    c.execute('''
+        INSERT INTO report_buckets (bucket_start, phone_number, report_count, spam_count)
+        SELECT CAST(strftime('%s', created_at) AS INTEGER) / ? * ?,
+               phone_number, COUNT(*), SUM(is_spam = 1)
+        FROM reports
+        WHERE created_at >= ?
+        GROUP BY 1, 2
+    ''', (BUCKET_SECONDS, BUCKET_SECONDS, cutoff))
+    conn.commit()
+    compact_report_buckets(now, conn=conn)
+
+def _record_bucket(conn, phone_number, is_spam, now):
+    """Increments the hourly leaderboard bucket for a freshly inserted report."""
+    bucket_start = int(now) // BUCKET_SECONDS * BUCKET_SECONDS
+    conn.execute('''
+        INSERT INTO report_buckets (bucket_start, phone_number, report_count, spam_count)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT (bucket_start, phone_number) DO UPDATE SET
+            report_count = report_count + 1,
+            spam_count = spam_count + excluded.spam_count
+    ''', (bucket_start, phone_number, 1 if is_spam else 0))
 
 @with_db_connection
-def add_report(phone_number, report_date, is_spam, comment, *, conn=None):
+def compact_report_buckets(now=None, *, conn=None):
+    """
+    Folds hourly buckets older than BUCKET_COMPACT_AFTER into daily buckets
+    and drops buckets older than BUCKET_MAX_AGE.
+    """
+    global _last_compaction
+    now = time.time() if now is None else now
+    if isinstance(conn, ShardedConnection):
+        for shard in conn.shards:
+            compact_report_buckets(now, conn=shard)
+        return
+
+    # Only fold complete days so a day never holds a mix of hourly and daily rows.
+    fold_before = int(now - BUCKET_COMPACT_AFTER) // DAY_SECONDS * DAY_SECONDS
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO report_buckets (bucket_start, phone_number, report_count, spam_count)
+        SELECT bucket_start / ? * ?, phone_number, SUM(report_count), SUM(spam_count)
+        FROM report_buckets
+        WHERE bucket_start < ? AND bucket_start % ? != 0
+        GROUP BY 1, 2
+        ON CONFLICT (bucket_start, phone_number) DO UPDATE SET
+            report_count = report_count + excluded.report_count,
+            spam_count = spam_count + excluded.spam_count
+    ''', (DAY_SECONDS, DAY_SECONDS, fold_before, DAY_SECONDS))
+    c.execute('''
+        DELETE FROM report_buckets WHERE bucket_start < ? AND bucket_start % ? != 0
+    ''', (fold_before, DAY_SECONDS))
+    c.execute("DELETE FROM report_buckets WHERE bucket_start < ?", (int(now - BUCKET_MAX_AGE),))
+    conn.commit()
+    _last_compaction = time.monotonic()
+
+def heatmap_key(phone_number, lookup):
+    """
+    Returns the (prefix, code_operateur, region) heatmap key for a number,
+    given its whoistel.search_number result. Unknown numbers map to empty strings.
+    """
+    if not lookup:
+        return ('', '', '')
+    region = ''
+    if lookup.get('territoire'):
+        # Overseas numbers: the territory stands in for the region
+        region = lookup['territoire']
+    elif lookup['type'] == 'Geographique':
+        region = whoistel.REGION_MAP.get(phone_number[:2], '')
+    return (lookup['prefix'], lookup['code_operateur'] or '', region)
+
+def _record_heatmap(conn, key, report_count, spam_count):
+    """Increments the heatmap counters for a key."""
+    conn.execute('''
+        INSERT INTO spam_heatmap (prefix, code_operateur, region, report_count, spam_count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (prefix, code_operateur, region) DO UPDATE SET
+            report_count = report_count + excluded.report_count,
+            spam_count = spam_count + excluded.spam_count
+    ''', (*key, report_count, spam_count))
+
+@with_db_connection
+def add_report(phone_number, report_date, is_spam, comment, *, lookup_conn=None, conn=None):
     """
     Adds a new spam report to the history database.
     
@@ -75,23 +307,39 @@ def add_report(phone_number, report_date, is_spam, comment, *, conn=None):
         report_date (str): Optional date of incident (AAAA-MM-JJ).
         is_spam (bool): Whether the report marks the number as spam.
         comment (str): Optional description.
+        lookup_conn (sqlite3.Connection): Optional ARCEP database connection used
+            to enrich the report for the spam heatmap.
         conn (sqlite3.Connection): Optional existing connection.
     """
-    c = conn.cursor()
+    # Looked up before the INSERT opens the write transaction on the history database
+    key = heatmap_key(phone_number, whoistel.search_number(lookup_conn, phone_number)) if lookup_conn is not None else None
+    target = conn.for_number(phone_number) if isinstance(conn, ShardedConnection) else conn
+    c = target.cursor()
     c.execute('''
         INSERT INTO reports (phone_number, report_date, is_spam, comment)
         VALUES (?, ?, ?, ?)
     ''', (phone_number, report_date, 1 if is_spam else 0, comment))
-    conn.commit()
+    _record_bucket(target, phone_number, is_spam, time.time())
+    if key is not None:
+        _record_heatmap(target, key, 1, 1 if is_spam else 0)
+    target.commit()
+
+    if time.monotonic() - _last_compaction > BUCKET_COMPACT_INTERVAL:
+        compact_report_buckets(conn=conn)
 
 @with_db_connection
 def get_spam_count(phone_number, *, conn=None):
-    """Returns the total number of spam reports for a given phone number."""
+    """
+    Returns the total number of spam reports for a given phone number,
+    including reports already moved to the archive.
+    """
+    if isinstance(conn, ShardedConnection):
+        conn = conn.for_number(phone_number)
     c = conn.cursor()
     c.execute('''
-        SELECT COUNT(*) FROM reports
-        WHERE phone_number = ? AND is_spam = 1
-    ''', (phone_number,))
+        SELECT (SELECT COUNT(*) FROM reports WHERE phone_number = ? AND is_spam = 1)
+             + COALESCE((SELECT spam_count FROM archived_totals WHERE phone_number = ?), 0)
+    ''', (phone_number, phone_number))
     return c.fetchone()[0]
 
 DEFAULT_RECENT_REPORTS_LIMIT = 50
@@ -99,8 +347,14 @@ DEFAULT_RECENT_REPORTS_LIMIT = 50
 @with_db_connection
 def get_recent_reports(limit=DEFAULT_RECENT_REPORTS_LIMIT, *, conn=None):
     """
-    Retrieves the most recent reports.
+    Retrieves the most recent reports. With a sharded layout, the per-shard
+    lists are k-way merged.
     """
+    if isinstance(conn, ShardedConnection):
+        per_shard = [get_recent_reports(limit, conn=shard) for shard in conn.shards]
+        merged = heapq.merge(*per_shard, key=lambda r: (r['created_at'] or '', r['id']), reverse=True)
+        return list(islice(merged, limit))
+
     c = conn.cursor()
     c.execute('''
         SELECT * FROM reports
@@ -109,3 +363,237 @@ def get_recent_reports(limit=DEFAULT_RECENT_REPORTS_LIMIT, *, conn=None):
     ''', (limit,))
     rows = c.fetchall()
     return [dict(row) for row in rows]
+
+@with_db_connection
+def get_top_reported(window=DEFAULT_LEADERBOARD_WINDOW, limit=DEFAULT_LEADERBOARD_LIMIT, now=None, *, conn=None):
+    """
+    Returns the most reported numbers over a rolling window ('24h', '7d' or '30d').
+    Reads only the leaderboard buckets overlapping the window, so its start is
+    rounded down to the bucket it falls in (a day once buckets are folded).
+    Results are cached per database file for LEADERBOARD_CACHE_TTL seconds
+    unless an explicit `now` is given.
+
+    Returns:
+        list[dict]: Entries with 'phone_number', 'report_count' and 'spam_count'.
+    """
+    if window not in LEADERBOARD_WINDOWS:
+        raise ValueError(f"Unknown leaderboard window: {window}")
+
+    use_cache = now is None and LEADERBOARD_CACHE_TTL > 0
+    if use_cache:
+        files = _database_files(conn)
+        cache_key = (files, window, limit)
+        # In-memory databases have no file to tell them apart
+        use_cache = all(files)
+    if use_cache:
+        cached = _leaderboard_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+    now = time.time() if now is None else now
+    since = int(now) - LEADERBOARD_WINDOWS[window]
+    bucket = DAY_SECONDS if since < now - BUCKET_COMPACT_AFTER else BUCKET_SECONDS
+    since = since // bucket * bucket
+    per_shard = [_query_top_reported(shard, since, limit) for shard in shard_connections(conn)]
+    # Each number lives in a single shard, so merging the per-shard tops is exact.
+    top = list(islice(heapq.merge(*per_shard, key=_leaderboard_order), limit))
+
+    if use_cache:
+        _leaderboard_cache[cache_key] = (time.monotonic() + LEADERBOARD_CACHE_TTL, top)
+    return top
+
+def _database_files(conn):
+    """Paths of the database files behind `conn`, one per shard ('' when in memory)."""
+    return tuple(shard.execute("PRAGMA database_list").fetchone()[2] for shard in shard_connections(conn))
+
+def _leaderboard_order(entry):
+    return (-entry['report_count'], -entry['spam_count'], entry['phone_number'])
+
+def _query_top_reported(conn, since, limit):
+    c = conn.cursor()
+    c.execute('''
+        SELECT phone_number, SUM(report_count) AS report_count, SUM(spam_count) AS spam_count
+        FROM report_buckets
+        WHERE bucket_start >= ?
+        GROUP BY phone_number
+        ORDER BY report_count DESC, spam_count DESC, phone_number
+        LIMIT ?
+    ''', (since, limit))
+    return [dict(row) for row in c.fetchall()]
+
+def clear_leaderboard_cache():
+    """Drops all cached leaderboard results."""
+    _leaderboard_cache.clear()
+
+def leaderboard_cache():
+    """The cached leaderboard results, keyed by (database files, window, limit); read-only, for memory reports."""
+    return _leaderboard_cache
+
+HEATMAP_GROUPINGS = {
+    'prefix': ('prefix', 'code_operateur', 'region'),
+    'operator': ('code_operateur',),
+    'region': ('region',),
+}
+DEFAULT_HEATMAP_LIMIT = 50
+
+@with_db_connection
+def get_heatmap(by='prefix', limit=DEFAULT_HEATMAP_LIMIT, *, conn=None):
+    """
+    Returns spam heatmap counters grouped by 'prefix', 'operator' or 'region',
+    ordered by spam count.
+    """
+    if by not in HEATMAP_GROUPINGS:
+        raise ValueError(f"Unknown heatmap grouping: {by}")
+    if not isinstance(conn, ShardedConnection):
+        return _query_heatmap(conn, by, limit)
+
+    # Heatmap keys span shards: sum the complete per-shard groupings, then rank.
+    totals = {}
+    for shard in conn.shards:
+        for entry in _query_heatmap(shard, by, -1):
+            key = tuple(entry[col] for col in HEATMAP_GROUPINGS[by])
+            merged = totals.setdefault(key, dict(entry, report_count=0, spam_count=0))
+            merged['report_count'] += entry['report_count']
+            merged['spam_count'] += entry['spam_count']
+    ranked = sorted(totals.values(), key=lambda e: (-e['spam_count'], -e['report_count']))
+    return ranked[:limit]
+
+def _query_heatmap(conn, by, limit):
+    columns = ', '.join(HEATMAP_GROUPINGS[by])
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT {columns}, SUM(report_count) AS report_count, SUM(spam_count) AS spam_count
+        FROM spam_heatmap
+        GROUP BY {columns}
+        ORDER BY spam_count DESC, report_count DESC
+        LIMIT ?
+    ''', (limit,))
+    return [dict(row) for row in c.fetchall()]
+
+@with_db_connection
+def rebuild_heatmap(lookup_conn, *, conn=None):
+    """
+    Re-enriches every stored report (including archived totals) against the
+    current ARCEP database and rewrites the heatmap counters. Each distinct number is looked up once.
+    Meant to run after an ARCEP refresh.
+
+    Returns:
+        int: Number of distinct phone numbers enriched.
+    """
+    if isinstance(conn, ShardedConnection):
+        return sum(rebuild_heatmap(lookup_conn, conn=shard) for shard in conn.shards)
+
+    counters = {}
+    c = conn.cursor()
+    c.execute('''
+        SELECT phone_number, SUM(report_count), SUM(spam_count) FROM (
+            SELECT phone_number, COUNT(*) AS report_count, SUM(is_spam = 1) AS spam_count
+            FROM reports GROUP BY phone_number
+            UNION ALL
+            SELECT phone_number, report_count, spam_count FROM archived_totals
+        ) GROUP BY phone_number
+    ''')
+    rows = c.fetchall()
+    for phone_number, report_count, spam_count in rows:
+        key = heatmap_key(phone_number, whoistel.search_number(lookup_conn, phone_number))
+        totals = counters.setdefault(key, [0, 0])
+        totals[0] += report_count
+        totals[1] += spam_count or 0
+
+    c.execute("DELETE FROM spam_heatmap")
+    c.executemany('''
+        INSERT INTO spam_heatmap (prefix, code_operateur, region, report_count, spam_count)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(*key, totals[0], totals[1]) for key, totals in counters.items()])
+    conn.commit()
+    logger.info(f"Heatmap rebuilt from {len(rows)} distinct numbers ({len(counters)} keys).")
+    return len(rows)
+
+RESHARD_BATCH_SIZE = 1000
+
+def reshard(target_shards, source_shards=None):
+    """
+    Copies the history database from its current layout (`source_shards`,
+    HISTORY_SHARDS by default) into a layout of `target_shards` files.
+    Reports, archived totals and leaderboard buckets are routed by phone
+    number; heatmap counters (keyed by prefix) are summed into the first shard.
+    The source files are left untouched.
+
+    Returns:
+        int: Number of reports copied.
+    """
+    source_shards = HISTORY_SHARDS if source_shards is None else source_shards
+    if max(source_shards, 1) == max(target_shards, 1):
+        raise ValueError("Source and target layouts are identical.")
+
+    copied = 0
+    with closing(get_db_connection(source_shards)) as source, closing(get_db_connection(target_shards)) as target:
+        init_history_db(conn=source)
+        init_history_db(conn=target)
+        targets = shard_connections(target)
+        if any(t.execute("SELECT 1 FROM reports LIMIT 1").fetchone() for t in targets):
+            raise ValueError("Target layout already contains reports.")
+
+        def route(phone_number):
+            return targets[shard_index(phone_number, len(targets))] if len(targets) > 1 else targets[0]
+
+        for shard in shard_connections(source):
+            c = shard.execute('''
+                SELECT phone_number, report_date, is_spam, comment, created_at FROM reports ORDER BY id
+            ''')
+            while rows := c.fetchmany(RESHARD_BATCH_SIZE):
+                for row in rows:
+                    route(row['phone_number']).execute('''
+                        INSERT INTO reports (phone_number, report_date, is_spam, comment, created_at)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', tuple(row))
+                copied += len(rows)
+
+            for row in shard.execute("SELECT * FROM archived_totals"):
+                route(row['phone_number']).execute('''
+                    INSERT INTO archived_totals (phone_number, report_count, spam_count) VALUES (?, ?, ?)
+                    ON CONFLICT (phone_number) DO UPDATE SET
+                        report_count = report_count + excluded.report_count,
+                        spam_count = spam_count + excluded.spam_count
+                ''', tuple(row))
+            for row in shard.execute("SELECT * FROM report_buckets"):
+                route(row['phone_number']).execute('''
+                    INSERT INTO report_buckets (bucket_start, phone_number, report_count, spam_count)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (bucket_start, phone_number) DO UPDATE SET
+                        report_count = report_count + excluded.report_count,
+                        spam_count = spam_count + excluded.spam_count
+                ''', tuple(row))
+            for row in shard.execute("SELECT * FROM spam_heatmap"):
+                _record_heatmap(targets[0], tuple(row)[:3], row['report_count'], row['spam_count'])
+        target.commit()
+
+    logger.info(f"Resharded {copied} reports from {max(source_shards, 1)} to {max(target_shards, 1)} file(s).")
+    return copied
+
+def main():
+    """CLI entry point for history database maintenance tasks."""
+    parser = argparse.ArgumentParser(description="Maintenance de la base d'historique des signalements.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild-heatmap', help="Ré-enrichit tous les signalements avec la base ARCEP actuelle.")
+    reshard_parser = subparsers.add_parser('reshard', help="Copie l'historique vers une disposition à N fichiers.")
+    reshard_parser.add_argument('--shards', type=int, required=True, help="Nombre de fichiers cibles (1 = fichier unique).")
+    reshard_parser.add_argument('--from-shards', type=int, default=None,
+                                help="Disposition source (défaut: HISTORY_SHARDS).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        if args.command == 'reshard':
+            reshard(args.shards, args.from_shards)
+            return
+        with closing(whoistel.setup_db_connection()) as lookup_conn:
+            init_history_db(lookup_conn=lookup_conn)
+            if args.command == 'rebuild-heatmap':
+                rebuild_heatmap(lookup_conn)
+    except (whoistel.DatabaseError, ValueError) as e:
+        print(f"{e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Retention policy for the history database: moves old reports into monthly
+archives, keeps the per-number summary counters correct and gives the freed
+pages back to the filesystem with small incremental vacuum steps.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing, contextmanager
+import history_manager
+import whoistel
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent jobs are only serialised by BEGIN IMMEDIATE
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', '0'))
+ARCHIVE_DIR = os.environ.get('HISTORY_ARCHIVE_DIR', 'data/archive')
+ARCHIVE_FORMATS = ('sqlite', 'jsonl')
+DEFAULT_ARCHIVE_FORMAT = os.environ.get('HISTORY_ARCHIVE_FORMAT', 'sqlite')
+# Rows moved per write transaction; keeps the writer lock short.
+DEFAULT_BATCH_SIZE = 500
+# Pages released per incremental vacuum step.
+DEFAULT_VACUUM_PAGES = 256
+# Pause between batches/steps so request threads get the lock in between.
+DEFAULT_PAUSE = 0.05
+DEFAULT_INTERVAL = 6 * 3600
+
+REPORT_COLUMNS = ('id', 'phone_number', 'report_date', 'is_spam', 'comment', 'created_at')
+# JSONL batches are staged as <archive>.pending until their rows are deleted, then
+# renamed <archive>.append-<archive size> while they are appended.
+PENDING_SUFFIX = '.pending'
+APPEND_SUFFIX = '.append-'
+
+def _archive_sqlite(archive_dir, month, rows):
+    """Appends rows to the monthly SQLite archive (reports-YYYY-MM.sqlite3)."""
+    path = os.path.join(archive_dir, f"reports-{month}.sqlite3")
+    with closing(sqlite3.connect(path)) as archive:
+        # Ids are only unique within a shard, but a number always lives in the
+        # same shard, so (phone_number, id) identifies a report across shards.
+        archive.execute('''
+            CREATE TABLE IF NOT EXISTS reports (
+                id INTEGER NOT NULL,
+                phone_number TEXT NOT NULL,
+                report_date DATE,
+                is_spam INTEGER DEFAULT 0,
+                comment TEXT,
+                created_at TIMESTAMP,
+                PRIMARY KEY (phone_number, id)
+            )
+        ''')
+        # Ids are kept, so replaying a batch after a crash does not duplicate rows.
+        archive.executemany(
+            f"INSERT OR IGNORE INTO reports ({', '.join(REPORT_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            [tuple(row[col] for col in REPORT_COLUMNS) for row in rows])
+        archive.commit()
+
+def _archive_jsonl(archive_dir, month, rows):
+    """
+    Stages rows for the monthly compressed JSONL archive
+    (reports-YYYY-MM.jsonl.gz) in a .pending file, which publish_jsonl
+    appends to the archive once the batch is committed. A gzip file may
+    hold several members, so the archive stays a single readable file.
+
+    Returns:
+        str: Path of the staged file.
+    """
+    pending = os.path.join(archive_dir, f"reports-{month}.jsonl.gz{PENDING_SUFFIX}")
+    data = gzip.compress(''.join(json.dumps({col: row[col] for col in REPORT_COLUMNS}, ensure_ascii=False) + '\n'
+                                 for row in rows).encode('utf-8'))
+    # 'x': a batch left over by an interrupted run must be recovered first (recover_jsonl).
+    # An incomplete file is discarded by recover_jsonl, as its batch cannot have committed.
+    with open(pending, 'xb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return pending
+
+def publish_jsonl(pending):
+    """
+    Appends a staged batch to its archive. The archive size is recorded in
+    the staged file's name first, so an interrupted append is redone from
+    that size instead of duplicating or corrupting lines.
+    """
+    archive = pending[:-len(PENDING_SUFFIX)]
+    size = os.path.getsize(archive) if os.path.exists(archive) else 0
+    claimed = f"{archive}{APPEND_SUFFIX}{size}"
+    os.replace(pending, claimed)
+    _append_claimed(claimed)
+
+def _append_claimed(claimed):
+    archive, size = claimed.rsplit(APPEND_SUFFIX, 1)
+    with open(archive, 'a+b') as out, open(claimed, 'rb') as staged:
+        out.truncate(int(size))
+        while block := staged.read(1 << 20):
+            out.write(block)
+        out.flush()
+        os.fsync(out.fileno())
+    os.remove(claimed)
+
+def _staged_keys(pending):
+    """(phone_number, id) of the rows of a staged batch, None if the file is incomplete."""
+    try:
+        with gzip.open(pending, 'rt', encoding='utf-8') as f:
+            return [(row['phone_number'], row['id']) for row in map(json.loads, f)]
+    except (OSError, EOFError, ValueError, KeyError):
+        return None
+
+def recover_jsonl(conn, archive_dir):
+    """
+    Finishes the JSONL batches of an interrupted run: a batch whose rows
+    were deleted from the history database is appended to its archive, any
+    other is discarded (its rows are still in `reports` and will be staged
+    again).
+
+    Returns:
+        int: Number of batches appended.
+    """
+    appended = 0
+    for name in sorted(os.listdir(archive_dir)):
+        path = os.path.join(archive_dir, name)
+        if APPEND_SUFFIX in name:
+            _append_claimed(path)
+            appended += 1
+        elif name.endswith(PENDING_SUFFIX):
+            keys = _staged_keys(path)
+            committed = bool(keys) and not any(
+                shard.execute("SELECT 1 FROM reports WHERE phone_number = ? AND id = ?", key).fetchone()
+                for shard in history_manager.shard_connections(conn) for key in keys)
+            if committed:
+                publish_jsonl(path)
+                appended += 1
+            else:
+                os.remove(path)
+    return appended
+
+ARCHIVE_WRITERS = {
+    'sqlite': _archive_sqlite,
+    'jsonl': _archive_jsonl,
+}
+
+def archive_batch(conn, cutoff, archive_dir, archive_format=DEFAULT_ARCHIVE_FORMAT, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Moves at most `batch_size` reports created before `cutoff` into the archive,
+    in a single write transaction. JSONL lines are only appended once the
+    transaction has committed, so a failed batch is not archived twice.
+
+    Args:
+        conn (sqlite3.Connection): History database connection.
+        cutoff (str): UTC timestamp ('YYYY-MM-DD HH:MM:SS'); older reports are archived.
+        archive_dir (str): Directory holding the monthly archives.
+        archive_format (str): 'sqlite' or 'jsonl'.
+        batch_size (int): Maximum number of rows to move.
+
+    Returns:
+        int: Number of reports moved.
+    """
+    writer = ARCHIVE_WRITERS[archive_format]
+    staged = []
+    # IMMEDIATE takes the write lock up front, so concurrent jobs never archive the same rows twice.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute('''
+            SELECT * FROM reports WHERE created_at < ? ORDER BY created_at, id LIMIT ?
+        ''', (cutoff, batch_size)).fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+
+        by_month = {}
+        totals = {}
+        for row in rows:
+            month = (row['created_at'] or '')[:7] or 'unknown'
+            by_month.setdefault(month, []).append(row)
+            counts = totals.setdefault(row['phone_number'], [0, 0])
+            counts[0] += 1
+            counts[1] += 1 if row['is_spam'] else 0
+
+        for month, month_rows in by_month.items():
+            staged.append(writer(archive_dir, month, month_rows))
+
+        conn.executemany('''
+            INSERT INTO archived_totals (phone_number, report_count, spam_count)
+            VALUES (?, ?, ?)
+            ON CONFLICT (phone_number) DO UPDATE SET
+                report_count = report_count + excluded.report_count,
+                spam_count = spam_count + excluded.spam_count
+        ''', [(number, counts[0], counts[1]) for number, counts in totals.items()])
+        conn.executemany("DELETE FROM reports WHERE id = ?", [(row['id'],) for row in rows])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        for path in filter(None, staged):
+            os.remove(path)
+        raise
+    for path in filter(None, staged):
+        publish_jsonl(path)
+    return len(rows)
+
+def incremental_vacuum(conn, pages=DEFAULT_VACUUM_PAGES, pause=DEFAULT_PAUSE, max_steps=None):
+    """
+    Releases free pages in steps of `pages`, pausing between steps.
+    Does nothing unless the database uses auto_vacuum=INCREMENTAL.
+
+    Returns:
+        int: Number of steps run.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logger.info("auto_vacuum n'est pas INCREMENTAL: utilisez 'history_retention.py enable-incremental-vacuum'.")
+        return 0
+
+    steps = 0
+    while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+        if max_steps is not None and steps >= max_steps:
+            break
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+        conn.commit()
+        steps += 1
+        time.sleep(pause)
+    return steps
+
+def enable_incremental_vacuum(conn):
+    """Switches an existing database to auto_vacuum=INCREMENTAL (runs one full VACUUM)."""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+@contextmanager
+def job_lock(archive_dir):
+    """
+    Exclusive lock on the archive directory (a sibling <archive_dir>.lock
+    file), held for a whole retention run. Yields False, without waiting,
+    when another process or thread holds it.
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(os.path.normpath(archive_dir) + '.lock', 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+@history_manager.with_db_connection
+def run_retention(days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR, archive_format=DEFAULT_ARCHIVE_FORMAT,
+                  batch_size=DEFAULT_BATCH_SIZE, vacuum_pages=DEFAULT_VACUUM_PAGES,
+                  pause=DEFAULT_PAUSE, now=None, *, conn=None):
+    """
+    Archives every report older than `days` days in small batches, then
+    runs incremental vacuum. One run at a time per archive directory (see
+    job_lock): a run that finds the lock taken returns 0 at once.
+
+    Returns:
+        int: Number of reports archived.
+    """
+    if days <= 0:
+        raise ValueError("Retention must be a positive number of days.")
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format: {archive_format}")
+
+    now = time.time() if now is None else now
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - days * history_manager.DAY_SECONDS))
+    os.makedirs(archive_dir, exist_ok=True)
+
+    archived = 0
+    with job_lock(archive_dir) as acquired:
+        if not acquired:
+            logger.info("Retention: another process is running the job, skipped.")
+            return 0
+        recover_jsonl(conn, archive_dir)
+        for shard in history_manager.shard_connections(conn):
+            while moved := archive_batch(shard, cutoff, archive_dir, archive_format, batch_size):
+                archived += moved
+                time.sleep(pause)
+            incremental_vacuum(shard, vacuum_pages, pause)
+
+    logger.info(f"Retention: {archived} signalements antérieurs à {cutoff} archivés ({archive_format}).")
+    return archived
+
+def start_retention_thread(days=RETENTION_DAYS, interval=DEFAULT_INTERVAL, **kwargs):
+    """
+    Starts a daemon thread that runs the retention job every `interval` seconds.
+    The job yields between batches, so it stays in the background of request handling.
+    Every web worker starts one, but job_lock lets a single run proceed at a time
+    across the deployment; the others skip that round.
+
+    Returns:
+        threading.Thread: The started thread.
+    """
+    def loop():
+        while True:
+            try:
+                run_retention(days, **kwargs)
+            except (whoistel.DatabaseError, sqlite3.Error, OSError):
+                logger.exception("Retention job failed.")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='history-retention', daemon=True)
+    thread.start()
+    return thread
+
+def main():
+    """CLI entry point for the history retention job."""
+    parser = argparse.ArgumentParser(description="Archivage des anciens signalements et vacuum incrémental.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    archive = subparsers.add_parser('archive', help="Archive les signalements plus anciens que --days jours.")
+    archive.add_argument('--days', type=int, default=RETENTION_DAYS or None, required=not RETENTION_DAYS,
+                         help="Âge maximal des signalements conservés (défaut: HISTORY_RETENTION_DAYS).")
+    archive.add_argument('--format', choices=ARCHIVE_FORMATS, default=DEFAULT_ARCHIVE_FORMAT)
+    archive.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    archive.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    archive.add_argument('--vacuum-pages', type=int, default=DEFAULT_VACUUM_PAGES)
+
+    subparsers.add_parser('enable-incremental-vacuum',
+                          help="Convertit une base existante en auto_vacuum=INCREMENTAL (VACUUM complet, bloquant).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        history_manager.init_history_db()
+        if args.command == 'archive':
+            run_retention(args.days, args.archive_dir, args.format, args.batch_size, args.vacuum_pages)
+        else:
+            with closing(history_manager.get_db_connection()) as conn:
+                for shard in history_manager.shard_connections(conn):
+                    enable_incremental_vacuum(shard)
+    except (whoistel.DatabaseError, ValueError) as e:
+        print(f"{e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+#-*- encoding: Utf-8 -*-
+"""
+HTTP load generator for the web application, to size deployments (sync or
+gthread workers, number of workers) on measurements.
+
+Virtual users drive a mix of /view/<number> lookups, /report POSTs and
+/history reads. The numbers looked up follow a Zipf distribution, so a few
+hot numbers get most of the traffic, like in production. Each user keeps
+its session cookie and the CSRF token of the report form, and fetches a
+new token when a report is refused with 400.
+
+Targets:
+- in-process (default): create_app() called through the WSGI test client,
+  with reports written to a temporary history database;
+- --serve PORT: the same application served by werkzeug's threaded server
+  on a local port;
+- --url: any running instance (gunicorn...), which keeps its own
+  configuration (report guard limits included).
+
+Load:
+- closed loop (default): --concurrency users send requests back to back;
+- fixed rate: --rate requests per second, spread over the users. Latencies
+  are measured from the scheduled start, so a saturated server shows up
+  as growing latencies rather than as a lower request rate.
+
+    python3 loadtest.py --db whoistel.sqlite3 --concurrency 8 --duration 30
+    python3 loadtest.py --url http://127.0.0.1:8000 --db whoistel.sqlite3 --rate 200 --output run.json
+"""
+import argparse
+import bisect
+import http.client
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import closing, contextmanager
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from benchstats import percentile, quiet_logging
+import generatedb
+import history_manager
+import whoistel
+
+DEFAULT_MIX = {'view': 0.90, 'report': 0.05, 'history': 0.05}
+DEFAULT_CONCURRENCY = 4
+DEFAULT_DURATION = 10.0
+DEFAULT_ZIPF = 1.1
+DEFAULT_POPULATION = 10000
+CSRF_PATTERN = re.compile(r'name="csrf_token" value="([^"]+)"')
+# Errors are server errors, client errors (429 from the report guard, 400 from CSRF) and failed connections.
+ERROR_STATUS = 400
+
+class ZipfSampler:
+    """Draws items with probability proportional to 1 / rank**s (the first item is the hottest)."""
+    def __init__(self, items, s=DEFAULT_ZIPF):
+        self.items = list(items)
+        weights = [1 / rank ** s for rank in range(1, len(self.items) + 1)]
+        self._cumulative = list(itertools.accumulate(weights))
+
+    def __call__(self, rng):
+        index = bisect.bisect_left(self._cumulative, rng.random() * self._cumulative[-1])
+        return self.items[min(index, len(self.items) - 1)]
+
+def load_numbers(db_path=None, count=DEFAULT_POPULATION, seed=0):
+    """
+    Lookup population: random numbers under the ranges of an ARCEP
+    database, or mobile numbers when there is none. The first ones are the
+    hottest.
+    """
+    rng = random.Random(seed)
+    prefixes = []
+    if db_path:
+        with closing(sqlite3.connect(db_path)) as conn:
+            for table in generatedb.NUMBER_TABLES:
+                try:
+                    prefixes.extend(row[0] for row in conn.execute(f"SELECT PlageTel FROM {table}"))
+                except sqlite3.OperationalError:
+                    continue
+    numbers = []
+    for _ in range(count):
+        prefix = rng.choice(prefixes) if prefixes else rng.choice(('06', '07'))
+        numbers.append(prefix + ''.join(rng.choice('0123456789') for _ in range(10 - len(prefix))))
+    return numbers
+
+class WSGIClient:
+    """In-process client: one Flask test client, with its own cookie jar."""
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self._client.open(path, method=method, data=data)
+        body = response.get_data(as_text=True)
+        return response.status_code, body
+
+class HTTPClient:
+    """Keep-alive HTTP/1.1 client for one virtual user, with a minimal cookie jar."""
+    def __init__(self, base_url, timeout=30):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.cookies = {}
+        self._conn = None
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{k}={v}" for k, v in self.cookies.items())
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self._conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = self._conn.getresponse()
+            content = response.read().decode('utf-8', 'replace')
+        except (OSError, http.client.HTTPException):
+            self._conn.close()
+            self._conn = None
+            raise
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, content
+
+class VirtualUser:
+    """Runs the requests of one route for one user, keeping the CSRF token of the report form."""
+    def __init__(self, client):
+        self.client = client
+        self.csrf_token = None
+
+    def _refresh_token(self):
+        _status, body = self.client.request('GET', '/')
+        match = CSRF_PATTERN.search(body)
+        self.csrf_token = match.group(1) if match else ''
+
+    def view(self, number):
+        return self.client.request('GET', f'/view/{number}')[0]
+
+    def history(self, number):
+        return self.client.request('GET', '/history')[0]
+
+    def report(self, number):
+        if self.csrf_token is None:
+            self._refresh_token()
+        # A unique comment, so the report guard does not drop it as a duplicate
+        data = {'number': number, 'is_spam': 'on', 'comment': f"loadtest {uuid.uuid4().hex[:12]}",
+                'csrf_token': self.csrf_token}
+        status = self.client.request('POST', '/report', data)[0]
+        if status == 400:
+            # Expired or missing token: the next report fetches a new one
+            self.csrf_token = None
+        return status
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        route, _, weight = part.partition('=')
+        if route not in DEFAULT_MIX or not weight:
+            raise argparse.ArgumentTypeError(f"Mélange invalide: '{part}' (attendu: view=90,report=5,history=5).")
+        mix[route] = float(weight)
+    return mix
+
+def _worker(user, numbers, mix, rng, deadline, schedule, stats):
+    routes, weights = zip(*mix.items())
+    latencies, statuses = stats
+    while True:
+        if schedule is not None:
+            started = schedule()
+            if started is None:
+                return
+            delay = started - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            started = time.perf_counter()
+            if started >= deadline:
+                return
+        route = rng.choices(routes, weights)[0]
+        try:
+            status = getattr(user, route)(numbers(rng))
+        except (OSError, http.client.HTTPException) as e:
+            status = type(e).__name__
+        latencies.setdefault(route, []).append(time.perf_counter() - started)
+        statuses.setdefault(route, Counter())[status] += 1
+
+def _fixed_rate_schedule(rate, start, deadline):
+    """Returns a thread-safe function giving the next scheduled start time (None past the deadline)."""
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def next_start():
+        with lock:
+            scheduled = start + next(counter) / rate
+        return scheduled if scheduled < deadline else None
+    return next_start
+
+def run_load(client_factory, numbers, mix=None, concurrency=DEFAULT_CONCURRENCY, duration=DEFAULT_DURATION,
+             rate=None, zipf=DEFAULT_ZIPF, seed=0):
+    """
+    Runs the load and returns the statistics of each route.
+
+    Args:
+        client_factory (callable): Returns a new client (WSGIClient or
+            HTTPClient) for each virtual user.
+        numbers (list): Lookup population, hottest first.
+        mix (dict): Route ('view', 'report', 'history') -> relative weight.
+        rate (float): Requests per second in total; None for a closed loop.
+
+    Returns:
+        dict: 'meta' and 'routes' (route -> requests, errors, error_rate,
+        throughput, latencies in ms, statuses), with a 'total' route.
+    """
+    mix = {route: weight for route, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+    sampler = ZipfSampler(numbers, zipf)
+    users = [VirtualUser(client_factory()) for _ in range(concurrency)]
+    per_worker = [({}, {}) for _ in users]
+    start = time.perf_counter()
+    deadline = start + duration
+    schedule = _fixed_rate_schedule(rate, start, deadline) if rate else None
+    threads = [threading.Thread(target=_worker, args=(user, sampler, mix, random.Random(seed * 1000 + i),
+                                                      deadline, schedule, per_worker[i]), daemon=True)
+               for i, user in enumerate(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route in [*mix, 'total']:
+        latencies = sorted(value for worker_latencies, _ in per_worker
+                           for name, values in worker_latencies.items() if route in (name, 'total') for value in values)
+        statuses = Counter()
+        for _, worker_statuses in per_worker:
+            for name, counts in worker_statuses.items():
+                if route in (name, 'total'):
+                    statuses.update(counts)
+        if not latencies:
+            continue
+        errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= ERROR_STATUS)
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'error_rate': round(errors / len(latencies), 4),
+            'throughput': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p90_ms': round(percentile(latencies, 90) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'statuses': {str(status): count for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        }
+    return {
+        'meta': {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'concurrency': concurrency, 'rate': rate,
+                 'duration': duration, 'elapsed': round(elapsed, 3), 'mix': mix, 'zipf': zipf,
+                 'population': len(numbers), 'seed': seed},
+        'routes': routes,
+    }
+
+@contextmanager
+def local_app(db_path, history_path):
+    """
+    The web application on the given databases, with the report guard
+    limits lifted (a load test comes from a single client).
+    """
+    from webapp import create_app
+
+    previous = whoistel.DB_FILE, history_manager.DB_FILE
+    whoistel.DB_FILE = db_path
+    history_manager.DB_FILE = history_path
+    try:
+        yield create_app({'SECRET_KEY': uuid.uuid4().hex, 'HISTORY_RETENTION_DAYS': 0,
+                          'REPORT_CLIENT_LIMIT': 10 ** 9, 'REPORT_GLOBAL_LIMIT': 10 ** 9,
+                          'METRICS_ENABLED': False})
+    finally:
+        whoistel.DB_FILE, history_manager.DB_FILE = previous
+
+@contextmanager
+def serve(app, port=0):
+    """Serves the application on 127.0.0.1 with werkzeug's threaded server; yields the base URL."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        thread.join()
+
+def print_results(results, file=None):
+    meta = results['meta']
+    load = f"{meta['rate']} req/s" if meta['rate'] else f"boucle fermée, {meta['concurrency']} utilisateurs"
+    print(f"Charge: {load}, {meta['elapsed']} s, Zipf s={meta['zipf']} sur {meta['population']} numéros", file=file)
+    print(f"{'route':10} {'requêtes':>9} {'req/s':>9} {'erreurs':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuts",
+          file=file)
+    for route, stats in results['routes'].items():
+        statuses = ' '.join(f"{status}:{count}" for status, count in stats['statuses'].items())
+        print(f"{route:10} {stats['requests']:9d} {stats['throughput']:9.1f} {stats['error_rate']:8.2%} "
+              f"{stats['p50_ms']:9.2f} {stats['p90_ms']:9.2f} {stats['p99_ms']:9.2f} {stats['max_ms']:9.2f}  {statuses}",
+              file=file)
+
+def main():
+    """CLI entry point for the load generator."""
+    parser = argparse.ArgumentParser(description="Test de charge HTTP de l'application web (consultations, signalements, historique).")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help="URL d'une instance déjà lancée (ex: http://127.0.0.1:8000).")
+    target.add_argument('--serve', type=int, metavar='PORT', help="Lance l'application sur ce port local (0: port libre) et la teste en HTTP.")
+    parser.add_argument('--db', default=None, help=f"Base ARCEP utilisée par l'application et pour tirer les numéros (défaut: {whoistel.DB_FILE}).")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Nombre d'utilisateurs simultanés.")
+    parser.add_argument('--rate', type=float, help="Débit fixe en requêtes/s (défaut: boucle fermée).")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help="Durée du test (s).")
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX, help="Poids des routes, ex: view=90,report=5,history=5.")
+    parser.add_argument('--zipf', type=float, default=DEFAULT_ZIPF, help="Exposant de la loi de Zipf des numéros consultés.")
+    parser.add_argument('--population', type=int, default=DEFAULT_POPULATION, help="Nombre de numéros distincts consultés.")
+    parser.add_argument('--seed', type=int, default=0, help="Graine aléatoire.")
+    parser.add_argument('--output', help="Enregistre les résultats en JSON.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.concurrency < 1 or args.duration <= 0 or (args.rate is not None and args.rate <= 0):
+        parser.error("--concurrency, --duration et --rate doivent être positifs.")
+    db_path = args.db or (None if args.url else whoistel.DB_FILE)
+    if db_path and not os.path.exists(db_path):
+        parser.error(f"Base introuvable: {db_path}")
+    numbers = load_numbers(db_path, args.population, args.seed)
+    options = dict(mix=args.mix, concurrency=args.concurrency, duration=args.duration, rate=args.rate,
+                   zipf=args.zipf, seed=args.seed)
+
+    if args.url:
+        results = run_load(lambda: HTTPClient(args.url), numbers, **options)
+    else:
+        # Reports go to a throwaway history database, never to the real one
+        with tempfile.TemporaryDirectory(prefix='whoistel-load-') as workdir, quiet_logging(), \
+                local_app(db_path, os.path.join(workdir, 'history.sqlite3')) as app:
+            if args.serve is not None:
+                with serve(app, args.serve) as url:
+                    results = run_load(lambda: HTTPClient(url), numbers, **options)
+            else:
+                results = run_load(lambda: WSGIClient(app), numbers, **options)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
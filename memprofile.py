@@ -0,0 +1,191 @@
+"""
+Memory usage reports: resident set size (RSS) and tracemalloc allocations
+per stage of a build, and the size of long-lived in-memory structures of a
+web worker (caches, report guard, metrics).
+
+RSS is read from /proc (Linux). The peak of a stage is the kernel's
+high-water mark (VmHWM), reset at the start of each stage through
+/proc/self/clear_refs; where that is not possible, the process-wide peak
+is reported instead. Structure sizes are approximate: sys.getsizeof summed
+over the objects reachable from the structure, each counted once.
+"""
+import linecache
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_TOP = 10
+# Not followed when sizing a structure: shared code, locks and OS resources.
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 types.CodeType, type(threading.Lock()), type(threading.RLock()), threading.Condition)
+_SCALAR_TYPES = (str, bytes, int, float, bool, type(None))
+# Allocations of the profiler itself are left out of the top allocators.
+_TRACE_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, linecache.__file__),
+                  tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'))
+
+def _status_kb(field):
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def rss_bytes():
+    """Current resident set size, or None where /proc is not available."""
+    return _status_kb('VmRSS')
+
+def peak_rss_bytes():
+    """Peak resident set size since the process started (or the last reset_peak_rss)."""
+    peak = _status_kb('VmHWM')
+    if peak is not None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+def reset_peak_rss():
+    """Resets the RSS high-water mark (Linux 4.0+); returns False where it cannot."""
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def deep_sizeof(obj):
+    """Approximate bytes held by obj: sys.getsizeof over everything reachable from it, shared objects once."""
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _OPAQUE_TYPES):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, _SCALAR_TYPES):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        else:
+            attributes = getattr(item, '__dict__', None)
+            if attributes is not None:
+                stack.append(attributes)
+            for slot in getattr(type(item), '__slots__', ()):
+                stack.append(getattr(item, slot, None))
+    return total
+
+def describe_structures(structures):
+    """
+    Sizes in-memory structures.
+
+    Args:
+        structures (dict): Name -> callable returning (entry count, object).
+
+    Returns:
+        dict: Name -> {'entries', 'bytes'} (bytes is None if the structure
+        kept changing while it was sized).
+    """
+    report = {}
+    for name, describe in structures.items():
+        entries, obj = describe()
+        size = 0
+        # Other threads may resize a structure while it is walked: retry a few times
+        for _attempt in range(3):
+            try:
+                size = deep_sizeof(obj) if obj is not None else 0
+                break
+            except RuntimeError:
+                size = None
+        report[name] = {'entries': entries, 'bytes': size}
+    return report
+
+def top_allocators(snapshot, baseline=None, top=DEFAULT_TOP):
+    """Source lines that allocated the most memory (since baseline when given), as dicts."""
+    snapshot = snapshot.filter_traces(_TRACE_FILTERS)
+    if baseline is not None:
+        stats = snapshot.compare_to(baseline.filter_traces(_TRACE_FILTERS), 'lineno')
+        return [{'where': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 'bytes': stat.size, 'delta': stat.size_diff, 'blocks': stat.count}
+                for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:top]]
+    return [{'where': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", 'bytes': stat.size,
+             'blocks': stat.count} for stat in snapshot.statistics('lineno')[:top]]
+
+def process_report(top=DEFAULT_TOP):
+    """RSS of the process, plus tracemalloc totals and top allocators when tracing is on."""
+    report = {'rss_bytes': rss_bytes(), 'peak_rss_bytes': peak_rss_bytes(), 'tracemalloc': None}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report['tracemalloc'] = {'current_bytes': current, 'peak_bytes': peak,
+                                 'top': top_allocators(tracemalloc.take_snapshot(), top=top)}
+    return report
+
+class StageMemory:
+    """
+    Records memory use per stage of a run (see generatedb.build_database):
+    RSS before and after, peak RSS, peak of Python allocations above the
+    start of the stage (tracemalloc), and the lines whose allocations grew
+    most during the stage. Starts tracemalloc on first use;
+    tracing slows the traced code down noticeably.
+    """
+    def __init__(self, top=DEFAULT_TOP):
+        self.top = top
+        self.stages = {}
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        baseline = tracemalloc.take_snapshot()
+        stage_peak = reset_peak_rss()
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            _current, traced_peak = tracemalloc.get_traced_memory()
+            self.stages[name] = {
+                'rss_before': rss_before,
+                'rss_after': rss_bytes(),
+                'peak_rss': peak_rss_bytes(),
+                'peak_rss_scope': 'stage' if stage_peak else 'process',
+                'traced_peak': traced_peak - traced_before,
+                'seconds': round(elapsed, 3),
+                'top': top_allocators(tracemalloc.take_snapshot(), baseline, self.top),
+            }
+
+    def stop(self):
+        """Stops tracemalloc if the first stage started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def format(self):
+        """Human-readable report, one block per stage."""
+        lines = []
+        for name, stage in self.stages.items():
+            scope = '' if stage['peak_rss_scope'] == 'stage' else ' (process-wide)'
+            lines.append(f"{name}: RSS {_mb(stage['rss_before'])} -> {_mb(stage['rss_after'])}, "
+                         f"peak RSS {_mb(stage['peak_rss'])}{scope}, peak traced {_mb(stage['traced_peak'])}")
+            for allocation in stage['top']:
+                lines.append(f"    {allocation['delta'] / 1e6:+9.2f} MB  {allocation['where']}")
+        return '\n'.join(lines)
+
+def _mb(value):
+    return 'n/a' if value is None else f"{value / 1e6:.1f} MB"
@@ -0,0 +1,198 @@
+"""
+In-process metrics: counters and fixed-bucket histograms, rendered in the
+Prometheus text exposition format. Each worker process keeps its own
+values in memory; nothing is shared between workers or sent anywhere, the
+scraper aggregates them.
+
+Recording costs one lock and a few dict operations (about a microsecond).
+Library code shared with the CLI (the whoistel lookup stages) only records
+when ENABLED is set, which the web application does when its metrics are
+enabled.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds: lookups are sub-millisecond, page renders and report writes are slower.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# SQL statements issued by one request.
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+# Whether the lookup stages record observations (set by webapp.create_app).
+ENABLED = False
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter, one value per combination of label values (passed positionally)."""
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def __len__(self):
+        return len(self._values)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name + _format_labels(self.labels, label_values), value
+
+class Histogram:
+    """
+    Histogram with fixed upper bounds. Observations are counted in their
+    bucket only; cumulative counts are computed when rendering.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes the wall-clock duration of the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values):
+        state = self._values.get(label_values)
+        return sum(state[0]) if state else 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def samples(self):
+        with self._lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                yield self.name + '_bucket' + _format_labels(self.labels, label_values, [('le', _format_value(bound))]), cumulative
+            yield self.name + '_sum' + _format_labels(self.labels, label_values), total
+            yield self.name + '_count' + _format_labels(self.labels, label_values), cumulative
+
+class CallbackMetric:
+    """
+    Metric read from existing state when rendering (e.g. LookupCache
+    counters): `callback` returns a {label values tuple: value} dict.
+    """
+    def __init__(self, name, description, kind, labels, callback):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def samples(self):
+        for label_values, value in self.callback().items():
+            yield self.name + _format_labels(self.labels, label_values), value
+
+class Registry:
+    """
+    Named metrics of one process. Registering a name again returns the
+    existing metric (callbacks are replaced), so application factories can
+    run several times.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric, replace=False):
+        with self._lock:
+            if replace or metric.name not in self._metrics:
+                self._metrics[metric.name] = metric
+            return self._metrics[metric.name]
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def callback(self, name, description, kind, labels, callback):
+        return self._register(CallbackMetric(name, description, kind, labels, callback), replace=True)
+
+    def series_count(self):
+        """Number of label combinations held in memory (callback metrics hold none)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return sum(len(metric) for metric in metrics if isinstance(metric, (Counter, Histogram)))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{sample} {_format_value(value)}" for sample, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+class StatementCounter:
+    """sqlite3 trace callback counting the statements run on a connection."""
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, _statement):
+        self.count += 1
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('whoistel_requests_total', "HTTP requests by route, method and status.",
+                            ('route', 'method', 'status'))
+REQUEST_LATENCY = REGISTRY.histogram('whoistel_request_duration_seconds', "HTTP request latency by route.",
+                                     ('route', 'method'))
+LOOKUP_STAGE_LATENCY = REGISTRY.histogram('whoistel_lookup_stage_duration_seconds',
+                                          "Latency of each stage of a number lookup and page render.", ('stage',))
+SQL_STATEMENTS = REGISTRY.counter('whoistel_sql_statements_total', "SQL statements executed, by database.", ('db',))
+REQUEST_SQL_STATEMENTS = REGISTRY.histogram('whoistel_request_sql_statements',
+                                            "SQL statements executed per HTTP request, by route.", ('route',),
+                                            buckets=COUNT_BUCKETS)
+REPORT_WRITE_LATENCY = REGISTRY.histogram('whoistel_report_write_duration_seconds',
+                                          "Latency of writing a spam report to the history database.")
@@ -0,0 +1,186 @@
+"""
+Built-in cProfile hook for web requests and CLI runs.
+
+Profiles are pstats files written to a directory, with one JSON line per
+profile in an index file (route, number, duration...) that the admin page
+lists. Load a profile with `python -m pstats <file>` or snakeviz.
+
+The webapp profiles one request in PROFILE_EVERY, plus any request that
+carries the admin token in the X-Whoistel-Profile header. When neither is
+configured, no hook is registered. Only the PROFILE_KEEP newest profiles
+are kept.
+"""
+import cProfile
+import hmac
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: index updates from concurrent workers are not serialised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get('WHOISTEL_PROFILE_DIR', 'data/profiles')
+PROFILE_HEADER = 'X-Whoistel-Profile'
+PROFILE_SUFFIX = '.prof'
+INDEX_FILE = 'index.jsonl'
+# Profiles kept in a directory; the oldest are deleted beyond that (0: no limit).
+PROFILE_KEEP = int(os.environ.get('WHOISTEL_PROFILE_KEEP', '500'))
+
+class Sampler:
+    """Thread-safe one-in-`every` selector (0 selects nothing)."""
+    def __init__(self, every):
+        self.every = every
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if not self.every:
+            return False
+        with self._lock:
+            return next(self._counter) % self.every == 0
+
+def token_matches(given, expected):
+    """Constant-time comparison of an admin token; an unset token never matches."""
+    return bool(expected) and bool(given) and hmac.compare_digest(given.encode(), expected.encode())
+
+def start():
+    """
+    Starts a profiler for the current thread.
+
+    Returns:
+        cProfile.Profile | None: None if another profiler is already active
+        (Python 3.12+ allows a single one per process).
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+def _slug(value):
+    return re.sub(r'[^A-Za-z0-9]+', '-', value or '').strip('-')[:60] or 'root'
+
+def save(profiler, directory=PROFILE_DIR, keep=PROFILE_KEEP, **metadata):
+    """
+    Stops the profiler and writes its pstats file, named after the time and
+    metadata['label'], then appends metadata to the directory's index and
+    prunes the directory to its `keep` newest profiles.
+
+    Returns:
+        str: Path of the pstats file.
+    """
+    profiler.disable()
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+    name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}-{int(now * 1e6) % 1000000:06d}-{_slug(metadata.get('label'))}{PROFILE_SUFFIX}"
+    path = os.path.join(directory, name)
+    profiler.dump_stats(path)
+    entry = {'file': name, 'created': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now)), **metadata}
+    with index_lock(directory), open(os.path.join(directory, INDEX_FILE), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    if keep:
+        prune(directory, keep)
+    return path
+
+def prune(directory=PROFILE_DIR, keep=PROFILE_KEEP):
+    """
+    Deletes all but the `keep` newest pstats files (names start with their
+    UTC time) and drops their index entries.
+
+    Returns:
+        int: Number of profiles deleted.
+    """
+    names = sorted(name for name in os.listdir(directory) if name.endswith(PROFILE_SUFFIX))
+    stale = names[:max(0, len(names) - keep)]
+    if not stale:
+        return 0
+    for name in stale:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # Pruned concurrently by another worker
+            pass
+    index = os.path.join(directory, INDEX_FILE)
+    stale = set(stale)
+    with index_lock(directory):
+        try:
+            with open(index, encoding='utf-8') as f:
+                lines = [line for line in f if _index_file(line) not in stale]
+        except FileNotFoundError:
+            return len(stale)
+        tmp = f"{index}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp, index)
+    return len(stale)
+
+@contextmanager
+def index_lock(directory):
+    """
+    Exclusive lock on the directory's index (a sibling index.jsonl.lock file,
+    since the index itself is replaced by prune), so no appended entry is
+    lost to a concurrent rewrite. Not reentrant.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, INDEX_FILE + '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _index_file(line):
+    try:
+        return json.loads(line).get('file')
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+def load_index(directory=PROFILE_DIR, limit=200):
+    """Returns the newest index entries whose pstats file still exists, newest first."""
+    try:
+        with open(os.path.join(directory, INDEX_FILE), encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in reversed(lines):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if os.path.exists(os.path.join(directory, entry.get('file', ''))):
+            entries.append(entry)
+            if len(entries) >= limit:
+                break
+    return entries
+
+def profile_path(directory, name):
+    """Path of a profile listed in the index, or None for any other name."""
+    if not name.endswith(PROFILE_SUFFIX) or os.path.basename(name) != name:
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isfile(path) else None
+
+@contextmanager
+def profiled(directory=PROFILE_DIR, **metadata):
+    """Profiles the block (e.g. a whole CLI batch run) and saves it with its duration."""
+    profiler = start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            path = save(profiler, directory, duration_ms=round((time.perf_counter() - started) * 1000, 3), **metadata)
+            logger.info(f"Profile written to {path}")
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#-*- encoding: Utf-8 -*-
+"""
+Refreshes the ARCEP/INSEE source files and the whoistel database.
+
+The refresh runs as a sequence of stages (fetch, parse, import operators,
+import numbers, import communes, indexes and snapshots). Each stage after
+fetch is keyed by a hash of its input files and of the code that processes
+them; a stage whose key matches the one recorded by the previous refresh is
+skipped. Downloads use conditional requests (ETag / Last-Modified), so a
+refresh where nothing changed upstream only costs three HTTP round trips.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import urllib.error
+import urllib.request
+from contextlib import closing
+
+import generatedb
+import history_manager
+import whoistel
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'refresh-state.json'
+# Bump to force every stage to rerun after a change in this module.
+STAGE_VERSION = 1
+# Modules whose code shapes the stage outputs: the importers, and the
+# lookups and heatmap enrichment run by the snapshot stage.
+STAGE_MODULES = (generatedb, whoistel, history_manager)
+FETCH_TIMEOUT = 60
+
+# File name -> download URL, delimiter, encoding and columns read by generatedb.
+SOURCES = {
+    'majournums.csv': {
+        'url': 'https://www.data.gouv.fr/fr/datasets/r/90e8bdd0-0f5c-47ac-bd39-5f46463eb806',
+        'delimiter': ';', 'encoding': 'cp1252',
+        'columns': ('EZABPQM', 'Mnémo', 'Territoire'),
+    },
+    'identifiants_ce.csv': {
+        'url': 'https://www.data.gouv.fr/fr/datasets/r/b0f62183-cd0c-498d-8153-aa1594e5e8d9',
+        'delimiter': ';', 'encoding': 'cp1252',
+        'columns': ('CODE_OPERATEUR', 'IDENTITE_OPERATEUR'),
+    },
+    'communes-france.csv': {
+        'url': 'https://www.data.gouv.fr/api/1/datasets/r/dbe8a621-a9c4-4bc3-9cae-be1699c5ff25',
+        'delimiter': ',', 'encoding': 'utf-8-sig',
+        'columns': ('code_commune_INSEE', 'nom_commune', 'code_postal', 'ligne_5',
+                    'nom_departement', 'latitude', 'longitude'),
+    },
+}
+
+# Import stage -> source file and the tables it fills.
+IMPORT_STAGES = {
+    'operators': ('identifiants_ce.csv', ('Operateurs',)),
+    'numbers': ('majournums.csv', generatedb.NUMBER_TABLES),
+    'communes': ('communes-france.csv', ('Communes',)),
+}
+
+def file_digest(path):
+    """Returns the SHA-256 hex digest of a file, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(1 << 20):
+            h.update(block)
+    return h.hexdigest()
+
+def code_version():
+    """Digest of the code that turns source files into the database (STAGE_MODULES)."""
+    h = hashlib.sha256(f"stage-version:{STAGE_VERSION}".encode())
+    for module in STAGE_MODULES:
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def stage_key(name, *inputs):
+    """Cache key of a stage: its name, the code version and its input digests."""
+    payload = json.dumps([name, code_version(), *inputs])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def load_state(arcep_dir):
+    try:
+        with open(os.path.join(arcep_dir, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_state(arcep_dir, state):
+    """Writes the state file atomically, so an interrupted refresh keeps the previous keys."""
+    path = os.path.join(arcep_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def fetch(url, path, validators=None, timeout=FETCH_TIMEOUT, check=None):
+    """
+    Downloads url to path with a conditional request. The download goes to
+    path + '.part', and path is only replaced once it has completed and
+    passed `check`.
+
+    Args:
+        validators (dict): 'etag' / 'last_modified' returned by the previous
+            download of this file, if any.
+        check (callable): Called with the path of the downloaded file before
+            it replaces path; an exception leaves path untouched.
+
+    Returns:
+        dict | None: New validators, or None if the server answered 304 Not
+        Modified (path is left untouched).
+    """
+    validators = validators or {}
+    request = urllib.request.Request(url)
+    if os.path.exists(path):
+        if validators.get('etag'):
+            request.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            request.add_header('If-Modified-Since', validators['last_modified'])
+    part = path + '.part'
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            with open(part, 'wb') as f:
+                while block := response.read(1 << 20):
+                    f.write(block)
+            headers = response.headers
+        if check is not None:
+            check(part)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    os.replace(part, path)
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+def check_source(path, spec):
+    """Parse stage: the file must be a CSV with the expected columns and at least one row."""
+    with open(path, newline='', encoding=spec['encoding']) as f:
+        reader = csv.DictReader(f, delimiter=spec['delimiter'])
+        missing = [column for column in spec['columns'] if column not in (reader.fieldnames or ())]
+        if missing:
+            raise generatedb.BuildError(f"{os.path.basename(path)}: colonnes manquantes {missing}")
+        if next(reader, None) is None:
+            raise generatedb.BuildError(f"{os.path.basename(path)}: aucune ligne")
+
+def _build_id(db_path):
+    if not os.path.exists(db_path):
+        return None
+    with closing(sqlite3.connect(db_path)) as conn:
+        try:
+            row = conn.execute("SELECT Value FROM BuildInfo WHERE Key = 'build_id'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+    return row[0] if row else None
+
+def build_options(db_path, state):
+    """
+    build_database options of the deployment: those of the existing
+    database (compact, compact_schema), else those recorded in the state.
+    """
+    if not os.path.exists(db_path):
+        return state.get('build_options', {})
+    with closing(sqlite3.connect(db_path)) as conn:
+        return {'compact': generatedb.is_compacted(conn), 'compact_schema': generatedb.has_compact_schema(conn)}
+
+def _history_exists():
+    if history_manager.HISTORY_SHARDS > 1:
+        return any(os.path.exists(path) for path in history_manager.shard_paths(history_manager.HISTORY_SHARDS))
+    return os.path.exists(history_manager.DB_FILE)
+
+def refresh_snapshots(db_path):
+    """Refreshes planner statistics and re-enriches the report heatmap against the new ranges."""
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute("ANALYZE")
+        conn.commit()
+    if _history_exists():
+        with closing(sqlite3.connect(db_path)) as lookup_conn:
+            lookup_conn.row_factory = sqlite3.Row
+            history_manager.init_history_db()
+            history_manager.rebuild_heatmap(lookup_conn)
+
+def refresh(db_path=generatedb.DB_FILE, arcep_dir=generatedb.ARCEP_DIR, fetch_sources=True, force=False):
+    """
+    Runs the refresh pipeline, skipping every stage whose inputs are unchanged.
+
+    Args:
+        fetch_sources (bool): Download the source files (False to use the
+            files already in arcep_dir).
+        force (bool): Ignore the recorded stage keys and rerun everything.
+
+    Returns:
+        dict: Stage name -> 'ran' or 'skipped'.
+    """
+    os.makedirs(arcep_dir, exist_ok=True)
+    state = {} if force else load_state(arcep_dir)
+    validators = state.setdefault('sources', {})
+    keys = state.setdefault('stages', {})
+    report = {}
+
+    if fetch_sources:
+        updated = 0
+        for name, spec in SOURCES.items():
+            path = os.path.join(arcep_dir, name)
+            # A malformed download is rejected before it replaces the last good file,
+            # and its validators are not recorded, so the next run downloads it again.
+            new = fetch(spec['url'], path, validators.get(name), check=lambda part, spec=spec: check_source(part, spec))
+            if new is not None:
+                validators[name] = new
+                parse_key = stage_key('parse', file_digest(path))
+                if keys.get(f'parse:{name}') != parse_key:
+                    # Already checked before the file was replaced
+                    keys[f'parse:{name}'] = parse_key
+                    report[f'parse:{name}'] = 'ran'
+                updated += 1
+            logger.info(f"fetch {name}: {'downloaded' if new is not None else 'not modified'}")
+        report['fetch'] = 'ran' if updated else 'skipped'
+
+    digests = {name: file_digest(os.path.join(arcep_dir, name)) for name in SOURCES}
+
+    def run(stage, key, action):
+        if keys.get(stage) == key:
+            logger.info(f"{stage}: unchanged, skipped")
+            report.setdefault(stage, 'skipped')
+            return False
+        action()
+        keys[stage] = key
+        report[stage] = 'ran'
+        return True
+
+    for name, spec in SOURCES.items():
+        run(f'parse:{name}', stage_key('parse', digests[name]),
+            lambda: check_source(os.path.join(arcep_dir, name), spec))
+        save_state(arcep_dir, state)
+
+    import_keys = {stage: stage_key(stage, digests[source]) for stage, (source, _) in IMPORT_STAGES.items()}
+    state['build_options'] = options = build_options(db_path, state)
+    if state.get('build_id') is None or state.get('build_id') != _build_id(db_path):
+        # No database, or one this pipeline did not produce: the recorded keys say nothing about it.
+        generatedb.build_database(db_path, arcep_dir, **options)
+        keys.update(import_keys)
+        report.update(dict.fromkeys(IMPORT_STAGES, 'ran'))
+    else:
+        changed = [stage for stage, key in import_keys.items() if keys.get(stage) != key]
+        report.update(dict.fromkeys(IMPORT_STAGES, 'skipped'))
+        if changed:
+            tables = [table for stage in changed for table in IMPORT_STAGES[stage][1]]
+            generatedb.update_database(db_path, arcep_dir, tables=tables)
+            for stage in changed:
+                keys[stage] = import_keys[stage]
+                report[stage] = 'ran'
+    state['build_id'] = _build_id(db_path)
+    save_state(arcep_dir, state)
+
+    run('snapshots', stage_key('snapshots', *sorted(import_keys.values())), lambda: refresh_snapshots(db_path))
+    save_state(arcep_dir, state)
+    return report
+
+def main():
+    """CLI entry point for the refresh pipeline."""
+    parser = argparse.ArgumentParser(description="Met à jour les fichiers ARCEP/INSEE et la base whoistel.")
+    parser.add_argument('--db', default=generatedb.DB_FILE, help="Chemin de la base whoistel.")
+    parser.add_argument('--arcep-dir', default=generatedb.ARCEP_DIR, help="Répertoire des fichiers CSV.")
+    parser.add_argument('--no-fetch', dest='fetch', action='store_false',
+                        help="N'effectue pas de téléchargement, utilise les fichiers présents.")
+    parser.add_argument('--force', action='store_true', help="Réexécute toutes les étapes.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        report = refresh(args.db, args.arcep_dir, fetch_sources=args.fetch, force=args.force)
+    except (generatedb.BuildError, urllib.error.URLError, OSError) as e:
+        logger.error(f"Refresh failed: {e}")
+        sys.exit(1)
+    logger.info("Refresh complete: " + ', '.join(f"{stage} {status}" for stage, status in report.items()))
+
+if __name__ == "__main__":
+    main()
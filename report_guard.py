@@ -0,0 +1,111 @@
+"""
+In-memory sliding-window filter dropping duplicate and burst report
+submissions before they reach the history database.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+
+DROP_DUPLICATE = 'duplicate'
+DROP_CLIENT_RATE = 'client_rate'
+DROP_GLOBAL_RATE = 'global_rate'
+
+class ReportGuard:
+    """
+    Bounded, thread-safe sliding-window store for report submissions.
+
+    - An exact duplicate, keyed by (client, number, content hash), is dropped
+      if seen within `duplicate_window` seconds.
+    - A client may submit at most `client_limit` reports per `rate_window` seconds.
+    - The process accepts at most `global_limit` reports per `rate_window` seconds.
+
+    Both key maps are LRU-bounded to `max_keys` entries, so memory stays
+    bounded whatever the number of clients.
+    """
+    def __init__(self, duplicate_window=600.0, rate_window=60.0, client_limit=10,
+                 global_limit=300, max_keys=10000, clock=time.monotonic):
+        self.duplicate_window = duplicate_window
+        self.rate_window = rate_window
+        self.client_limit = client_limit
+        self.global_limit = global_limit
+        self.max_keys = max_keys
+        self.clock = clock
+        self._seen = OrderedDict()
+        self._clients = OrderedDict()
+        self._global = deque()
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.dropped = {DROP_DUPLICATE: 0, DROP_CLIENT_RATE: 0, DROP_GLOBAL_RATE: 0}
+
+    @staticmethod
+    def content_hash(*fields):
+        """Compact digest of the submitted fields."""
+        payload = '\x1f'.join('' if f is None else str(f) for f in fields)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=8).digest()
+
+    def check(self, client, number, content_hash):
+        """
+        Records a submission if it is allowed.
+
+        Returns:
+            str | None: None when accepted, otherwise the drop reason
+            (DROP_DUPLICATE, DROP_CLIENT_RATE or DROP_GLOBAL_RATE).
+        """
+        now = self.clock()
+        key = (client, number, content_hash)
+        with self._lock:
+            seen_at = self._seen.get(key)
+            if seen_at is not None and now - seen_at < self.duplicate_window:
+                return self._drop(DROP_DUPLICATE)
+
+            window_start = now - self.rate_window
+            history = self._clients.get(client)
+            if history is not None:
+                while history and history[0] <= window_start:
+                    history.popleft()
+                if len(history) >= self.client_limit:
+                    return self._drop(DROP_CLIENT_RATE)
+
+            while self._global and self._global[0] <= window_start:
+                self._global.popleft()
+            if len(self._global) >= self.global_limit:
+                return self._drop(DROP_GLOBAL_RATE)
+
+            if history is None:
+                history = self._clients[client] = deque()
+            history.append(now)
+            self._global.append(now)
+            self._remember(self._clients, client, history)
+            self._remember(self._seen, key, now)
+            self.accepted += 1
+            return None
+
+    def forget(self, client, number, content_hash):
+        """
+        Forgets an accepted submission whose write failed, so that retrying
+        it is not dropped as a duplicate. It still counts towards the rate
+        limits.
+        """
+        with self._lock:
+            self._seen.pop((client, number, content_hash), None)
+
+    def _drop(self, reason):
+        self.dropped[reason] += 1
+        return reason
+
+    def _remember(self, store, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_keys:
+            store.popitem(last=False)
+
+    def stats(self):
+        """Returns accepted/dropped counters and current key counts."""
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'dropped': dict(self.dropped),
+                'tracked_submissions': len(self._seen),
+                'tracked_clients': len(self._clients),
+            }
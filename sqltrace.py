@@ -0,0 +1,128 @@
+"""
+Opt-in SQL tracing for sqlite3 connections, per web request or CLI run.
+
+A Tracer hooks existing connections (lookup and history alike) without
+changing how they are created:
+
+- set_trace_callback records the text of every statement SQLite runs,
+  with its bound values, including implicit BEGIN/COMMIT;
+- set_progress_handler counts virtual machine steps, a measure of the work
+  done by the statement (a table scan shows up as a large step count);
+- the connection's row_factory is wrapped to count the rows returned.
+
+A statement's elapsed time runs until the next traced statement starts
+(or the trace finishes), so it includes the caller's handling of the rows.
+When tracing is off nothing is installed.
+
+A query budget caps the number of statements of one trace. Exceeding it is
+logged with the full trace, or raises QueryBudgetExceeded, so N+1
+regressions fail in tests.
+"""
+import logging
+import time
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# The progress handler runs every PROGRESS_STEPS virtual machine instructions.
+PROGRESS_STEPS = 100
+BUDGET_LOG = 'log'
+BUDGET_RAISE = 'raise'
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a trace issued more statements than its budget allows."""
+
+class TracedStatement:
+    """One statement run on a traced connection."""
+    __slots__ = ('db', 'sql', 'started', 'elapsed', 'rows', 'steps')
+
+    def __init__(self, db, sql, started):
+        self.db = db
+        self.sql = sql
+        self.started = started
+        self.elapsed = None
+        self.rows = 0
+        self.steps = 0
+
+    def as_dict(self):
+        return {'db': self.db, 'sql': self.sql, 'elapsed_ms': round((self.elapsed or 0) * 1000, 3),
+                'rows': self.rows, 'steps': self.steps}
+
+class Tracer:
+    """
+    Records the statements run on the connections it is attached to.
+
+    Args:
+        budget (int): Maximum number of statements (None for no limit).
+        on_exceeded (str): BUDGET_LOG to log a warning, BUDGET_RAISE to raise
+            QueryBudgetExceeded from finish().
+        label (str): Describes the traced unit of work in logs (route, number...).
+    """
+    def __init__(self, budget=None, on_exceeded=BUDGET_LOG, label='', clock=time.perf_counter):
+        self.budget = budget
+        self.on_exceeded = on_exceeded
+        self.label = label
+        self.clock = clock
+        self.statements = []
+        self._current = None
+
+    def attach(self, conn, db='main', on_statement=None):
+        """
+        Installs the hooks on a sqlite3 connection. Cursors created before
+        this call keep the previous row_factory and their rows are not counted.
+
+        Args:
+            db (str): Name of the connection in the trace.
+            on_statement (callable): Also called with each statement's text
+                (SQLite keeps a single trace callback per connection).
+        """
+        conn.set_trace_callback(partial(self._on_statement, db, on_statement))
+        conn.set_progress_handler(self._on_progress, PROGRESS_STEPS)
+        row_factory = conn.row_factory
+
+        def counting_row_factory(cursor, row):
+            if self._current is not None:
+                self._current.rows += 1
+            return row_factory(cursor, row) if row_factory is not None else row
+        conn.row_factory = counting_row_factory
+        return conn
+
+    def _on_statement(self, db, on_statement, sql):
+        now = self.clock()
+        if self._current is not None:
+            self._current.elapsed = now - self._current.started
+        self._current = TracedStatement(db, sql, now)
+        self.statements.append(self._current)
+        if on_statement is not None:
+            on_statement(sql)
+
+    def _on_progress(self):
+        if self._current is not None:
+            self._current.steps += PROGRESS_STEPS
+        return 0
+
+    def finish(self):
+        """
+        Closes the trace and enforces the budget.
+
+        Returns:
+            list: The TracedStatement records.
+        """
+        if self._current is not None:
+            self._current.elapsed = self.clock() - self._current.started
+            self._current = None
+        if self.budget is not None and len(self.statements) > self.budget:
+            message = (f"SQL query budget exceeded{f' ({self.label})' if self.label else ''}: "
+                       f"{len(self.statements)} statements for a budget of {self.budget}.\n{self.format()}")
+            if self.on_exceeded == BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return self.statements
+
+    def format(self):
+        """Human-readable trace, one line per statement."""
+        lines = [f"{i:3d}. [{s.db}] {(s.elapsed or 0) * 1000:8.3f} ms {s.rows:5d} rows {s.steps:7d} steps  {' '.join(s.sql.split())}"
+                 for i, s in enumerate(self.statements, 1)]
+        total = sum(s.elapsed or 0 for s in self.statements) * 1000
+        lines.append(f"{len(self.statements)} statements, {total:.3f} ms")
+        return '\n'.join(lines)
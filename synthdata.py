@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#-*- encoding: Utf-8 -*-
+"""
+Generates synthetic ARCEP/INSEE source files for offline scale testing.
+
+The files follow the formats read by generatedb.py:
+- majournums.csv and identifiants_ce.csv: cp1252, ';', CRLF;
+- communes-france.csv: UTF-8, ','.
+
+The data carries the quirks of the real files:
+- nested prefixes of different lengths held by different operators;
+- duplicate prefixes (the first one wins) and duplicate operator codes;
+- ranges of the overseas territories, under their ARCEP names;
+- operators missing from identifiants_ce.csv;
+- empty attribution dates;
+- secondary delivery lines (ligne_5) before or after the main commune entry;
+- Corsican 2A/2B codes and INSEE and postal codes without leading zeros.
+
+The same sizes and seed always produce the same files.
+
+    python3 synthdata.py --out-dir arcep-synth --scale 10 --seed 1
+    python3 generatedb.py --arcep-dir arcep-synth --db synth.sqlite3
+"""
+import argparse
+import os
+import random
+import string
+
+import whoistel
+
+# Roughly the size of the real files; --scale multiplies them.
+BASE_RANGES = 50000
+BASE_OPERATORS = 400
+BASE_COMMUNES = 35000
+
+# Prefix length distribution of metropolitan ranges (EZABPQM).
+PREFIX_LENGTHS = (4, 5, 6, 7)
+PREFIX_WEIGHTS = (1, 3, 5, 2)
+# National blocks: geographic zones 01-05, mobile 06/07, special 08, VoIP 09.
+METRO_ZONES = '123456789'
+OVERSEAS_SHARE = 0.04
+NESTED_SHARE = 0.05
+DUPLICATE_SHARE = 0.01
+UNKNOWN_OPERATOR_SHARE = 0.01
+EMPTY_DATE_SHARE = 0.01
+SECONDARY_LINE_SHARE = 0.05
+STRIPPED_ZERO_SHARE = 0.05
+
+# Overseas block -> ARCEP territory names found under it.
+TERRITORIES = {
+    '0262': ('La Réunion',), '0263': ('La Réunion',), '0692': ('La Réunion',), '0693': ('La Réunion',),
+    '0269': ('Mayotte',), '0639': ('Mayotte',),
+    '0590': ('Guadeloupe', 'Saint-Martin', 'Saint-Barthélemy'),
+    '0690': ('Guadeloupe', 'Saint-Martin', 'Saint-Barthélemy'),
+    '0691': ('Guadeloupe', 'Saint-Martin', 'Saint-Barthélemy'),
+    '0594': ('Guyane',), '0694': ('Guyane',),
+    '0596': ('Martinique',), '0696': ('Martinique',), '0697': ('Martinique',),
+    '0508': ('Saint-Pierre-et-Miquelon',),
+}
+DEPARTEMENTS = [f"{i:02d}" for i in range(1, 96) if i != 20] + ['2A', '2B', '971', '972', '973', '974', '976']
+COMMUNES_HEADER = ("code_commune_INSEE,nom_commune_postal,code_postal,libelle_acheminement,ligne_5,latitude,longitude,"
+                   "code_commune,article,nom_commune,nom_commune_complet,code_departement,nom_departement,code_region,nom_region")
+NAME_PARTS = ('Saint', 'Sainte', 'Mont', 'Val', 'Bois', 'Pré', 'Château', 'Fontaine', 'Étang', 'Côte')
+
+def _date(rng):
+    if rng.random() < EMPTY_DATE_SHARE:
+        return ''
+    return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1997, 2024)}"
+
+def _operator_codes(rng, count):
+    codes = set()
+    while len(codes) < count:
+        codes.add(''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(3, 6))))
+    return sorted(codes)
+
+def write_operators(path, rng, codes):
+    """identifiants_ce.csv, with a few codes listed twice (the importer keeps the first)."""
+    with open(path, 'w', encoding='cp1252', newline='') as f:
+        f.write("CODE_OPERATEUR;IDENTITE_OPERATEUR;ADRESSE_COMPLETE;SIREN\r\n")
+        for code in codes:
+            line = f"{code};Société {code.title()} Télécom;{rng.randint(1, 200)} rue de la République;{rng.randrange(10 ** 9):09d}\r\n"
+            f.write(line)
+            if rng.random() < DUPLICATE_SHARE:
+                f.write(line)
+
+def _metro_prefix(rng):
+    while True:
+        length = rng.choices(PREFIX_LENGTHS, PREFIX_WEIGHTS)[0]
+        prefix = '0' + rng.choice(METRO_ZONES) + ''.join(rng.choice(string.digits) for _ in range(length - 2))
+        if prefix[:4] not in whoistel.OVERSEAS_BLOCKS:
+            return prefix
+
+def write_ranges(path, rng, count, codes):
+    """
+    majournums.csv. Returns the ranges as generatedb resolves them:
+    ({metropolitan prefix: operator}, {overseas prefix: (country code, operator, territory)}).
+    """
+    known = codes + [f"ZZ{i:02d}" for i in range(max(1, int(len(codes) * UNKNOWN_OPERATOR_SHARE)))]
+    blocks = sorted(TERRITORIES)
+    metro, overseas = {}, {}
+    rows = []
+
+    def add(prefix, operator, territory):
+        rows.append((prefix, operator, territory, _date(rng)))
+        target = overseas if territory != 'Métropole' else metro
+        if prefix not in target:
+            target[prefix] = (whoistel.OVERSEAS_BLOCKS[prefix[:4]], operator, territory) if territory != 'Métropole' else operator
+
+    while len(rows) < count:
+        operator = rng.choice(known)
+        if rng.random() < OVERSEAS_SHARE:
+            block = rng.choice(blocks)
+            prefix = block + ''.join(rng.choice(string.digits) for _ in range(rng.randint(0, 3)))
+            add(prefix, operator, rng.choice(TERRITORIES[block]))
+            continue
+        prefix = _metro_prefix(rng)
+        add(prefix, operator, 'Métropole')
+        if len(prefix) < 9 and rng.random() < NESTED_SHARE:
+            # A longer range inside this one, held by another operator
+            add(prefix + rng.choice(string.digits), rng.choice(known), 'Métropole')
+        if rng.random() < DUPLICATE_SHARE:
+            add(prefix, rng.choice(known), 'Métropole')
+
+    with open(path, 'w', encoding='cp1252', newline='') as f:
+        f.write("EZABPQM;Tranche_Debut;Tranche_Fin;Mnémo;Territoire;Date_Attribution\r\n")
+        for prefix, operator, territory, attributed in rows:
+            f.write(f"{prefix};{prefix.ljust(10, '0')};{prefix.ljust(10, '9')};{operator};{territory};{attributed}\r\n")
+    return metro, overseas
+
+def _commune_name(rng):
+    return f"{rng.choice(NAME_PARTS)}-{''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9))).title()}"
+
+def write_communes(path, rng, count):
+    """communes-france.csv, one main entry per commune plus a few secondary delivery lines."""
+    lines = []
+    for i in range(count):
+        departement = DEPARTEMENTS[i % len(DEPARTEMENTS)]
+        number = i // len(DEPARTEMENTS) + 1
+        insee = f"{departement}{number:0{5 - len(departement)}d}"[:5]
+        postal = f"{departement.replace('2A', '20').replace('2B', '20')}{rng.randrange(1000):03d}"[:5]
+        name = _commune_name(rng)
+        main = [insee, name.upper(), postal, name.upper(), '', f"{rng.uniform(41, 51):.4f}", f"{rng.uniform(-5, 9):.4f}",
+                insee[2:], '', name, name, departement, f"Département {departement}", f"{rng.randint(1, 94):02d}", "Région"]
+        if rng.random() < STRIPPED_ZERO_SHARE:
+            main[0] = main[0].lstrip('0')
+            main[2] = main[2].lstrip('0')
+        entries = [main]
+        if rng.random() < SECONDARY_LINE_SHARE:
+            secondary = list(main)
+            secondary[4] = _commune_name(rng).upper()
+            secondary[2] = postal[:-1] + str(rng.randrange(10))
+            entries.insert(rng.randrange(2), secondary)
+        lines.extend(','.join(entry) for entry in entries)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(COMMUNES_HEADER + '\n')
+        for line in lines:
+            f.write(line + '\n')
+
+def generate(out_dir, ranges=BASE_RANGES, operators=BASE_OPERATORS, communes=BASE_COMMUNES, seed=0):
+    """
+    Writes the three source files into out_dir.
+
+    Returns:
+        dict: 'metro' ({prefix: operator}) and 'overseas' ({prefix:
+        (country code, operator, territory)}), the ranges as generatedb
+        resolves them (first occurrence wins), plus the file row counts.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    codes = _operator_codes(rng, operators)
+    write_operators(os.path.join(out_dir, 'identifiants_ce.csv'), rng, codes)
+    metro, overseas = write_ranges(os.path.join(out_dir, 'majournums.csv'), rng, ranges, codes)
+    write_communes(os.path.join(out_dir, 'communes-france.csv'), rng, communes)
+    return {'metro': metro, 'overseas': overseas, 'ranges': ranges, 'operators': operators, 'communes': communes}
+
+def main():
+    """CLI entry point for the synthetic dataset generator."""
+    parser = argparse.ArgumentParser(description="Génère des fichiers ARCEP/INSEE synthétiques (formats réels) pour les tests de charge.")
+    parser.add_argument('--out-dir', required=True, help="Répertoire de sortie des fichiers CSV.")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplicateur des tailles par défaut (taille réelle = 1).")
+    parser.add_argument('--ranges', type=int, help=f"Nombre de lignes de majournums.csv (défaut: {BASE_RANGES} x scale).")
+    parser.add_argument('--operators', type=int, help=f"Nombre d'opérateurs (défaut: {BASE_OPERATORS} x scale).")
+    parser.add_argument('--communes', type=int, help=f"Nombre de communes (défaut: {BASE_COMMUNES} x scale).")
+    parser.add_argument('--seed', type=int, default=0, help="Graine aléatoire (mêmes paramètres, mêmes fichiers).")
+    args = parser.parse_args()
+
+    summary = generate(args.out_dir,
+                       ranges=args.ranges or int(BASE_RANGES * args.scale),
+                       operators=args.operators or max(1, int(BASE_OPERATORS * args.scale)),
+                       communes=args.communes or int(BASE_COMMUNES * args.scale),
+                       seed=args.seed)
+    print(f"{summary['ranges']} plages ({len(summary['metro'])} préfixes métropolitains, "
+          f"{len(summary['overseas'])} outre-mer), {summary['operators']} opérateurs, "
+          f"{summary['communes']} communes écrits dans {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
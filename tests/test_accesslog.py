@@ -0,0 +1,34 @@
+import json
+import logging
+import queue
+
+import accesslog
+
+def test_number_hash_is_keyed_and_stable():
+    assert accesslog.number_hash('0612345678', 'key') == accesslog.number_hash('0612345678', 'key')
+    assert accesslog.number_hash('0612345678', 'key') != accesslog.number_hash('0612345678', 'other')
+    assert len(accesslog.number_hash('0612345678', 'key')) == accesslog.HASH_LENGTH
+    assert '0612345678' not in accesslog.number_hash('0612345678', 'key')
+    assert accesslog.number_hash(None, 'key') is None
+
+def test_json_formatter():
+    record = logging.LogRecord('whoistel.access', logging.INFO, __file__, 1, {'route': '/', 'status': 200}, None, None)
+    assert json.loads(accesslog.JSONFormatter().format(record)) == {'route': '/', 'status': 200}
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = accesslog.DroppingQueueHandler(queue.Queue(2))
+    for status in range(5):
+        handler.handle(logging.LogRecord('whoistel.access', logging.INFO, __file__, 1, {'status': status}, None, None))
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+def test_start_writes_json_lines(tmp_path):
+    path = tmp_path / 'access.jsonl'
+    try:
+        accesslog.start(str(path))
+        accesslog.log({'route': '/view/<number>', 'stages_ms': {'render': 1.5}})
+        accesslog.log({'route': '/', 'stages_ms': {}})
+    finally:
+        accesslog.stop()
+    lines = path.read_text(encoding='utf-8').splitlines()
+    assert [json.loads(line)['route'] for line in lines] == ['/view/<number>', '/']
@@ -0,0 +1,23 @@
+import benchmark
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    """A throughput drop or a latency increase beyond the threshold is a regression."""
+    baseline = {'benchmarks': {'a': {'ops_per_sec': 100.0, 'p99_us': 10.0},
+                               'b': {'ops_per_sec': 100.0, 'p99_us': 10.0},
+                               'gone': {'ops_per_sec': 1.0, 'p99_us': 1.0}}}
+    current = {'benchmarks': {'a': {'ops_per_sec': 95.0, 'p99_us': 20.0},
+                              'b': {'ops_per_sec': 80.0, 'p99_us': 10.5}}}
+    assert [(name, regressed) for name, *_, regressed in benchmark.compare(baseline, current, 0.10)] == [
+        ('a', False), ('b', True)]
+    assert [(name, regressed) for name, *_, regressed in benchmark.compare(baseline, current, 0.10, 'p99_us')] == [
+        ('a', True), ('b', False)]
+
+def test_run_small_dataset():
+    """The suite runs end to end on a tiny synthetic dataset."""
+    results = benchmark.run(duration=0.01, ranges=300, communes=50, operators=5, builds=1)
+    names = set(results['benchmarks'])
+    assert {'clean_phone_number', 'search_number', 'get_full_info', 'enrich_batch', 'generatedb.numbers',
+            'generatedb.total', 'route./view', 'route./report', 'route./history'} <= names
+    assert all(stats['ops_per_sec'] > 0 for stats in results['benchmarks'].values())
+    assert results['meta']['ranges'] == 300
@@ -0,0 +1,24 @@
+import logging
+
+import benchstats
+
+
+def test_summarize_percentiles_and_throughput():
+    """ops/sec is computed over the total time; p50/p99 use nearest rank."""
+    stats = benchstats.summarize([1000 * i for i in range(1, 101)], ops_per_run=2)
+    assert stats['runs'] == 100
+    assert stats['p50_us'] == 50.0
+    assert stats['p99_us'] == 99.0
+    assert stats['ops_per_sec'] == round(200 / (5050 * 1000 / 1e9), 2)
+
+def test_percentile_nearest_rank():
+    assert benchstats.percentile([], 50) is None
+    assert benchstats.percentile([1, 2, 3, 4], 50) == 2
+    assert benchstats.percentile([1, 2, 3, 4], 100) == 4
+
+def test_quiet_logging_restores_level():
+    root = logging.getLogger()
+    level = root.level
+    with benchstats.quiet_logging():
+        assert root.level == logging.WARNING
+    assert root.level == level
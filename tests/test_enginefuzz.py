@@ -0,0 +1,42 @@
+import pytest
+import enginefuzz
+import synthdata
+
+
+@pytest.fixture(scope='module')
+def databases(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('fuzz')
+    synthdata.generate(workdir / 'arcep', ranges=800, operators=10, communes=200, seed=5)
+    return enginefuzz.build_variants(str(workdir), str(workdir / 'arcep'))
+
+def test_edge_numbers_cover_range_boundaries():
+    """Each range contributes its first and last number, and those of its neighbours."""
+    assert enginefuzz.edge_numbers(['0612']) == ['0611000000', '0611999999', '0612000000', '0612999999',
+                                               '0613000000', '0613999999']
+    assert enginefuzz._neighbours('0000') == ['0001']
+
+def test_all_engines_agree_with_reference(databases):
+    """Standard, lookup table, cache, compacted and compact schema engines give the reference results."""
+    numbers, raw = enginefuzz.generate_inputs(enginefuzz.load_prefixes(databases['standard']), count=1000)
+    assert raw and enginefuzz.check_cleaning(raw) == []
+    report = enginefuzz.run(databases, numbers)
+    assert set(report) == set(enginefuzz.ENGINES)
+    assert {engine: entry['mismatches'] for engine, entry in report.items()} == dict.fromkeys(enginefuzz.ENGINES, 0)
+    assert all(entry['stats']['runs'] == len(numbers) for entry in report.values())
+
+def test_diverging_engine_is_reported(databases, monkeypatch):
+    """An engine that drops the commune of geographic numbers shows up with examples."""
+    def factory(conn):
+        def lookup(tel):
+            result = dict(enginefuzz.whoistel.normalized_full_info(conn, tel))
+            if result['type'] == 'Geographique':
+                result['location'] = None
+            return result
+        return lookup
+    monkeypatch.setitem(enginefuzz.ENGINES, 'broken', ('standard', factory))
+    numbers, _raw = enginefuzz.generate_inputs(enginefuzz.load_prefixes(databases['standard']), count=200)
+    report = enginefuzz.run(databases, numbers, engines=['broken'], max_reported=3)
+    assert set(report) == {'range_tables', 'broken'}
+    assert report['broken']['mismatches'] > 0
+    number, expected, got = report['broken']['examples'][0]
+    assert expected['location'] is not None and got['location'] is None
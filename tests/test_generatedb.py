@@ -0,0 +1,441 @@
+import os
+import sqlite3
+from contextlib import closing
+import pytest
+import generatedb
+import whoistel
+
+
+MAJOURNUMS = [
+    # EZABPQM;Tranche_Debut;Tranche_Fin;Mnémo;Territoire;Date_Attribution
+    ("01234", "0123400000", "0123499999", "OP1", "Métropole", "01/01/2000"),
+    ("01235", "0123500000", "0123599999", "OP1", "Métropole", "01/01/2000"),
+    ("0612", "0612000000", "0612999999", "OP2", "Métropole", "15/03/2005"),
+    ("09876", "0987600000", "0987699999", "OP2", "Métropole", "01/06/2010"),
+    ("0262", "0262000000", "0262999999", "OP3", "La Réunion", "01/01/2001"),
+]
+OPERATEURS = [
+    ("OP1", "Operator One"),
+    ("OP2", "Operator Two"),
+    ("OP3", "Operator Three"),
+]
+COMMUNES_HEADER = ("code_commune_INSEE,nom_commune_postal,code_postal,libelle_acheminement,ligne_5,"
+                   "latitude,longitude,code_commune,article,nom_commune,nom_commune_complet,"
+                   "code_departement,nom_departement,code_region,nom_region")
+COMMUNES = [
+    "75056,PARIS,75001,PARIS,,48.8566,2.3522,056,,Paris,Paris,75,Paris,11,Île-de-France",
+    "59350,LILLE,59000,LILLE,,50.63,3.06,350,,Lille,Lille,59,Nord,32,Hauts-de-France",
+    "59350,LILLE,59160,LILLE,LOMME,50.64,2.98,350,,Lille,Lille,59,Nord,32,Hauts-de-France",
+]
+
+def write_arcep_files(arcep_dir, ranges=MAJOURNUMS, operateurs=OPERATEURS, communes=COMMUNES):
+    """Writes small ARCEP/INSEE CSV files in the real formats (cp1252, ';' for ARCEP)."""
+    os.makedirs(arcep_dir, exist_ok=True)
+    with open(os.path.join(arcep_dir, "majournums.csv"), "w", encoding="cp1252", newline="") as f:
+        f.write("EZABPQM;Tranche_Debut;Tranche_Fin;Mnémo;Territoire;Date_Attribution\r\n")
+        for row in ranges:
+            f.write(";".join(row) + "\r\n")
+    with open(os.path.join(arcep_dir, "identifiants_ce.csv"), "w", encoding="cp1252", newline="") as f:
+        f.write("CODE_OPERATEUR;IDENTITE_OPERATEUR;ADRESSE_COMPLETE;SIREN\r\n")
+        for code, name in operateurs:
+            f.write(f"{code};{name};1 rue de Paris;123456789\r\n")
+    with open(os.path.join(arcep_dir, "communes-france.csv"), "w", encoding="utf-8", newline="") as f:
+        f.write(COMMUNES_HEADER + "\n")
+        for line in communes:
+            f.write(line + "\n")
+
+def ranges_with(prefix, operator):
+    """Sample ranges plus one extra non-geographic range."""
+    return [*MAJOURNUMS, (prefix, f"{prefix}000000", f"{prefix}999999", operator, "Métropole", "01/01/2020")]
+
+@pytest.fixture
+def arcep_dir(tmp_path):
+    """Directory populated with a small, valid set of source files."""
+    path = tmp_path / "arcep"
+    write_arcep_files(str(path))
+    return str(path)
+
+def test_build_database_imports_and_publishes(arcep_dir, tmp_path):
+    """A full build produces the expected tables and leaves no temporary file."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir)
+
+    assert os.path.exists(db_path)
+    assert not os.path.exists(db_path + generatedb.BUILD_SUFFIX)
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM PlagesNumerosGeographiques").fetchone()[0] == 2
+        # Overseas ranges go to their own partition, not the metropolitan tables
+        assert conn.execute("SELECT COUNT(*) FROM PlagesNumeros").fetchone()[0] == 2
+        assert [tuple(row) for row in conn.execute("SELECT * FROM PlagesOutreMer")] == [("262", "0262", "OP3", "La Réunion")]
+        # Main commune entry (empty ligne_5) wins over the LOMME delivery line
+        row = conn.execute("SELECT CodePostal FROM Communes WHERE CodeInsee='59350'").fetchone()
+        assert row[0] == "59000"
+        info = whoistel.get_full_info(conn, "0612345678")
+        assert info["operator"]["nom"] == "Operator Two"
+    finally:
+        conn.close()
+
+def test_overseas_numbers_resolve_in_their_partition(tmp_path):
+    """Overseas ranges are imported per country code and looked up in their own partition only."""
+    arcep = str(tmp_path / "arcep")
+    write_arcep_files(arcep, ranges=[
+        *MAJOURNUMS,
+        ("02", "0200000000", "0299999999", "OP1", "Métropole", "01/01/2000"),
+        ("0690", "0690000000", "0690999999", "OP2", "SAINT BARTHELEMY", "01/01/2001"),
+        ("0999", "0999000000", "0999999999", "OP2", "Atlantide", "01/01/2001"),
+    ])
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep)
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.row_factory = sqlite3.Row
+        assert [tuple(row) for row in conn.execute("SELECT Indicatif, PlageTel FROM PlagesOutreMer ORDER BY 1")] == [
+            ("262", "0262"), ("590", "0690")]
+        # Unknown territories are skipped
+        assert whoistel.search_number(conn, "0999123456") is None
+
+        info = whoistel.get_full_info(conn, whoistel.clean_phone_number("+262 262 12 34 56"))
+        assert info["found"] is True
+        assert info["code_operateur"] == "OP3"
+        assert info["location"] == {"region": "La Réunion"}
+        assert whoistel.get_full_info(conn, "0690123456")["location"] == {"region": "SAINT BARTHELEMY"}
+        # An unassigned overseas block does not fall back to the metropolitan '02' range
+        assert whoistel.get_full_info(conn, "0263123456")["found"] is False
+        assert whoistel.get_full_info(conn, "0245123456")["code_operateur"] == "OP1"
+
+def test_rebuild_keeps_backup_and_rolls_back(arcep_dir, tmp_path):
+    """Publishing keeps the previous file for rollback; the live path never disappears."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir)
+
+    # A reader holding the old database keeps working across the swap
+    reader = sqlite3.connect(db_path)
+    write_arcep_files(arcep_dir, ranges=ranges_with("0613", "OP2"))
+    generatedb.build_database(db_path, arcep_dir)
+    assert reader.execute("SELECT COUNT(*) FROM PlagesNumeros WHERE PlageTel='0613'").fetchone()[0] == 0
+    reader.close()
+
+    assert os.path.exists(db_path + generatedb.BACKUP_SUFFIX)
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM PlagesNumeros WHERE PlageTel='0613'").fetchone()[0] == 1
+
+    generatedb.rollback_database(db_path)
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM PlagesNumeros WHERE PlageTel='0613'").fetchone()[0] == 0
+
+def test_failed_checks_leave_current_database(arcep_dir, tmp_path):
+    """A build failing its sanity checks is discarded and the live database is untouched."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir)
+    before = os.stat(db_path).st_ino
+
+    # Truncated numbering file: only one range left
+    write_arcep_files(arcep_dir, ranges=MAJOURNUMS[:1])
+    with pytest.raises(generatedb.BuildError):
+        generatedb.build_database(db_path, arcep_dir)
+
+    assert os.stat(db_path).st_ino == before
+    assert not os.path.exists(db_path + generatedb.BUILD_SUFFIX)
+
+def test_check_database_rejects_empty_tables(tmp_path):
+    """An empty table is reported as a build error."""
+    conn = generatedb.setup_database(str(tmp_path / "empty.sqlite3"))
+    with pytest.raises(generatedb.BuildError, match="empty"):
+        generatedb.check_database(conn)
+    conn.close()
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_build_modes_produce_keyed_analyzed_database(arcep_dir, tmp_path, bulk):
+    """Both load modes end with unique keys, planner statistics and stage timings."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    timings = generatedb.build_database(db_path, arcep_dir, bulk=bulk)
+
+    assert {"operators", "numbers", "communes", "analyze+vacuum", "checks", "publish"} <= set(timings)
+    assert ("indexes" in timings) is bulk
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute("PRAGMA page_size").fetchone()[0] == generatedb.BUILD_PAGE_SIZE
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO PlagesNumeros (PlageTel, CodeOperateur) VALUES ('0612', 'X')")
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT CodeOperateur FROM PlagesNumeros WHERE PlageTel='0612'").fetchall()
+        assert "USING" in plan[0][-1]
+
+def test_streaming_import_dedupes_across_chunks(tmp_path):
+    """With one-row chunks, first-seen prefixes win and a main commune entry replaces an earlier secondary line."""
+    arcep = str(tmp_path / "arcep")
+    write_arcep_files(
+        arcep,
+        ranges=[*MAJOURNUMS, ("0612", "0612000000", "0612999999", "DUP", "Métropole", "01/01/2021")],
+        communes=[COMMUNES[2], COMMUNES[1], COMMUNES[0]],
+    )
+    conn = generatedb.setup_database(str(tmp_path / "stream.sqlite3"))
+    generatedb.import_numeros(conn, arcep, chunk_size=1)
+    generatedb.import_communes(conn, arcep, chunk_size=1)
+
+    assert conn.execute("SELECT CodeOperateur FROM PlagesNumeros WHERE PlageTel='0612'").fetchall() == [("OP2",)]
+    assert conn.execute("SELECT CodeInsee, CodePostal FROM Communes ORDER BY CodeInsee").fetchall() == [
+        ("59350", "59000"), ("75056", "75001")]
+    conn.close()
+
+def test_incremental_update_applies_diff_and_logs_changes(arcep_dir, tmp_path):
+    """Only added, removed and reassigned rows are applied, each recorded in ChangeLog."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir)
+    with closing(sqlite3.connect(db_path)) as conn:
+        build_id = conn.execute("SELECT Value FROM BuildInfo WHERE Key='build_id'").fetchone()[0]
+
+    ranges = [r for r in MAJOURNUMS if r[0] != "01235"]                      # removed
+    ranges = [(*r[:3], "OP1", *r[4:]) if r[0] == "0612" else r for r in ranges]  # reassigned
+    ranges.append(("0613", "0613000000", "0613999999", "OP2", "Métropole", "01/01/2020"))  # added
+    write_arcep_files(arcep_dir, ranges=ranges, operateurs=[("OP1", "Operator One"), ("OP2", "Operator 2"), ("OP3", "Operator Three")])
+
+    summary = generatedb.update_database(db_path, arcep_dir, dataset_date="2024-05-01")
+    assert summary["PlagesNumeros"] == {"added": 1, "removed": 0, "changed": 1}
+    assert summary["PlagesNumerosGeographiques"] == {"added": 0, "removed": 1, "changed": 0}
+    assert summary["Operateurs"] == {"added": 0, "removed": 0, "changed": 1}
+    assert summary["Communes"] == {"added": 0, "removed": 0, "changed": 0}
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        log = conn.execute(
+            "SELECT DatasetDate, TableName, Action, KeyValue FROM ChangeLog ORDER BY TableName, KeyValue").fetchall()
+        assert log == [
+            ("2024-05-01", "Operateurs", "changed", "OP2"),
+            ("2024-05-01", "PlagesNumeros", "reassigned", "0612"),
+            ("2024-05-01", "PlagesNumeros", "added", "0613"),
+            ("2024-05-01", "PlagesNumerosGeographiques", "removed", "01235"),
+        ]
+        assert conn.execute("SELECT CodeOperateur FROM PlagesNumeros WHERE PlageTel='0612'").fetchone()[0] == "OP1"
+        # Incremental updates keep the build identity; only ChangeLog moves
+        assert conn.execute("SELECT Value FROM BuildInfo WHERE Key='build_id'").fetchone()[0] == build_id
+
+    # Re-running with identical files is a no-op
+    summary = generatedb.update_database(db_path, arcep_dir, dataset_date="2024-05-02")
+    assert all(sum(counts.values()) == 0 for counts in summary.values())
+
+def test_incremental_update_refuses_truncated_input(arcep_dir, tmp_path):
+    """A staged table much smaller than the current one is not applied."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir)
+    write_arcep_files(arcep_dir, ranges=MAJOURNUMS[:1])
+
+    with pytest.raises(generatedb.BuildError):
+        generatedb.update_database(db_path, arcep_dir)
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ChangeLog").fetchone()[0] == 0
+
+def test_range_history_survives_rebuilds_and_updates(arcep_dir, tmp_path):
+    """Assignments are kept with validity intervals across full builds and incremental updates."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir, dataset_date="2020-01-01")
+
+    # Full rebuild: 0612 moves to OP1 (attributed 01/06/2021)
+    ranges = [("0612", "0612000000", "0612999999", "OP1", "Métropole", "01/06/2021") if r[0] == "0612" else r
+              for r in MAJOURNUMS]
+    write_arcep_files(arcep_dir, ranges=ranges)
+    generatedb.build_database(db_path, arcep_dir, dataset_date="2021-07-01")
+
+    # Incremental update: 01235 disappears, 09876 moves to OP1 without a usable attribution date
+    ranges = [r for r in ranges if r[0] != "01235"]
+    ranges = [("09876", "0987600000", "0987699999", "OP1", "Métropole", "") if r[0] == "09876" else r for r in ranges]
+    write_arcep_files(arcep_dir, ranges=ranges)
+    generatedb.update_database(db_path, arcep_dir, dataset_date="2023-02-01")
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        history = conn.execute(
+            "SELECT PlageTel, CodeOperateur, ValidFrom, ValidTo FROM HistoriquePlages ORDER BY PlageTel, ValidFrom").fetchall()
+        conn.row_factory = sqlite3.Row
+        assert whoistel.get_full_info(conn, "0612345678", as_of="2010-05-01")["code_operateur"] == "OP2"
+        assert whoistel.get_full_info(conn, "0612345678", as_of="2021-06-01")["code_operateur"] == "OP1"
+        assert whoistel.get_full_info(conn, "0612345678", as_of="2001-01-01")["found"] is False
+        assert whoistel.get_full_info(conn, "0123512345", as_of="2023-01-31")["found"] is True
+        assert whoistel.get_full_info(conn, "0123512345", as_of="2023-02-01")["found"] is False
+        assert whoistel.get_full_info(conn, "0987654321", as_of="2023-01-31")["code_operateur"] == "OP2"
+        assert whoistel.get_full_info(conn, "0987654321")["code_operateur"] == "OP1"
+        assert conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'idx_HistoriquePlages_validity'").fetchone() is not None
+
+    assert history == [
+        ("01234", "OP1", "2000-01-01", generatedb.HISTORY_OPEN_END),
+        ("01235", "OP1", "2000-01-01", "2023-02-01"),
+        ("0262", "OP3", "2001-01-01", generatedb.HISTORY_OPEN_END),
+        ("0612", "OP2", "2005-03-15", "2021-06-01"),
+        ("0612", "OP1", "2021-06-01", generatedb.HISTORY_OPEN_END),
+        ("09876", "OP2", "2010-06-01", "2023-02-01"),
+        ("09876", "OP1", "2023-02-01", generatedb.HISTORY_OPEN_END),
+    ]
+
+def test_failed_history_carry_drops_the_build(arcep_dir, tmp_path, monkeypatch):
+    """An error after the fresh history was replaced fails the build instead of publishing a partial history."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir, dataset_date="2020-01-01")
+    with closing(sqlite3.connect(db_path)) as conn:
+        before = conn.execute("SELECT * FROM HistoriquePlages ORDER BY PlageTel").fetchall()
+
+    def broken_merge(conn, fresh, dataset_date):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(generatedb, "merge_range_history", broken_merge)
+    with pytest.raises(sqlite3.OperationalError):
+        generatedb.build_database(db_path, arcep_dir, dataset_date="2021-07-01")
+
+    assert not os.path.exists(db_path + generatedb.BUILD_SUFFIX)
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute("SELECT * FROM HistoriquePlages ORDER BY PlageTel").fetchall() == before
+
+def test_compact_prefixes_merges_complete_sibling_groups():
+    """Complete groups of identical siblings collapse level by level; incomplete or mixed groups stay."""
+    entries = {f"0612{d}": ("OP1",) for d in "0123456789"}             # complete -> 0612
+    entries.update({f"0613{d}{e}": ("OP2",) for d in "0123456789" for e in "0123456789"})  # -> 0613x -> 0613
+    entries["0613"] = ("OP9",)                                          # shadowed parent, overwritten
+    entries.update({f"0614{d}": ("OP1",) for d in "012345678"})         # incomplete
+    entries.update({f"0615{d}": ("OP1",) for d in "012345678"})
+    entries["06159"] = ("OP3",)                                         # mixed
+    entries["061234"] = ("OP4",)                                        # longer prefix under a merged group
+
+    compacted = generatedb.compact_prefixes(entries)
+    assert compacted["0612"] == ("OP1",) and "06125" not in compacted
+    assert compacted["0613"] == ("OP2",) and "06135" not in compacted and "061355" not in compacted
+    assert compacted["061234"] == ("OP4",)
+    assert "0614" not in compacted and "0615" not in compacted
+    assert len(compacted) == 2 + 1 + 9 + 10
+    generatedb.verify_compaction(entries, compacted)
+
+    # A wrong compaction (dropping the more specific range) is caught
+    broken = dict(compacted)
+    del broken["061234"]
+    with pytest.raises(generatedb.BuildError):
+        generatedb.verify_compaction(entries, broken)
+
+def test_build_database_compact(arcep_dir, tmp_path):
+    """A compacted build answers like a plain one, and incremental updates fall back to a compacted rebuild."""
+    ranges = [*MAJOURNUMS, *[(f"0613{d}", f"0613{d}00000", f"0613{d}99999", "OP1", "Métropole", "01/01/2020")
+                             for d in "0123456789"]]
+    write_arcep_files(arcep_dir, ranges=ranges)
+    plain_path = str(tmp_path / "plain.sqlite3")
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(plain_path, arcep_dir)
+    generatedb.build_database(db_path, arcep_dir, compact=True)
+
+    with closing(sqlite3.connect(db_path)) as conn, closing(sqlite3.connect(plain_path)) as plain:
+        assert conn.execute("SELECT COUNT(*) FROM PlagesNumeros").fetchone()[0] == 3
+        assert conn.execute("SELECT CodeOperateur FROM PlagesNumeros WHERE PlageTel = '0613'").fetchone()[0] == "OP1"
+        conn.row_factory = plain.row_factory = sqlite3.Row
+        for number in ("0613512345", "0612345678", "0987654321", "0123456789", "0799999999"):
+            ours, theirs = whoistel.get_full_info(conn, number), whoistel.get_full_info(plain, number)
+            assert (ours["found"], ours.get("code_operateur")) == (theirs["found"], theirs.get("code_operateur"))
+        build_id = conn.execute("SELECT Value FROM BuildInfo WHERE Key = 'build_id'").fetchone()[0]
+
+    assert generatedb.update_database(db_path, arcep_dir) == {}
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert generatedb.is_compacted(conn)
+        assert conn.execute("SELECT Value FROM BuildInfo WHERE Key = 'build_id'").fetchone()[0] != build_id
+
+def test_lookup_table_matches_normalised_lookups(arcep_dir, tmp_path):
+    """LookupNumeros answers exactly like the normalised tables, and follows incremental updates."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    write_arcep_files(arcep_dir, ranges=ranges_with("0699", "OPX"))  # OPX is not a known operator
+    generatedb.build_database(db_path, arcep_dir)
+    numbers = ("0123456789", "0123512345", "0612345678", "0987654321", "0699123456", "0799999999")
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.row_factory = sqlite3.Row
+        conn.execute("UPDATE PlagesNumerosGeographiques SET CodeInsee = '75056' WHERE PlageTel = '01234'")
+        conn.execute("UPDATE Operateurs SET MailOperateur = 'not-an-email', SiteOperateur = 'https://op1.example' "
+                     "WHERE CodeOperateur = 'OP1'")
+        generatedb.build_lookup_table(conn)
+        conn.commit()
+        for number in numbers:
+            assert whoistel.lookup_full_info(conn, number) == whoistel.normalized_full_info(conn, number)
+        paris = whoistel.get_full_info(conn, "0123456789")
+        assert paris["location"]["commune"] == "Paris" and paris["location"]["region"] == "Île-de-France"
+        assert paris["operator"]["mail"] is None and paris["operator"]["site"] == "https://op1.example"
+        assert whoistel.get_full_info(conn, "0699123456")["operator"]["nom"] == "Inconnu"
+
+    write_arcep_files(arcep_dir, ranges=ranges_with("0699", "OP3"))
+    generatedb.update_database(db_path, arcep_dir)
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.row_factory = sqlite3.Row
+        assert whoistel.get_full_info(conn, "0699123456")["operator"]["nom"] == "Operator Three"
+        for number in numbers:
+            assert whoistel.lookup_full_info(conn, number) == whoistel.normalized_full_info(conn, number)
+
+def test_build_database_compact_schema(arcep_dir, tmp_path):
+    """The integer-keyed schema gives the same lookups as the text schema and survives incremental updates."""
+    plain_path = str(tmp_path / "plain.sqlite3")
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(plain_path, arcep_dir)
+    generatedb.build_database(db_path, arcep_dir, compact_schema=True)
+    numbers = ("0123456789", "0123512345", "0612345678", "0987654321", "0262123456", "0799999999")
+
+    with closing(sqlite3.connect(db_path)) as conn, closing(sqlite3.connect(plain_path)) as plain:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert {"PlagesCompactes", "CodesOperateurs"} <= tables
+        assert not tables & {"PlagesNumeros", "PlagesNumerosGeographiques", "LookupNumeros"}
+        assert conn.execute("SELECT Longueur, Prefixe FROM PlagesCompactes WHERE Geographique = 0 "
+                            "ORDER BY Prefixe").fetchall() == [(4, 612), (5, 9876)]
+        conn.row_factory = plain.row_factory = sqlite3.Row
+        for number in numbers:
+            assert whoistel.get_full_info(conn, number) == whoistel.get_full_info(plain, number)
+
+    write_arcep_files(arcep_dir, ranges=ranges_with("0699", "OP3"))
+    generatedb.update_database(db_path, arcep_dir)
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.row_factory = sqlite3.Row
+        assert generatedb.has_compact_schema(conn)
+        assert whoistel.get_full_info(conn, "0699123456")["operator"]["nom"] == "Operator Three"
+
+def test_engine_selected_from_schema_not_errors(arcep_dir, tmp_path):
+    """The lookup engine follows the tables of the database; unrelated SQLite errors are not rerouted."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    generatedb.build_database(db_path, arcep_dir)
+    with closing(sqlite3.connect(db_path, factory=whoistel.Connection)) as conn:
+        conn.row_factory = sqlite3.Row
+        assert whoistel.database_tables(conn) is whoistel.database_tables(conn)
+        explanation = whoistel.explain_lookup(conn, "0612345678")
+        assert explanation["engine"] == "lookup_table"
+        # A single query covers every candidate prefix
+        assert [(probe["table"], len(probe["prefixes"]), probe["match"]) for probe in explanation["probes"]] == \
+            [("LookupNumeros", 8, "0612")]
+        conn.execute("DROP TABLE LookupNumeros")
+        conn.tables = None
+        assert whoistel.explain_lookup(conn, "0612345678")["engine"] == "range_tables"
+        conn.execute("DROP TABLE PlagesNumeros")
+        conn.tables = None
+        with pytest.raises(sqlite3.OperationalError, match="PlagesNumeros"):
+            whoistel.search_number(conn, "0612345678")
+
+def test_build_database_memory_profile(arcep_dir, tmp_path):
+    """With a StageMemory, every timed stage also gets a memory record."""
+    import memprofile
+    memory = memprofile.StageMemory(top=2)
+    try:
+        timings = generatedb.build_database(str(tmp_path / "whoistel.sqlite3"), arcep_dir, memory=memory)
+    finally:
+        memory.stop()
+    assert list(memory.stages) == list(timings)
+    assert all(stage['traced_peak'] >= 0 and len(stage['top']) <= 2 for stage in memory.stages.values())
+
+
+def test_cli_memprofile_stops_tracing(arcep_dir, tmp_path, monkeypatch):
+    """--memprofile writes its report and leaves tracemalloc stopped after the build."""
+    import json
+    import tracemalloc
+    output = tmp_path / "memory.json"
+    monkeypatch.setattr("sys.argv", ["generatedb.py", "--db", str(tmp_path / "whoistel.sqlite3"), "--arcep-dir", arcep_dir,
+                                     "--memprofile", "2", "--memprofile-output", str(output)])
+    generatedb.main()
+    assert not tracemalloc.is_tracing()
+    assert json.loads(output.read_text(encoding="utf-8"))
+
+
+def test_import_leaves_root_logger_alone():
+    """Importing generatedb must not configure logging for the importing program."""
+    import subprocess
+    import sys
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    code = "import logging, generatedb; assert not logging.getLogger().handlers"
+    subprocess.run([sys.executable, "-c", code], cwd=root, check=True)
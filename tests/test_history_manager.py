@@ -1,5 +1,7 @@
 import pytest
 import sqlite3
+import time
+from contextlib import closing
 import history_manager
 
 
@@ -11,33 +13,11 @@ def history_db_connection(tmp_path):
     """Provides a connection to a temporary history database."""
     db_path = tmp_path / TEST_HISTORY_DB
     
-    # Initialize schema
+    # Initialize schema (reports table, indexes and aggregates) on this connection
     conn = sqlite3.connect(db_path)
-    if hasattr(history_manager, "init_history_db"):
-        # We need to monkeypatch DB_FILE or pass conn if possible.
-        # history_manager.init_history_db uses get_db_connection() which uses DB_FILE.
-        # But our history_manager functions accept a 'conn' argument.
-        # Let's create the schema manually or assume init_history_db can be bypassed 
-        # if we provide the connection with schema.
-        
-        # Actually simplest is to run the init logic on this conn directly.
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone_number TEXT NOT NULL,
-                report_date DATE,
-                is_spam INTEGER DEFAULT 0,
-                comment TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        c.execute('''
-            CREATE INDEX IF NOT EXISTS idx_reports_phone_number_spam ON reports (phone_number, is_spam);
-        ''')
-        conn.commit()
-
     conn.row_factory = sqlite3.Row
+    history_manager.init_history_db(conn=conn)
+
     yield conn
     conn.close()
 
@@ -194,3 +174,171 @@ def test_history_manager_add_report_and_get_spam_count_without_conn(tmp_path, mo
     # Spam count should now be 1, using implicit connection again
     updated_count = history_manager.get_spam_count(number)
     assert updated_count == 1
+
+def test_get_top_reported_windows(history_db_connection):
+    """Leaderboard ranks numbers by report count and honours the rolling window."""
+    conn = history_db_connection
+    for _ in range(3):
+        history_manager.add_report("0111111111", None, True, "spam", conn=conn)
+    history_manager.add_report("0222222222", None, False, "note", conn=conn)
+
+    now = time.time()
+    top = history_manager.get_top_reported('24h', now=now, conn=conn)
+    assert [e["phone_number"] for e in top] == ["0111111111", "0222222222"]
+    assert top[0]["report_count"] == 3
+    assert top[0]["spam_count"] == 3
+    assert top[1]["spam_count"] == 0
+
+    # Three days later the reports fall out of the 24h window but not the 7d one
+    later = now + 3 * history_manager.DAY_SECONDS
+    assert history_manager.get_top_reported('24h', now=later, conn=conn) == []
+    assert len(history_manager.get_top_reported('7d', now=later, conn=conn)) == 2
+
+    with pytest.raises(ValueError):
+        history_manager.get_top_reported('1y', conn=conn)
+
+def test_top_reported_counts_the_day_the_window_starts_in(history_db_connection):
+    """Once folded into a daily bucket, a report from the first, partial day of the window still counts."""
+    conn = history_db_connection
+    day = history_manager.DAY_SECONDS
+    base = 1_700_000_000 // day * day
+    history_manager._record_bucket(conn, "0555555555", True, base + 18 * 3600)
+    conn.commit()
+
+    # The 7d window starts at noon on the report's day, six hours before it
+    now = base + 7 * day + 12 * 3600
+    history_manager.compact_report_buckets(now, conn=conn)
+    assert [tuple(r) for r in conn.execute("SELECT bucket_start FROM report_buckets")] == [(base,)]
+    assert history_manager.get_top_reported('7d', now=now, conn=conn) == [
+        {"phone_number": "0555555555", "report_count": 1, "spam_count": 1}]
+    assert history_manager.get_top_reported('7d', now=now + day, conn=conn) == []
+
+def test_top_reported_cache_is_per_database(tmp_path, monkeypatch):
+    """Cached leaderboards are not shared between connections to different files."""
+    monkeypatch.setattr(history_manager, "LEADERBOARD_CACHE_TTL", 60)
+    history_manager.clear_leaderboard_cache()
+    tops = []
+    for number in ("0611111111", "0622222222"):
+        with closing(sqlite3.connect(tmp_path / f"{number}.sqlite3")) as conn:
+            conn.row_factory = sqlite3.Row
+            history_manager.init_history_db(conn=conn)
+            history_manager.add_report(number, None, True, "spam", conn=conn)
+            tops.append([e["phone_number"] for e in history_manager.get_top_reported('24h', conn=conn)])
+    history_manager.clear_leaderboard_cache()
+    assert tops == [["0611111111"], ["0622222222"]]
+
+def test_compact_report_buckets_preserves_totals(history_db_connection):
+    """Compaction folds old hourly buckets into daily ones without changing totals."""
+    conn = history_db_connection
+    base = 1_700_000_000 // history_manager.DAY_SECONDS * history_manager.DAY_SECONDS
+    for hour in (1, 2, 5):
+        history_manager._record_bucket(conn, "0333333333", True, base + hour * 3600)
+    conn.commit()
+
+    now = base + 5 * history_manager.DAY_SECONDS
+    history_manager.compact_report_buckets(now, conn=conn)
+
+    rows = conn.execute("SELECT bucket_start, report_count FROM report_buckets").fetchall()
+    assert [tuple(r) for r in rows] == [(base, 3)]
+    top = history_manager.get_top_reported('7d', now=now, conn=conn)
+    assert top[0]["report_count"] == 3
+
+    # Past the maximum age the buckets are dropped entirely
+    history_manager.compact_report_buckets(now + history_manager.BUCKET_MAX_AGE, conn=conn)
+    assert conn.execute("SELECT COUNT(*) FROM report_buckets").fetchone()[0] == 0
+
+def test_init_history_db_backfills_buckets(history_db_connection):
+    """Existing reports are aggregated when the bucket table is first created."""
+    conn = history_db_connection
+    history_manager.add_report("0444444444", None, True, "spam", conn=conn)
+    conn.execute("DROP TABLE report_buckets")
+    conn.commit()
+
+    history_manager.init_history_db(conn=conn)
+    top = history_manager.get_top_reported('24h', now=time.time(), conn=conn)
+    assert top == [{"phone_number": "0444444444", "report_count": 1, "spam_count": 1}]
+
+
+def test_heatmap_enriched_on_insert_and_rebuilt(history_db_connection, db_connection):
+    """Reports are enriched with their ARCEP block on insert; rebuild yields the same counters."""
+    conn = history_db_connection
+    history_manager.add_report("0123456789", None, True, "spam", lookup_conn=db_connection, conn=conn)
+    history_manager.add_report("0123400000", None, False, "note", lookup_conn=db_connection, conn=conn)
+    history_manager.add_report("0799999999", None, True, "unknown", lookup_conn=db_connection, conn=conn)
+
+    by_prefix = history_manager.get_heatmap('prefix', conn=conn)
+    assert by_prefix[0] == {
+        "prefix": "01234", "code_operateur": "OP1", "region": "Île-de-France",
+        "report_count": 2, "spam_count": 1,
+    }
+    by_operator = {e["code_operateur"]: e["spam_count"] for e in history_manager.get_heatmap('operator', conn=conn)}
+    assert by_operator == {"OP1": 1, "": 1}
+
+    assert history_manager.rebuild_heatmap(db_connection, conn=conn) == 3
+    assert history_manager.get_heatmap('prefix', conn=conn) == by_prefix
+
+    with pytest.raises(ValueError):
+        history_manager.get_heatmap('city', conn=conn)
+
+def test_init_history_db_backfills_heatmap(history_db_connection, db_connection):
+    """A heatmap added to an existing database is backfilled when an ARCEP connection is given."""
+    conn = history_db_connection
+    history_manager.add_report("0123456789", None, True, "spam", conn=conn)
+    conn.execute("DROP TABLE spam_heatmap")
+    conn.commit()
+
+    history_manager.init_history_db(lookup_conn=db_connection, conn=conn)
+    assert history_manager.get_heatmap('prefix', conn=conn) == [{
+        "prefix": "01234", "code_operateur": "OP1", "region": "Île-de-France",
+        "report_count": 1, "spam_count": 1,
+    }]
+
+def test_sharded_layout_keeps_api(tmp_path, monkeypatch):
+    """With HISTORY_SHARDS, reports are routed by number and reads merge all shards."""
+    monkeypatch.setattr(history_manager, "DB_FILE", str(tmp_path / "history.sqlite3"))
+    monkeypatch.setattr(history_manager, "HISTORY_SHARDS", 4)
+    history_manager.init_history_db()
+
+    numbers = [f"06000000{i:02d}" for i in range(12)]
+    for number in numbers:
+        history_manager.add_report(number, None, True, f"spam {number}")
+    history_manager.add_report(numbers[0], None, True, "again")
+
+    # Every shard file exists and each number is stored in exactly one of them
+    paths = history_manager.shard_paths(4)
+    assert [p.split("/")[-1] for p in paths][0] == "history.00-of-04.sqlite3"
+    per_shard = []
+    for path in paths:
+        conn = sqlite3.connect(path)
+        per_shard.append({r[0] for r in conn.execute("SELECT phone_number FROM reports")})
+        conn.close()
+    assert sum(len(s) for s in per_shard) == len(numbers)
+    assert sum(1 for s in per_shard if s) > 1
+
+    assert history_manager.get_spam_count(numbers[0]) == 2
+    recent = history_manager.get_recent_reports(limit=5)
+    assert len(recent) == 5
+    assert [r["created_at"] for r in recent] == sorted((r["created_at"] for r in recent), reverse=True)
+
+    top = history_manager.get_top_reported('24h', limit=1, now=time.time())
+    assert top == [{"phone_number": numbers[0], "report_count": 2, "spam_count": 2}]
+
+def test_reshard_round_trip(tmp_path, monkeypatch):
+    """Resharding a single file and back preserves reports and counters."""
+    monkeypatch.setattr(history_manager, "DB_FILE", str(tmp_path / "history.sqlite3"))
+    history_manager.init_history_db()
+    for i in range(20):
+        history_manager.add_report(f"07000000{i:02d}", None, i % 2 == 0, f"report {i}")
+
+    assert history_manager.reshard(3, source_shards=0) == 20
+    with pytest.raises(ValueError):
+        history_manager.reshard(3, source_shards=0)
+
+    monkeypatch.setattr(history_manager, "HISTORY_SHARDS", 3)
+    assert history_manager.get_spam_count("0700000000") == 1
+    assert history_manager.get_spam_count("0700000001") == 0
+    assert len(history_manager.get_recent_reports(limit=100)) == 20
+    assert len(history_manager.get_top_reported('24h', limit=100, now=time.time())) == 20
+
+    with pytest.raises(ValueError):
+        history_manager.reshard(3)
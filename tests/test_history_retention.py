@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import sqlite3
+import time
+import pytest
+import history_manager
+import history_retention
+
+
+@pytest.fixture
+def history_db_connection(tmp_path):
+    """Provides a connection to a temporary history database with its schema."""
+    conn = sqlite3.connect(tmp_path / "history.sqlite3")
+    conn.row_factory = sqlite3.Row
+    history_manager.init_history_db(conn=conn)
+    yield conn
+    conn.close()
+
+def _insert_report(conn, number, is_spam, created_at):
+    conn.execute(
+        "INSERT INTO reports (phone_number, is_spam, comment, created_at) VALUES (?, ?, ?, ?)",
+        (number, 1 if is_spam else 0, f"report {created_at}", created_at))
+    conn.commit()
+
+def test_run_retention_archives_monthly_sqlite_and_keeps_counts(history_db_connection, tmp_path):
+    """Old reports move to monthly SQLite archives while spam counts stay unchanged."""
+    conn = history_db_connection
+    number = "0123456789"
+    _insert_report(conn, number, True, "2024-01-05 10:00:00")
+    _insert_report(conn, number, True, "2024-02-10 10:00:00")
+    _insert_report(conn, number, False, "2024-02-11 10:00:00")
+    _insert_report(conn, number, True, "2024-06-01 10:00:00")
+    assert history_manager.get_spam_count(number, conn=conn) == 3
+
+    now = time.mktime(time.strptime("2024-06-02", "%Y-%m-%d"))
+    archive_dir = tmp_path / "archive"
+    moved = history_retention.run_retention(
+        days=30, archive_dir=str(archive_dir), archive_format='sqlite',
+        batch_size=2, pause=0, now=now, conn=conn)
+
+    assert moved == 3
+    assert conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0] == 1
+    assert history_manager.get_spam_count(number, conn=conn) == 3
+    assert sorted(p.name for p in archive_dir.iterdir()) == [
+        "reports-2024-01.sqlite3", "reports-2024-02.sqlite3"]
+
+    archive = sqlite3.connect(archive_dir / "reports-2024-02.sqlite3")
+    assert archive.execute("SELECT COUNT(*) FROM reports").fetchone()[0] == 2
+    archive.close()
+
+    # Nothing left to archive on a second run
+    assert history_retention.run_retention(
+        days=30, archive_dir=str(archive_dir), pause=0, now=now, conn=conn) == 0
+
+def test_run_retention_jsonl_archive(history_db_connection, tmp_path):
+    """The JSONL format writes one gzip-compressed line per archived report."""
+    conn = history_db_connection
+    _insert_report(conn, "0987654321", True, "2023-12-24 08:30:00")
+
+    archive_dir = tmp_path / "archive"
+    history_retention.run_retention(
+        days=1, archive_dir=str(archive_dir), archive_format='jsonl', pause=0, conn=conn)
+
+    with gzip.open(archive_dir / "reports-2023-12.jsonl.gz", 'rt', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 1
+    assert lines[0]["phone_number"] == "0987654321"
+    assert lines[0]["is_spam"] == 1
+
+def _archived_ids(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return sorted(json.loads(line)["id"] for line in f)
+
+def test_jsonl_batch_archived_once_when_delete_fails(history_db_connection, tmp_path):
+    """Lines of a batch whose transaction fails are not appended, so the retry archives each report once."""
+    conn = history_db_connection
+    for day in (1, 2, 3):
+        _insert_report(conn, "0987654321", True, f"2023-12-0{day} 08:30:00")
+    conn.execute("CREATE TRIGGER block_delete BEFORE DELETE ON reports BEGIN SELECT RAISE(ABORT, 'locked'); END")
+    archive_dir = tmp_path / "archive"
+
+    with pytest.raises(sqlite3.IntegrityError):
+        history_retention.run_retention(days=1, archive_dir=str(archive_dir), archive_format='jsonl', pause=0, conn=conn)
+    assert list(archive_dir.iterdir()) == []
+
+    conn.execute("DROP TRIGGER block_delete")
+    history_retention.run_retention(days=1, archive_dir=str(archive_dir), archive_format='jsonl', pause=0, conn=conn)
+    assert _archived_ids(archive_dir / "reports-2023-12.jsonl.gz") == [1, 2, 3]
+
+def test_interrupted_jsonl_batches_are_recovered(history_db_connection, tmp_path):
+    """A run finishes an interrupted append and discards a batch whose rows were never deleted."""
+    conn = history_db_connection
+    _insert_report(conn, "0987654321", True, "2023-11-01 08:30:00")
+    _insert_report(conn, "0987654321", True, "2023-12-01 08:30:00")
+    archive_dir = tmp_path / "archive"
+    archive_dir.mkdir()
+    rows = conn.execute("SELECT * FROM reports ORDER BY id").fetchall()
+
+    # November: committed, then interrupted halfway through the append
+    archive = archive_dir / "reports-2023-11.jsonl.gz"
+    staged = history_retention._archive_jsonl(str(archive_dir), "2023-11", rows[:1])
+    conn.execute("DELETE FROM reports WHERE id = ?", (rows[0]["id"],))
+    conn.commit()
+    claimed = f"{archive}{history_retention.APPEND_SUFFIX}0"
+    os.replace(staged, claimed)
+    with open(claimed, 'rb') as f:
+        archive.write_bytes(f.read()[:10])
+    # December: staged, but the process died before the transaction committed
+    history_retention._archive_jsonl(str(archive_dir), "2023-12", rows[1:])
+
+    history_retention.run_retention(days=1, archive_dir=str(archive_dir), archive_format='jsonl', pause=0, conn=conn)
+    assert _archived_ids(archive) == [rows[0]["id"]]
+    assert _archived_ids(archive_dir / "reports-2023-12.jsonl.gz") == [rows[1]["id"]]
+    assert sorted(p.name for p in archive_dir.iterdir()) == ["reports-2023-11.jsonl.gz", "reports-2023-12.jsonl.gz"]
+
+def test_run_retention_skips_while_another_run_holds_the_lock(history_db_connection, tmp_path):
+    """Only one retention run at a time per archive directory, e.g. across web workers."""
+    conn = history_db_connection
+    _insert_report(conn, "0987654321", True, "2023-12-24 08:30:00")
+    archive_dir = tmp_path / "archive"
+    archive_dir.mkdir()
+    with history_retention.job_lock(str(archive_dir)) as acquired:
+        assert acquired
+        assert history_retention.run_retention(days=1, archive_dir=str(archive_dir), pause=0, conn=conn) == 0
+    assert history_retention.run_retention(days=1, archive_dir=str(archive_dir), pause=0, conn=conn) == 1
+
+def test_run_retention_rejects_invalid_settings(history_db_connection, tmp_path):
+    """Retention needs a positive number of days and a known format."""
+    with pytest.raises(ValueError):
+        history_retention.run_retention(days=0, conn=history_db_connection)
+    with pytest.raises(ValueError):
+        history_retention.run_retention(days=10, archive_format='csv', conn=history_db_connection)
+
+def test_incremental_vacuum_releases_free_pages(history_db_connection):
+    """Incremental vacuum empties the freelist of a database created by init_history_db."""
+    conn = history_db_connection
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    conn.executemany(
+        "INSERT INTO reports (phone_number, comment) VALUES (?, ?)",
+        [("0123456789", "x" * 500) for _ in range(200)])
+    conn.commit()
+    conn.execute("DELETE FROM reports")
+    conn.commit()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+
+    steps = history_retention.incremental_vacuum(conn, pages=10, pause=0)
+    assert steps > 1
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
@@ -0,0 +1,59 @@
+import random
+from collections import Counter
+from contextlib import closing
+import pytest
+import generatedb
+import history_manager
+import loadtest
+import synthdata
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('load')
+    data = synthdata.generate(workdir / 'arcep', ranges=300, operators=5, communes=50, seed=1)
+    db_path = str(workdir / 'whoistel.sqlite3')
+    generatedb.build_database(db_path, str(workdir / 'arcep'))
+    return db_path, str(workdir / 'history.sqlite3'), data
+
+def test_zipf_sampler_favours_first_items():
+    """Rank 1 is drawn most often and the draw counts decrease with the rank."""
+    sampler = loadtest.ZipfSampler(['a', 'b', 'c', 'd'], s=1.0)
+    rng = random.Random(0)
+    counts = Counter(sampler(rng) for _ in range(20000))
+    assert counts['a'] > counts['b'] > counts['c'] > counts['d'] > 0
+    assert abs(counts['a'] / counts['b'] - 2) < 0.2
+
+def test_load_numbers_from_database(dataset):
+    """Numbers are drawn under the database's ranges."""
+    db_path, _history, data = dataset
+    numbers = loadtest.load_numbers(db_path, count=50)
+    prefixes = set(data['metro']) | set(data['overseas'])
+    assert len(numbers) == 50
+    assert all(len(n) == 10 and any(n.startswith(p) for p in prefixes) for n in numbers)
+
+def test_closed_loop_in_process(dataset):
+    """Every route of the mix gets traffic without errors; reports pass CSRF and are stored."""
+    db_path, history_path, _data = dataset
+    numbers = loadtest.load_numbers(db_path, count=100)
+    with loadtest.local_app(db_path, history_path) as app:
+        results = loadtest.run_load(lambda: loadtest.WSGIClient(app), numbers,
+                                    mix={'view': 6, 'report': 2, 'history': 2}, concurrency=2, duration=0.5)
+        with closing(history_manager.get_db_connection()) as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+    routes = results['routes']
+    assert set(routes) == {'view', 'report', 'history', 'total'}
+    assert routes['total']['errors'] == 0
+    assert routes['report']['statuses'] == {'302': routes['report']['requests']}
+    assert stored == routes['report']['requests']
+    assert routes['total']['requests'] == sum(routes[r]['requests'] for r in ('view', 'report', 'history'))
+
+def test_fixed_rate_over_http(dataset):
+    """At a fixed rate the request count follows the schedule, here through a local port."""
+    db_path, history_path, _data = dataset
+    numbers = loadtest.load_numbers(db_path, count=100)
+    with loadtest.local_app(db_path, history_path) as app, loadtest.serve(app) as url:
+        results = loadtest.run_load(lambda: loadtest.HTTPClient(url), numbers, mix={'view': 1},
+                                    concurrency=2, duration=0.5, rate=40)
+    assert 18 <= results['routes']['view']['requests'] <= 20
+    assert results['routes']['view']['errors'] == 0
@@ -0,0 +1,42 @@
+import sys
+import threading
+import memprofile
+
+
+def test_deep_sizeof_counts_reachable_objects_once():
+    """Nested containers and object attributes are included; shared objects and locks are not double counted."""
+    shared = 'x' * 1000
+    assert memprofile.deep_sizeof([shared, shared]) == sys.getsizeof([shared, shared]) + sys.getsizeof(shared)
+
+    class Holder:
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.entries = {i: str(i) * 10 for i in range(100)}
+    holder = Holder()
+    assert memprofile.deep_sizeof(holder) > memprofile.deep_sizeof(holder.entries) > 100 * 10
+
+def test_describe_structures():
+    """Entry counts come from the description, sizes from the object; absent structures weigh nothing."""
+    data = {i: i for i in range(10)}
+    report = memprofile.describe_structures({'data': lambda: (len(data), data), 'none': lambda: (0, None)})
+    assert report['data']['entries'] == 10 and report['data']['bytes'] >= sys.getsizeof(data)
+    assert report['none'] == {'entries': 0, 'bytes': 0}
+
+def test_stage_memory_records_each_stage():
+    """Each stage records RSS, its tracemalloc peak and the lines that allocated during it."""
+    memory = memprofile.StageMemory(top=3)
+    try:
+        with memory.stage('allocate'):
+            blob = [bytearray(1000) for _ in range(1000)]
+        with memory.stage('idle'):
+            pass
+    finally:
+        memory.stop()
+    allocate = memory.stages['allocate']
+    assert allocate['traced_peak'] >= 1000 * 1000
+    assert allocate['top'][0]['where'].endswith(f"test_memprofile.py:{test_stage_memory_records_each_stage.__code__.co_firstlineno + 5}")
+    assert memory.stages['idle']['traced_peak'] < allocate['traced_peak']
+    if memprofile.rss_bytes() is not None:
+        assert allocate['peak_rss'] >= allocate['rss_before']
+    assert 'allocate: RSS' in memory.format()
+    del blob
@@ -0,0 +1,56 @@
+import metrics
+
+
+def test_counter_and_histogram_render_exposition_format():
+    """Counters render one sample per label set; histograms render cumulative buckets, sum and count."""
+    registry = metrics.Registry()
+    requests = registry.counter('test_requests_total', "Requests.", ('route',))
+    latency = registry.histogram('test_latency_seconds', "Latency.", buckets=(0.1, 1.0))
+    requests.inc('/view/<number>')
+    requests.inc('/view/<number>', amount=2)
+    latency.observe(0.05)
+    latency.observe(0.1)
+    latency.observe(5)
+
+    text = registry.render()
+    assert '# TYPE test_requests_total counter' in text
+    assert 'test_requests_total{route="/view/<number>"} 3' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_latency_seconds_sum 5.15' in text
+    assert 'test_latency_seconds_count 3' in text
+
+def test_registry_reuses_metrics_and_escapes_labels():
+    """Registering a name twice returns the same metric; label values are escaped."""
+    registry = metrics.Registry()
+    first = registry.counter('test_total', "Test.", ('value',))
+    assert registry.counter('test_total', "Test.", ('value',)) is first
+    first.inc('a "quoted"\nvalue')
+    assert 'test_total{value="a \\"quoted\\"\\nvalue"} 1' in registry.render()
+
+    registry.callback('test_cache_total', "Cache.", 'counter', ('result',), lambda: {('hit',): 1})
+    registry.callback('test_cache_total', "Cache.", 'counter', ('result',), lambda: {('hit',): 7})
+    assert 'test_cache_total{result="hit"} 7' in registry.render()
+
+def test_histogram_time_observes_duration():
+    """The time() context manager records one observation per block."""
+    histogram = metrics.Histogram('test_seconds', "Test.", ('stage',))
+    with histogram.time('lookup'):
+        pass
+    assert histogram.count('lookup') == 1
+    assert histogram.count('other') == 0
+
+def test_lookup_stages_record_only_when_enabled(monkeypatch):
+    """CLI and batch lookups leave the stage histogram untouched unless metrics are enabled."""
+    import whoistel
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    before = len(metrics.LOOKUP_STAGE_LATENCY)
+    with whoistel.timed_stage('test_stage_disabled'):
+        pass
+    assert len(metrics.LOOKUP_STAGE_LATENCY) == before
+
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    with whoistel.timed_stage('test_stage_enabled'):
+        pass
+    assert len(metrics.LOOKUP_STAGE_LATENCY) == before + 1
@@ -0,0 +1,59 @@
+import pstats
+import profiling
+
+
+def test_sampler_selects_one_in_n():
+    """The sampler selects every n-th call; 0 disables it."""
+    sample = profiling.Sampler(3)
+    assert [sample() for _ in range(6)] == [False, False, True, False, False, True]
+    assert not any(profiling.Sampler(0)() for _ in range(5))
+
+def test_profiled_writes_pstats_and_index(tmp_path):
+    """A profiled block produces a loadable pstats file listed in the index with its metadata."""
+    with profiling.profiled(str(tmp_path), label='cli batch numeros.csv', route='cli'):
+        sum(i * i for i in range(1000))
+    entries = profiling.load_index(str(tmp_path))
+    assert len(entries) == 1
+    assert entries[0]['route'] == 'cli'
+    assert entries[0]['file'].endswith('-cli-batch-numeros-csv.prof')
+    path = profiling.profile_path(str(tmp_path), entries[0]['file'])
+    assert pstats.Stats(path).total_calls > 0
+    # Only files of the profile directory can be served
+    assert profiling.profile_path(str(tmp_path), '../index.jsonl') is None
+    assert profiling.profile_path(str(tmp_path), profiling.INDEX_FILE) is None
+
+def test_token_matches():
+    assert profiling.token_matches('secret', 'secret')
+    assert not profiling.token_matches('other', 'secret')
+    assert not profiling.token_matches('', '')
+    assert not profiling.token_matches(None, None)
+
+def test_save_keeps_only_newest_profiles(tmp_path):
+    """Beyond `keep` profiles, the oldest files and their index entries are deleted."""
+    for i in range(5):
+        profiler = profiling.start()
+        profiling.save(profiler, str(tmp_path), keep=3, label=f'run {i}')
+    assert len(list(tmp_path.glob('*.prof'))) == 3
+    assert [entry['label'] for entry in profiling.load_index(str(tmp_path))] == ['run 4', 'run 3', 'run 2']
+    assert len((tmp_path / profiling.INDEX_FILE).read_text(encoding='utf-8').splitlines()) == 3
+
+def test_index_append_waits_for_a_rewrite(tmp_path):
+    """save() appends to the index only once a concurrent prune has swapped in its rewrite."""
+    import threading
+
+    class StoppedProfiler:
+        def disable(self):
+            pass
+
+        def dump_stats(self, path):
+            open(path, 'wb').close()
+
+    with profiling.index_lock(str(tmp_path)):
+        writer = threading.Thread(target=profiling.save, args=(StoppedProfiler(), str(tmp_path)),
+                                  kwargs={'keep': 0, 'label': 'waiting'})
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+        assert not (tmp_path / profiling.INDEX_FILE).exists()
+    writer.join()
+    assert [entry['label'] for entry in profiling.load_index(str(tmp_path))] == ['waiting']
@@ -0,0 +1,125 @@
+import functools
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import refresh
+from test_generatedb import write_arcep_files, OPERATEURS
+
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    """Local HTTP stand-in for data.gouv.fr serving the source files (honours If-Modified-Since)."""
+    served = tmp_path / "upstream"
+    write_arcep_files(str(served))
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(served))
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    sources = {name: {**spec, "url": f"{base}/{name}"} for name, spec in refresh.SOURCES.items()}
+    monkeypatch.setattr(refresh, "SOURCES", sources)
+    monkeypatch.setattr(refresh.history_manager, "DB_FILE", str(tmp_path / "history.sqlite3"))
+    yield served
+    server.shutdown()
+    server.server_close()
+
+def test_refresh_skips_unchanged_stages(upstream, tmp_path):
+    """A second refresh with identical upstream files fetches nothing and runs no stage."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    arcep_dir = str(tmp_path / "arcep")
+
+    report = refresh.refresh(db_path, arcep_dir)
+    assert set(report.values()) == {"ran"}
+
+    report = refresh.refresh(db_path, arcep_dir)
+    assert set(report.values()) == {"skipped"}
+
+def test_refresh_reruns_only_changed_stages(upstream, tmp_path):
+    """A changed operators file reruns its fetch, parse, import and snapshot stages only."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    arcep_dir = str(tmp_path / "arcep")
+    refresh.refresh(db_path, arcep_dir)
+
+    write_arcep_files(str(upstream), operateurs=[*OPERATEURS[:1], ("OP2", "Operator 2"), *OPERATEURS[2:]])
+    # Last-Modified has a one-second resolution
+    for name in os.listdir(upstream):
+        os.utime(upstream / name, (os.path.getmtime(upstream / name) + 5,) * 2)
+
+    report = refresh.refresh(db_path, arcep_dir)
+    ran = {stage for stage, status in report.items() if status == "ran"}
+    # All three files were re-sent, but only one has new content
+    assert ran == {"fetch", "parse:identifiants_ce.csv", "operators", "snapshots"}
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute("SELECT NomOperateur FROM Operateurs WHERE CodeOperateur = 'OP2'").fetchone()[0] == "Operator 2"
+
+def test_refresh_rejects_malformed_source(upstream, tmp_path):
+    """A file without the expected columns (e.g. an HTML error page) stops the refresh before the database."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    arcep_dir = str(tmp_path / "arcep")
+    (upstream / "majournums.csv").write_text("<html>Service indisponible</html>\n", encoding="cp1252")
+
+    with pytest.raises(refresh.generatedb.BuildError):
+        refresh.refresh(db_path, arcep_dir)
+    assert not os.path.exists(db_path)
+
+def test_refresh_rebuilds_database_it_did_not_produce(upstream, tmp_path):
+    """Stage keys are ignored when the database was replaced outside the pipeline."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    arcep_dir = str(tmp_path / "arcep")
+    refresh.refresh(db_path, arcep_dir)
+    refresh.generatedb.build_database(db_path, arcep_dir)
+
+    report = refresh.refresh(db_path, arcep_dir)
+    assert report["fetch"] == "skipped"
+    assert report["numbers"] == "ran"
+
+def test_malformed_download_keeps_last_good_file(upstream, tmp_path):
+    """A malformed download neither replaces the previous file nor records its validators, so the next run retries it."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    arcep_dir = tmp_path / "arcep"
+    refresh.refresh(db_path, str(arcep_dir))
+    good = (arcep_dir / "majournums.csv").read_bytes()
+    validators = refresh.load_state(str(arcep_dir))["sources"]["majournums.csv"]
+
+    (upstream / "majournums.csv").write_text("<html>Service indisponible</html>\n", encoding="cp1252")
+    os.utime(upstream / "majournums.csv", (os.path.getmtime(upstream / "majournums.csv") + 5,) * 2)
+    with pytest.raises(refresh.generatedb.BuildError):
+        refresh.refresh(db_path, str(arcep_dir))
+    assert (arcep_dir / "majournums.csv").read_bytes() == good
+    assert not (arcep_dir / "majournums.csv.part").exists()
+    assert refresh.load_state(str(arcep_dir))["sources"]["majournums.csv"] == validators
+
+    write_arcep_files(str(upstream))
+    os.utime(upstream / "majournums.csv", (os.path.getmtime(upstream / "majournums.csv") + 10,) * 2)
+    report = refresh.refresh(db_path, str(arcep_dir))
+    assert report["fetch"] == "ran"
+
+def test_refresh_rebuild_keeps_compact_schema(upstream, tmp_path):
+    """The full-build fallback rebuilds a compact-schema deployment with the same layout."""
+    db_path = str(tmp_path / "whoistel.sqlite3")
+    arcep_dir = str(tmp_path / "arcep")
+    refresh.refresh(db_path, arcep_dir)
+    refresh.generatedb.build_database(db_path, arcep_dir, compact_schema=True)
+
+    report = refresh.refresh(db_path, arcep_dir)
+    assert report["numbers"] == "ran"
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert refresh.generatedb.has_compact_schema(conn)
+    assert refresh.load_state(arcep_dir)["build_options"]["compact_schema"] is True
+
+def test_code_version_covers_every_stage_module(tmp_path, monkeypatch):
+    """A change to any module the stages import (not only generatedb) invalidates the stage keys."""
+    import types
+    modules = []
+    for name in ("importer", "lookups"):
+        path = tmp_path / f"{name}.py"
+        path.write_text("X = 1\n")
+        modules.append(types.SimpleNamespace(__file__=str(path)))
+    monkeypatch.setattr(refresh, "STAGE_MODULES", tuple(modules))
+    before = refresh.code_version()
+    (tmp_path / "lookups.py").write_text("X = 2\n")
+    assert refresh.code_version() != before
@@ -0,0 +1,64 @@
+from report_guard import ReportGuard, DROP_DUPLICATE, DROP_CLIENT_RATE, DROP_GLOBAL_RATE
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_exact_duplicate_dropped_within_window():
+    """The same content for the same number and client is accepted once per window."""
+    clock = FakeClock()
+    guard = ReportGuard(duplicate_window=60, clock=clock)
+    digest = ReportGuard.content_hash('2024-01-01', True, 'spam')
+
+    assert guard.check('1.2.3.4', '0123456789', digest) is None
+    assert guard.check('1.2.3.4', '0123456789', digest) == DROP_DUPLICATE
+    # A different client or different content is not a duplicate
+    assert guard.check('5.6.7.8', '0123456789', digest) is None
+    assert guard.check('1.2.3.4', '0123456789', ReportGuard.content_hash('2024-01-01', True, 'other')) is None
+
+    clock.now += 61
+    assert guard.check('1.2.3.4', '0123456789', digest) is None
+    assert guard.stats()['dropped'][DROP_DUPLICATE] == 1
+
+def test_client_and_global_rate_limits():
+    """Bursts are limited per client and globally over a sliding window."""
+    clock = FakeClock()
+    guard = ReportGuard(rate_window=10, client_limit=2, global_limit=3, clock=clock)
+
+    assert guard.check('a', '0100000001', b'1') is None
+    assert guard.check('a', '0100000002', b'2') is None
+    assert guard.check('a', '0100000003', b'3') == DROP_CLIENT_RATE
+    assert guard.check('b', '0100000004', b'4') is None
+    assert guard.check('c', '0100000005', b'5') == DROP_GLOBAL_RATE
+
+    clock.now += 10
+    assert guard.check('a', '0100000003', b'3') is None
+
+    stats = guard.stats()
+    assert stats['accepted'] == 4
+    assert stats['dropped'] == {DROP_DUPLICATE: 0, DROP_CLIENT_RATE: 1, DROP_GLOBAL_RATE: 1}
+
+def test_key_maps_are_lru_bounded():
+    """Tracked submissions and clients never exceed max_keys."""
+    guard = ReportGuard(client_limit=1000, global_limit=1000, max_keys=5, clock=FakeClock())
+    for i in range(50):
+        guard.check(f"client-{i}", f"01000000{i:02d}", b'x')
+
+    stats = guard.stats()
+    assert stats['tracked_submissions'] == 5
+    assert stats['tracked_clients'] == 5
+
+def test_forgotten_submission_can_be_retried():
+    """A submission forgotten after a failed write is accepted again, but still counts towards the rate limit."""
+    guard = ReportGuard(client_limit=2, clock=FakeClock())
+    digest = ReportGuard.content_hash('2024-01-01', True, 'spam')
+
+    assert guard.check('1.2.3.4', '0123456789', digest) is None
+    guard.forget('1.2.3.4', '0123456789', digest)
+    assert guard.check('1.2.3.4', '0123456789', digest) is None
+    assert guard.check('1.2.3.4', '0123456789', ReportGuard.content_hash('other')) == DROP_CLIENT_RATE
@@ -0,0 +1,49 @@
+import sqlite3
+import pytest
+import sqltrace
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE t (k INTEGER PRIMARY KEY, v TEXT)")
+    conn.executemany("INSERT INTO t (k, v) VALUES (?, ?)", [(i, str(i)) for i in range(500)])
+    yield conn
+    conn.close()
+
+def test_tracer_records_statements_rows_and_steps(conn):
+    """Each statement is recorded with its bound values, the rows it returned and its VM steps."""
+    seen = []
+    tracer = sqltrace.Tracer()
+    tracer.attach(conn, 'lookup', on_statement=seen.append)
+    row = conn.execute("SELECT v FROM t WHERE k = ?", (42,)).fetchone()
+    rows = conn.execute("SELECT v FROM t WHERE v LIKE '1%'").fetchall()
+    statements = tracer.finish()
+
+    # The existing row_factory is kept
+    assert row['v'] == '42'
+    assert [s.sql for s in statements] == ["SELECT v FROM t WHERE k = 42", "SELECT v FROM t WHERE v LIKE '1%'"]
+    assert seen == [s.sql for s in statements]
+    assert [s.rows for s in statements] == [1, len(rows)]
+    # The full scan does far more work than the primary key lookup
+    assert statements[1].steps > statements[0].steps
+    assert all(s.elapsed is not None for s in statements)
+    assert "2 statements" in tracer.format()
+
+def test_query_budget_logs_or_raises(conn, caplog):
+    """Going over the budget logs the trace, or raises QueryBudgetExceeded."""
+    tracer = sqltrace.Tracer(budget=1, label='GET /view')
+    tracer.attach(conn)
+    conn.execute("SELECT 1").fetchone()
+    conn.execute("SELECT 2").fetchone()
+    tracer.finish()
+    assert "SQL query budget exceeded (GET /view): 2 statements for a budget of 1" in caplog.text
+
+    tracer = sqltrace.Tracer(budget=1, on_exceeded=sqltrace.BUDGET_RAISE)
+    tracer.attach(conn)
+    conn.execute("SELECT 1").fetchone()
+    tracer.finish()
+    conn.execute("SELECT 2").fetchone()
+    with pytest.raises(sqltrace.QueryBudgetExceeded):
+        tracer.finish()
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+from contextlib import closing
+import generatedb
+import synthdata
+import whoistel
+
+
+def read_files(directory):
+    return {name: open(os.path.join(directory, name), 'rb').read() for name in sorted(os.listdir(directory))}
+
+def test_generate_is_deterministic(tmp_path):
+    """The same sizes and seed write the same bytes; another seed does not."""
+    synthdata.generate(tmp_path / 'a', ranges=500, operators=20, communes=100, seed=3)
+    synthdata.generate(tmp_path / 'b', ranges=500, operators=20, communes=100, seed=3)
+    synthdata.generate(tmp_path / 'c', ranges=500, operators=20, communes=100, seed=4)
+    assert read_files(tmp_path / 'a') == read_files(tmp_path / 'b')
+    assert read_files(tmp_path / 'a') != read_files(tmp_path / 'c')
+
+def test_generate_real_formats_and_quirks(tmp_path):
+    """cp1252 ';' ARCEP files with nested and duplicate prefixes, overseas territories and unknown operators."""
+    synthdata.generate(tmp_path, ranges=3000, operators=50, communes=500, seed=1)
+    with open(tmp_path / 'majournums.csv', encoding='cp1252', newline='') as f:
+        lines = f.read().split('\r\n')
+    assert lines[0] == "EZABPQM;Tranche_Debut;Tranche_Fin;Mnémo;Territoire;Date_Attribution"
+    rows = [line.split(';') for line in lines[1:] if line]
+    assert len(rows) >= 3000
+    prefixes = [row[0] for row in rows]
+    assert len(set(prefixes)) < len(prefixes)
+    assert {len(p) for p in prefixes} >= {4, 5, 6, 7}
+    assert any(p[:-1] in set(prefixes) for p in prefixes)
+    assert {'Métropole', 'La Réunion', 'Mayotte', 'Martinique'} <= {row[4] for row in rows}
+    assert '' in {row[5] for row in rows}
+    with open(tmp_path / 'identifiants_ce.csv', encoding='cp1252') as f:
+        operators = {line.split(';')[0] for line in f.read().splitlines()[1:]}
+    assert {row[3] for row in rows} - operators
+    with open(tmp_path / 'communes-france.csv', encoding='utf-8') as f:
+        communes = [line.split(',') for line in f.read().splitlines()[1:]]
+    assert any(row[4] for row in communes)
+    assert {'2A', '2B'} <= {row[11] for row in communes}
+
+def test_generated_dataset_builds_and_resolves(tmp_path):
+    """generatedb builds the dataset; the first of nested/duplicate ranges wins, overseas ranges resolve."""
+    arcep_dir = tmp_path / 'arcep'
+    dataset = synthdata.generate(arcep_dir, ranges=2000, operators=30, communes=300, seed=2)
+    db_path = str(tmp_path / 'synth.sqlite3')
+    generatedb.build_database(db_path, str(arcep_dir))
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.row_factory = sqlite3.Row
+        for prefix, operator in list(dataset['metro'].items())[:200]:
+            number = prefix.ljust(10, '5')
+            longest = max((p for p in dataset['metro'] if number.startswith(p)), key=len)
+            assert whoistel.search_number(conn, number)['code_operateur'] == dataset['metro'][longest]
+        for prefix, (cc, operator, territory) in list(dataset['overseas'].items())[:50]:
+            number = prefix.ljust(10, '5')
+            result = whoistel.search_number(conn, number)
+            assert result is not None and result['territoire'] is not None
@@ -313,3 +313,204 @@ def test_report_comment_truncation_flash_message(client):
     assert rv.status_code == 200
     expected_message = f"Votre commentaire a été tronqué à {MAX_COMMENT_LENGTH} caractères."
     assert expected_message.encode("utf-8") in rv.data
+
+def test_top_reported_page_links_to_view(client):
+    """The leaderboard lists reported numbers with a link to their view page."""
+    client.post('/report', data={'number': '0612345678', 'is_spam': 'on'})
+    client.post('/report', data={'number': '0612345678', 'comment': 'again'})
+
+    rv = client.get('/top?window=7d')
+    assert rv.status_code == 200
+    assert b'/view/0612345678' in rv.data
+    assert b'<td>2</td>' in rv.data
+
+    rv = client.get('/top?window=forever')
+    assert rv.status_code == 400
+
+def test_heatmap_api_and_page(client):
+    """Reports feed the heatmap JSON endpoint and page."""
+    client.post('/report', data={'number': '0123456789', 'is_spam': 'on'})
+
+    rv = client.get('/api/heatmap?by=region')
+    assert rv.status_code == 200
+    assert rv.get_json() == {
+        'by': 'region',
+        'entries': [{'region': 'Île-de-France', 'report_count': 1, 'spam_count': 1}],
+    }
+    assert client.get('/api/heatmap?by=city').status_code == 400
+
+    rv = client.get('/heatmap')
+    assert rv.status_code == 200
+    assert b'01234' in rv.data
+
+def test_report_duplicate_and_burst_suppressed(app_instance, client):
+    """Double submits are dropped silently and bursts get a 429, before any DB write."""
+    app_instance.extensions['report_guard'].client_limit = 2
+    data = {'number': '0612345679', 'is_spam': 'on', 'comment': 'dup'}
+
+    client.post('/report', data=data)
+    rv = client.post('/report', data=data, follow_redirects=True)
+    assert b"d\xc3\xa9j\xc3\xa0 \xc3\xa9t\xc3\xa9 enregistr\xc3\xa9" in rv.data
+    assert history_manager.get_spam_count('0612345679') == 1
+
+    client.post('/report', data={**data, 'comment': 'second'})
+    rv = client.post('/report', data={**data, 'comment': 'third'})
+    assert rv.status_code == 429
+    assert history_manager.get_spam_count('0612345679') == 2
+
+    stats = client.get('/api/report-guard').get_json()
+    assert stats['accepted'] == 2
+    assert stats['dropped'] == {'duplicate': 1, 'client_rate': 1, 'global_rate': 0}
+
+def test_report_guard_keys_clients_on_forwarded_address(app_instance):
+    """Behind TRUSTED_PROXIES proxies, each forwarded client gets its own rate-limit bucket."""
+    def post(client, comment, forwarded_for):
+        return client.post('/report', data={'number': '0612345681', 'is_spam': 'on', 'comment': comment},
+                           headers={'X-Forwarded-For': forwarded_for})
+
+    # Without trusted proxies the header is ignored: every client shares the proxy's address
+    app_instance.extensions['report_guard'].client_limit = 1
+    with app_instance.test_client() as client:
+        assert post(client, 'a', '203.0.113.1').status_code == 302
+        assert post(client, 'b', '203.0.113.2').status_code == 429
+
+    app = create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False, 'SECRET_KEY': 'test-key',
+                      'TRUSTED_PROXIES': 1, 'REPORT_CLIENT_LIMIT': 1})
+    with app.test_client() as client:
+        assert post(client, 'c', '203.0.113.1').status_code == 302
+        assert post(client, 'd', '203.0.113.2').status_code == 302
+        assert post(client, 'e', '203.0.113.1').status_code == 429
+
+def test_report_retry_after_failed_write_is_not_a_duplicate(client):
+    """A report whose write failed (e.g. database locked) is accepted again when retried."""
+    import sqlite3
+    data = {'number': '0612345680', 'is_spam': 'on', 'comment': 'locked'}
+    with patch('history_manager.add_report', side_effect=sqlite3.OperationalError('database is locked')):
+        with pytest.raises(sqlite3.OperationalError):
+            client.post('/report', data=data)
+
+    rv = client.post('/report', data=data, follow_redirects=True)
+    assert "Signalement enregistré." in rv.get_data(as_text=True)
+    assert history_manager.get_spam_count('0612345680') == 1
+
+def test_metrics_endpoint_reports_routes_stages_and_sql(client):
+    """/metrics exposes per-route latency, lookup stages and SQL statement counts."""
+    client.get('/view/0612345678')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.get_data(as_text=True)
+    assert 'whoistel_requests_total{route="/view/<number>",method="GET",status="200"}' in text
+    assert 'whoistel_request_duration_seconds_count{route="/view/<number>",method="GET"}' in text
+    assert 'whoistel_lookup_stage_duration_seconds_count{stage="spam_count"}' in text
+    assert 'whoistel_lookup_stage_duration_seconds_count{stage="render"}' in text
+    assert 'whoistel_sql_statements_total{db="history_db"}' in text
+    assert 'whoistel_lookup_cache_total{result="miss"}' in text
+
+def test_sql_query_budget_catches_extra_statements(app_instance, client):
+    """With SQL tracing on, a request issuing more statements than its budget fails loudly."""
+    import sqltrace
+    app_instance.config.update(SQL_TRACE=True, SQL_QUERY_BUDGET=20, SQL_BUDGET_ACTION=sqltrace.BUDGET_RAISE)
+    assert client.get('/view/0612345678').status_code == 200
+
+    app_instance.config['SQL_QUERY_BUDGET'] = 1
+    with pytest.raises(sqltrace.QueryBudgetExceeded):
+        client.get('/view/0123456789')
+
+def test_api_lookup_with_explain(client):
+    """/api/lookup returns the lookup result; ?explain=1 adds the explained steps."""
+    data = client.get('/api/lookup/0123456789').get_json()
+    assert data['code_operateur'] == 'OP1'
+    assert 'explain' not in data
+
+    data = client.get('/api/lookup/+33123456789?explain=1').get_json()
+    assert data['code_operateur'] == 'OP1'
+    assert data['explain']['number'] == '0123456789'
+    assert any(step['step'] == 'cache' for step in data['explain']['steps'])
+
+    response = client.get('/api/lookup/123?explain=1')
+    assert response.status_code == 400
+    assert response.get_json()['explain']['valid'] is False
+
+def test_request_profiling_and_admin_index(monkeypatch, tmp_path):
+    """Requests sent with the admin token are profiled and listed on the admin page."""
+    db_fd, db_path = tempfile.mkstemp()
+    monkeypatch.setattr(history_manager, 'DB_FILE', db_path)
+    app = create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False, 'SECRET_KEY': 'test-key',
+                      'PROFILE_TOKEN': 'admin-token', 'PROFILE_DIR': str(tmp_path)})
+    try:
+        with app.test_client() as client:
+            client.get('/view/0612345678')
+            assert not list(tmp_path.glob('*.prof'))
+            client.get('/view/0612345678', headers={'X-Whoistel-Profile': 'admin-token'})
+            assert len(list(tmp_path.glob('*.prof'))) == 1
+
+            assert client.get('/admin/profiles').status_code == 404
+            page = client.get('/admin/profiles', headers={'X-Whoistel-Profile': 'admin-token'})
+            assert b'GET /view/&lt;number&gt;' in page.data
+            assert b'0612345678' in page.data
+            name = next(tmp_path.glob('*.prof')).name
+            assert client.get(f'/admin/profiles/{name}?token=admin-token').status_code == 404
+            assert client.get(f'/admin/profiles/{name}', headers={'X-Whoistel-Profile': 'admin-token'}).status_code == 200
+            assert b'token=' not in page.data
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+def test_admin_memory_report(monkeypatch, tmp_path):
+    """The memory report lists each in-memory structure with its entries and size, behind the admin token."""
+    db_fd, db_path = tempfile.mkstemp()
+    monkeypatch.setattr(history_manager, 'DB_FILE', db_path)
+    # Requests carrying the token are also profiled
+    app = create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False, 'SECRET_KEY': 'test-key',
+                      'PROFILE_TOKEN': 'admin-token', 'PROFILE_DIR': str(tmp_path)})
+    try:
+        with app.test_client() as client:
+            client.get('/view/0612345678')
+            assert client.get('/admin/memory').status_code == 404
+            report = client.get('/admin/memory', headers={'X-Whoistel-Profile': 'admin-token'}).get_json()
+            structures = report['structures']
+            assert set(structures) == {'lookup_cache', 'report_guard', 'leaderboard_cache', 'metrics'}
+            assert structures['lookup_cache']['entries'] == 1
+            assert structures['lookup_cache']['bytes'] > 0
+            assert 'rss_bytes' in report['process']
+            assert 'whoistel_memory_structure_entries{structure="lookup_cache"} 1' in client.get('/metrics').get_data(as_text=True)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+def test_access_log_sampling_and_slow_requests(monkeypatch, tmp_path):
+    """Sampled requests are logged as JSON with their stages; slow ones are logged even when not sampled."""
+    import json
+    import accesslog
+    db_fd, db_path = tempfile.mkstemp()
+    monkeypatch.setattr(history_manager, 'DB_FILE', db_path)
+    log_path = tmp_path / 'access.jsonl'
+    try:
+        app = create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False, 'SECRET_KEY': 'test-key',
+                          'ACCESS_LOG': str(log_path), 'ACCESS_LOG_SAMPLE_EVERY': 1})
+        with app.test_client() as client:
+            client.get('/view/0612345678')
+            client.get('/')
+        accesslog.stop()
+        entries = [json.loads(line) for line in log_path.read_text(encoding='utf-8').splitlines()]
+        assert [entry['route'] for entry in entries] == ['/view/<number>', '/']
+        view = entries[0]
+        assert view['status'] == 200
+        assert view['number'] == accesslog.number_hash('0612345678', 'test-key')
+        assert {'normalise', 'spam_count', 'render'} <= set(view['stages_ms'])
+        assert view['total_ms'] >= sum(view['stages_ms'].values())
+        assert view['slow'] is False
+        assert entries[1]['number'] is None
+
+        app = create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False, 'SECRET_KEY': 'test-key',
+                          'ACCESS_LOG': str(log_path), 'ACCESS_LOG_SAMPLE_EVERY': 0, 'ACCESS_LOG_SLOW_MS': 0})
+        with app.test_client() as client:
+            client.get('/')
+        accesslog.stop()
+        entries = [json.loads(line) for line in log_path.read_text(encoding='utf-8').splitlines()]
+        assert len(entries) == 3 and entries[-1]['slow'] is True
+    finally:
+        accesslog.stop()
+        os.close(db_fd)
+        os.unlink(db_path)
@@ -78,11 +78,27 @@ def test_clean_phone_number():
     assert clean_phone_number("06-12-34-56-78") == "0612345678"
     assert clean_phone_number("06\t12 34\n56 78") == "0612345678"
     assert clean_phone_number("0033612345678") == "0612345678"
+    # Overseas country codes of the French plan (+269 is Mayotte's former code)
+    assert clean_phone_number("+262 262 12 34 56") == "0262123456"
+    assert clean_phone_number("00590690123456") == "0690123456"
+    assert clean_phone_number("+269 639 12 34 56") == "0639123456"
+    # Foreign country codes are left as typed (and rejected by is_valid_phone_format)
+    assert clean_phone_number("+44 20 7946 0958") == "+442079460958"
     
     # Falsy / missing inputs
     assert clean_phone_number("") == ""
     assert clean_phone_number(None) == ""
 
+def test_country_code_of():
+    """National numbers are dispatched to their territory's partition."""
+    from whoistel import country_code_of
+    assert country_code_of("0262123456") == "262"
+    assert country_code_of("0639123456") == "262"
+    assert country_code_of("0696123456") == "596"
+    assert country_code_of("0508123456") == "508"
+    assert country_code_of("0245123456") == "33"
+    assert country_code_of("0612345678") == "33"
+
 def test_is_valid_phone_format():
     """Tests the phone number validation helper."""
     from whoistel import is_valid_phone_format
@@ -268,3 +284,99 @@ def test_cli_db_error_from_setup_db_connection(capsys):
     assert exit_code == 1
     # Check that it didn't crash with traceback but handled it with a user-facing error
     assert "Test DB Error" in output.err
+
+def test_lookup_cache_invalidated_by_changelog(tmp_path):
+    """The lookup cache evicts only numbers under changed prefixes and clears on a new build."""
+    import sqlite3
+    import whoistel
+
+    conn = sqlite3.connect(tmp_path / "cache.sqlite3")
+    conn.row_factory = sqlite3.Row
+    conn.executescript('''
+        CREATE TABLE PlagesNumerosGeographiques(PlageTel TEXT PRIMARY KEY, CodeOperateur TEXT, CodeInsee TEXT);
+        CREATE TABLE PlagesNumeros(PlageTel TEXT PRIMARY KEY, CodeOperateur TEXT);
+        CREATE TABLE Operateurs(CodeOperateur TEXT PRIMARY KEY, NomOperateur TEXT, TypeOperateur TEXT, MailOperateur TEXT, SiteOperateur TEXT);
+        CREATE TABLE Communes(CodeInsee TEXT PRIMARY KEY, NomCommune TEXT, CodePostal TEXT, NomDepartement TEXT, Latitude REAL, Longitude REAL);
+        CREATE TABLE BuildInfo(Key TEXT PRIMARY KEY, Value TEXT);
+        CREATE TABLE ChangeLog(Id INTEGER PRIMARY KEY AUTOINCREMENT, DatasetDate TEXT, AppliedAt TIMESTAMP,
+                               TableName TEXT, Action TEXT, KeyValue TEXT, OldValue TEXT, NewValue TEXT);
+        INSERT INTO BuildInfo VALUES ('build_id', 'build-1');
+        INSERT INTO PlagesNumeros VALUES ('0612', 'OP1'), ('0698', 'OP1');
+        INSERT INTO Operateurs VALUES ('OP1', 'Operator One', '', '', '');
+    ''')
+
+    cache = whoistel.LookupCache(sync_interval=0)
+    cache.sync(conn)
+    for tel in ("0612345678", "0698765432"):
+        whoistel.get_full_info(conn, tel, cache=cache)
+    assert whoistel.get_full_info(conn, "0612345678", cache=cache)["prefix"] == "0612"
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    conn.execute("INSERT INTO ChangeLog (TableName, Action, KeyValue) VALUES ('PlagesNumeros', 'reassigned', '0612')")
+    cache.sync(conn)
+    assert cache.get("0612345678") is None
+    assert cache.get("0698765432") is not None
+
+    conn.execute("UPDATE BuildInfo SET Value = 'build-2'")
+    cache.sync(conn)
+    assert len(cache) == 0
+    conn.close()
+
+def test_write_batch_enriches_csv(db_connection):
+    """Batch enrichment writes one CSV line per input row, in order, including invalid numbers."""
+    import io
+    import whoistel
+
+    source = io.StringIO("numero;date\n01 23 45 67 89;\n0987654321;\n12AB;\n")
+    out = io.StringIO()
+    whoistel.write_batch(db_connection, source, out)
+
+    lines = out.getvalue().splitlines()
+    assert lines[0] == ",".join(whoistel.BATCH_FIELDS)
+    assert lines[1].startswith("0123456789,,1,Geographique,01234,OP1,Operator One")
+    assert lines[2].startswith("0987654321,,1,Non-Geographique,09876,OP2,Operator Two")
+    assert lines[3].startswith("12AB,,0,")
+
+    # A single 'numero' column has no delimiter to sniff
+    out = io.StringIO()
+    whoistel.write_batch(db_connection, io.StringIO("numero\n0123456789\n"), out)
+    assert out.getvalue().splitlines()[1].startswith("0123456789,,1,")
+
+def test_parse_as_of():
+    """As-of dates accept ISO dates, timestamps and date objects."""
+    import datetime
+    from whoistel import parse_as_of
+
+    assert parse_as_of("2024-05-01") == "2024-05-01"
+    assert parse_as_of("2024-05-01 13:45:00") == "2024-05-01"
+    assert parse_as_of(datetime.datetime(2024, 5, 1, 13, 45)) == "2024-05-01"
+    with pytest.raises(ValueError):
+        parse_as_of("01/05/2024")
+
+def test_explain_lookup_reports_steps_engine_and_probes(db_connection):
+    """explain_lookup shows normalisation, the engine, the probes walked and the fetches, with timings."""
+    import whoistel
+    explanation = whoistel.explain_lookup(db_connection, "+33 1 23 45 67 89")
+    assert explanation['valid'] is True
+    assert explanation['number'] == "0123456789"
+    assert explanation['engine'] == 'range_tables'
+    assert explanation['result']['code_operateur'] == 'OP1'
+    steps = [step['step'] for step in explanation['steps']]
+    assert steps[:4] == ['separators', 'e164', 'format', 'partition']
+    assert {'engine', 'search_number', 'operator', 'commune'} <= set(steps)
+    assert all(step['us'] >= 0 for step in explanation['steps'] if 'us' in step)
+    # One query per prefix, recorded by the range walk itself, which stops at the longest hit
+    assert explanation['probes'] == [
+        {'table': 'PlagesNumerosGeographiques', 'prefixes': [p], 'match': p if p == '01234' else None}
+        for p in ('012345678', '01234567', '0123456', '012345', '01234')]
+    assert 'probe' not in steps
+
+    cache = whoistel.LookupCache()
+    whoistel.explain_lookup(db_connection, "0123456789", cache=cache)
+    cached = whoistel.explain_lookup(db_connection, "0123456789", cache=cache)
+    assert cached['engine'] is None
+    assert {'step': 'cache', 'hit': True, 'detail': 'trouvé'} in cached['steps']
+
+    invalid = whoistel.explain_lookup(db_connection, "12ab")
+    assert invalid['valid'] is False
+    assert invalid['result'] is None
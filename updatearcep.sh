@@ -22,22 +22,9 @@ fi
 echo
 
 cd "$(dirname "$0")"
-mkdir -p arcep
-cd arcep
 
-# New ARCEP data from data.gouv.fr (CSV files)
-echo "Downloading ARCEP numbering resources (majournums.csv)..."
-wget -N -O majournums.csv https://www.data.gouv.fr/fr/datasets/r/90e8bdd0-0f5c-47ac-bd39-5f46463eb806
-
-echo "Downloading ARCEP operator identifiers (identifiants_ce.csv)..."
-wget -N -O identifiants_ce.csv https://www.data.gouv.fr/fr/datasets/r/b0f62183-cd0c-498d-8153-aa1594e5e8d9
-
-# INSEE / La Poste data (Enriched with Coordinates and Dept Names)
-echo "Downloading Enriched Communes data..."
-wget -N -O communes-france.csv https://www.data.gouv.fr/api/1/datasets/r/dbe8a621-a9c4-4bc3-9cae-be1699c5ff25
-
-cd ..
-echo
-echo "Running generatedb.py to build database..."
-./generatedb.py
+# Downloads the ARCEP/INSEE files with conditional requests and reruns only the
+# pipeline stages whose inputs changed (see refresh.py).
+echo "Running refresh.py to update the data and the database..."
+python3 refresh.py "$@"
 echo "Data update and database generation complete."
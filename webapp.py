@@ -2,21 +2,43 @@
 Flask web application serving the whoistel user interface, 
 handling number lookups and community spam reporting.
 """
+import logging
 import os
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, g
+import time
+import tracemalloc
+from contextlib import closing, nullcontext
+from datetime import datetime, timezone
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, flash, g, jsonify, send_file
 from flask_wtf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
+import accesslog
 import history_manager
+import history_retention
+import memprofile
+import metrics
+import profiling
+import sqltrace
+from report_guard import ReportGuard, DROP_DUPLICATE
 import whoistel
 
 csrf = CSRFProtect()
 MAX_COMMENT_LENGTH = 1024
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+
+def configure_logging():
+    """
+    Sends the logs of the whoistel modules (schema init, retention runs...)
+    to standard error at WHOISTEL_LOG_LEVEL (INFO by default), unless the
+    server or a test runner has already configured the root logger.
+    """
+    logging.basicConfig(level=os.environ.get('WHOISTEL_LOG_LEVEL', 'INFO').upper(), format=LOG_FORMAT)
 
 def create_app(test_config=None):
     """
     Application factory for the Flask web UI.
     Initializes configuration, CSRF protection, and database schema.
     """
+    configure_logging()
     app = Flask(__name__)
     
     if test_config:
@@ -29,6 +51,90 @@ def create_app(test_config=None):
 
     csrf.init_app(app)
 
+    # Behind N trusted reverse proxies, take the client address (used as the
+    # report guard's client key) from X-Forwarded-For. 0 trusts no header.
+    app.config.setdefault('TRUSTED_PROXIES', int(os.environ.get('WHOISTEL_TRUSTED_PROXIES', '0')))
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                                x_proto=app.config['TRUSTED_PROXIES'])
+
+    # Duplicate/burst suppression for /report, applied before any DB write
+    app.config.setdefault('REPORT_DUPLICATE_WINDOW', float(os.environ.get('WHOISTEL_REPORT_DUPLICATE_WINDOW', '600')))
+    app.config.setdefault('REPORT_RATE_WINDOW', float(os.environ.get('WHOISTEL_REPORT_RATE_WINDOW', '60')))
+    app.config.setdefault('REPORT_CLIENT_LIMIT', int(os.environ.get('WHOISTEL_REPORT_CLIENT_LIMIT', '10')))
+    app.config.setdefault('REPORT_GLOBAL_LIMIT', int(os.environ.get('WHOISTEL_REPORT_GLOBAL_LIMIT', '300')))
+    app.config.setdefault('REPORT_GUARD_MAX_KEYS', int(os.environ.get('WHOISTEL_REPORT_GUARD_MAX_KEYS', '10000')))
+    report_guard = ReportGuard(
+        duplicate_window=app.config['REPORT_DUPLICATE_WINDOW'],
+        rate_window=app.config['REPORT_RATE_WINDOW'],
+        client_limit=app.config['REPORT_CLIENT_LIMIT'],
+        global_limit=app.config['REPORT_GLOBAL_LIMIT'],
+        max_keys=app.config['REPORT_GUARD_MAX_KEYS'],
+    )
+    app.extensions['report_guard'] = report_guard
+
+    # Lookup results cache, invalidated from the ARCEP database's ChangeLog (0 disables it)
+    app.config.setdefault('LOOKUP_CACHE_SIZE', 10000)
+    lookup_cache = whoistel.LookupCache(app.config['LOOKUP_CACHE_SIZE']) if app.config['LOOKUP_CACHE_SIZE'] else None
+    app.extensions['lookup_cache'] = lookup_cache
+
+    # Per-worker metrics exposed at /metrics (Prometheus text format)
+    app.config.setdefault('METRICS_ENABLED', os.environ.get('WHOISTEL_METRICS', '1') != '0')
+    metrics_enabled = app.config['METRICS_ENABLED']
+    metrics.ENABLED = metrics_enabled
+    if metrics_enabled:
+        metrics.REGISTRY.callback('whoistel_lookup_cache_total', "Lookup cache hits, misses and evictions.",
+                                  'counter', ('result',), lambda: {
+                                      ('hit',): lookup_cache.hits,
+                                      ('miss',): lookup_cache.misses,
+                                      ('eviction',): lookup_cache.evictions,
+                                  } if lookup_cache is not None else {})
+        metrics.REGISTRY.callback('whoistel_report_guard_total', "Report submissions accepted and dropped, by reason.",
+                                  'counter', ('result',), lambda: {
+                                      ('accepted',): report_guard.accepted,
+                                      **{(reason,): count for reason, count in report_guard.dropped.items()},
+                                  })
+
+    # Opt-in SQL tracing of every request, with an optional statement budget
+    app.config.setdefault('SQL_TRACE', os.environ.get('WHOISTEL_SQL_TRACE', '0') == '1')
+    app.config.setdefault('SQL_QUERY_BUDGET', int(os.environ.get('WHOISTEL_SQL_QUERY_BUDGET', '0')) or None)
+    app.config.setdefault('SQL_BUDGET_ACTION', os.environ.get('WHOISTEL_SQL_BUDGET_ACTION', sqltrace.BUDGET_LOG))
+
+    # Optional cProfile sampling: one request in PROFILE_EVERY, or any request
+    # sent with the admin token in the X-Whoistel-Profile header
+    app.config.setdefault('PROFILE_EVERY', int(os.environ.get('WHOISTEL_PROFILE_EVERY', '0')))
+    app.config.setdefault('PROFILE_TOKEN', os.environ.get('WHOISTEL_PROFILE_TOKEN'))
+    app.config.setdefault('PROFILE_DIR', profiling.PROFILE_DIR)
+    app.config.setdefault('PROFILE_KEEP', profiling.PROFILE_KEEP)
+
+    # Memory report at /admin/memory (admin token). WHOISTEL_TRACEMALLOC=N traces
+    # Python allocations with N frames, for the top allocators (slows the worker down).
+    app.config.setdefault('TRACEMALLOC_FRAMES', int(os.environ.get('WHOISTEL_TRACEMALLOC', '0')))
+    if app.config['TRACEMALLOC_FRAMES'] and not tracemalloc.is_tracing():
+        tracemalloc.start(app.config['TRACEMALLOC_FRAMES'])
+    # Long-lived structures of the worker: name -> (entry count, object)
+    memory_structures = {
+        'lookup_cache': lambda: (len(lookup_cache), lookup_cache) if lookup_cache is not None else (0, None),
+        'report_guard': lambda: (sum(report_guard.stats()[key] for key in ('tracked_submissions', 'tracked_clients')),
+                                 report_guard),
+        'leaderboard_cache': lambda: (len(history_manager.leaderboard_cache()), history_manager.leaderboard_cache()),
+        'metrics': lambda: (metrics.REGISTRY.series_count(), metrics.REGISTRY),
+    }
+    app.extensions['memory_structures'] = memory_structures
+
+    # Structured JSON access log, opt-in: WHOISTEL_ACCESS_LOG is a file path, or '-'
+    # for standard error. One request in ACCESS_LOG_SAMPLE_EVERY is logged (0: none),
+    # plus every request slower than ACCESS_LOG_SLOW_MS.
+    app.config.setdefault('ACCESS_LOG', os.environ.get('WHOISTEL_ACCESS_LOG'))
+    app.config.setdefault('ACCESS_LOG_SAMPLE_EVERY', int(os.environ.get('WHOISTEL_ACCESS_LOG_SAMPLE_EVERY', '1')))
+    app.config.setdefault('ACCESS_LOG_SLOW_MS', float(os.environ.get('WHOISTEL_ACCESS_LOG_SLOW_MS', '500')))
+    if metrics_enabled:
+        metrics.REGISTRY.callback('whoistel_process_resident_memory_bytes', "Resident set size of this worker.",
+                                  'gauge', (), lambda: {(): rss} if (rss := memprofile.rss_bytes()) is not None else {})
+        metrics.REGISTRY.callback('whoistel_memory_structure_entries', "Entries held by each in-memory structure.",
+                                  'gauge', ('structure',),
+                                  lambda: {(name,): describe()[0] for name, describe in memory_structures.items()})
+
     # Note: Template filters, error handlers, and routes are registered here
     # to avoid import-time side effects (like DB initialization).
 
@@ -62,12 +168,174 @@ def create_app(test_config=None):
         if db is None:
             db = connect_func()
             setattr(g, name, db)
+            counter = None
+            if metrics_enabled:
+                if not hasattr(g, 'sql_statements'):
+                    g.sql_statements = {}
+                counter = g.sql_statements[name] = metrics.StatementCounter()
+            # A sharded history database is one sqlite3 connection per shard
+            for conn in history_manager.shard_connections(db):
+                if app.config['SQL_TRACE']:
+                    _get_tracer().attach(conn, name, on_statement=counter)
+                elif counter is not None:
+                    conn.set_trace_callback(counter)
             # Scalable registry for teardown
             if not hasattr(g, 'db_connections'):
                 g.db_connections = []
             g.db_connections.append(db)
         return db
 
+    if metrics_enabled:
+        @app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            """Records latency, status and SQL statement count of the request."""
+            started = getattr(g, 'request_started', None)
+            if started is None:
+                return response
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, route, request.method)
+            metrics.REQUESTS.inc(route, request.method, str(response.status_code))
+            counters = getattr(g, 'sql_statements', {})
+            for db_name, counter in counters.items():
+                metrics.SQL_STATEMENTS.inc(db_name, amount=counter.count)
+            metrics.REQUEST_SQL_STATEMENTS.observe(sum(counter.count for counter in counters.values()), route)
+            return response
+
+        @app.route('/metrics', methods=['GET'])
+        def metrics_endpoint():
+            """Exposes this worker's metrics in the Prometheus text format."""
+            return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    def _get_tracer():
+        """SQL tracer of the current request, created on first use."""
+        if 'sql_tracer' not in g:
+            g.sql_tracer = sqltrace.Tracer(budget=app.config['SQL_QUERY_BUDGET'],
+                                           on_exceeded=app.config['SQL_BUDGET_ACTION'],
+                                           label=f"{request.method} {request.path}")
+        return g.sql_tracer
+
+    @app.after_request
+    def finish_sql_trace(response):
+        """Logs the request's SQL trace and enforces the query budget."""
+        tracer = g.pop('sql_tracer', None)
+        if tracer is not None:
+            tracer.finish()
+            app.logger.debug(f"SQL trace for {tracer.label}:\n{tracer.format()}")
+        return response
+
+    if app.config['ACCESS_LOG']:
+        access_handler = accesslog.start(None if app.config['ACCESS_LOG'] == '-' else app.config['ACCESS_LOG'])
+        sample_access = profiling.Sampler(app.config['ACCESS_LOG_SAMPLE_EVERY'])
+        slow_seconds = app.config['ACCESS_LOG_SLOW_MS'] / 1000
+        if metrics_enabled:
+            metrics.REGISTRY.callback('whoistel_access_log_dropped_total', "Access log entries dropped on a full queue.",
+                                      'counter', (), lambda: {(): access_handler.dropped})
+
+        @app.before_request
+        def start_access_log():
+            g.access_started = time.perf_counter()
+            g.stage_timings, g.stage_timings_token = whoistel.collect_stage_timings()
+
+        @app.after_request
+        def write_access_log(response):
+            """Queues the request's access log entry if it is sampled or slow."""
+            started = g.get('access_started')
+            if started is None:
+                return response
+            elapsed = time.perf_counter() - started
+            slow = elapsed >= slow_seconds
+            if not (slow or sample_access()):
+                return response
+            number = (request.view_args or {}).get('number') or request.form.get('number')
+            entry = {
+                'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+                'method': request.method,
+                'route': request.url_rule.rule if request.url_rule else 'unmatched',
+                'status': response.status_code,
+                'number': accesslog.number_hash(whoistel.clean_phone_number(number), app.config['SECRET_KEY']),
+                'total_ms': round(elapsed * 1000, 3),
+                'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in g.stage_timings.items()},
+                'slow': slow,
+            }
+            counters = g.get('sql_statements')
+            if counters:
+                entry['sql_statements'] = {db_name: counter.count for db_name, counter in counters.items()}
+            accesslog.log(entry)
+            return response
+
+        @app.teardown_request
+        def stop_access_log(_error):
+            token = g.pop('stage_timings_token', None)
+            if token is not None:
+                try:
+                    whoistel.stop_stage_timings(token)
+                except ValueError:
+                    # Token created in another context (e.g. an async view): nothing to reset here
+                    pass
+
+    profile_token = app.config['PROFILE_TOKEN']
+    if app.config['PROFILE_EVERY'] or profile_token:
+        sample = profiling.Sampler(app.config['PROFILE_EVERY'])
+
+        @app.before_request
+        def start_profile():
+            if sample() or profiling.token_matches(request.headers.get(profiling.PROFILE_HEADER), profile_token):
+                g.profiler = profiling.start()
+                g.profile_started = time.perf_counter()
+
+        @app.after_request
+        def record_profile_status(response):
+            if g.get('profiler') is not None:
+                g.profile_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def save_profile(_error):
+            """Saves the request's profile (also when the request failed)."""
+            profiler = g.pop('profiler', None)
+            if profiler is None:
+                return
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            number = (request.view_args or {}).get('number') or request.form.get('number')
+            profiling.save(profiler, app.config['PROFILE_DIR'], app.config['PROFILE_KEEP'], label=f"{request.method} {route}",
+                           method=request.method, route=route, path=request.path, number=number,
+                           status=g.pop('profile_status', 500),
+                           duration_ms=round((time.perf_counter() - g.profile_started) * 1000, 3))
+
+    if profile_token:
+        def _require_profile_token():
+            # Header only: a token in the URL would leak into logs, Referer headers and browser history
+            if not profiling.token_matches(request.headers.get(profiling.PROFILE_HEADER), profile_token):
+                abort(404)
+
+        @app.route('/admin/profiles', methods=['GET'])
+        def profiles():
+            """Lists the saved request and CLI profiles (admin token required)."""
+            _require_profile_token()
+            entries = profiling.load_index(app.config['PROFILE_DIR'])
+            return render_template('profiles.html', entries=entries)
+
+        @app.route('/admin/profiles/<name>', methods=['GET'])
+        def profile_file(name):
+            """Downloads one pstats file (admin token required)."""
+            _require_profile_token()
+            path = profiling.profile_path(app.config['PROFILE_DIR'], name)
+            if path is None:
+                abort(404)
+            return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
+
+        @app.route('/admin/memory', methods=['GET'])
+        def memory_report():
+            """RSS, tracemalloc top allocators and in-memory structure sizes of this worker (admin token required)."""
+            _require_profile_token()
+            top = request.args.get('top', memprofile.DEFAULT_TOP, type=int)
+            return jsonify({'pid': os.getpid(), 'process': memprofile.process_report(top),
+                            'structures': memprofile.describe_structures(memory_structures)})
+
     @app.teardown_appcontext
     def close_dbs(_error):
         """Closes all database connections at the end of the request."""
@@ -106,19 +374,49 @@ def create_app(test_config=None):
     @app.route('/view/<number>', methods=['GET'])
     def view_number(number):
         """Displays information and history for a specific phone number."""
-        cleaned_number = whoistel.clean_phone_number(number)
-        
-        if not whoistel.is_valid_phone_format(cleaned_number):
+        with whoistel.timed_stage('normalise'):
+            cleaned_number = whoistel.clean_phone_number(number)
+            valid = whoistel.is_valid_phone_format(cleaned_number)
+
+        if not valid:
             return render_template('error.html', message="Le format du numéro est invalide."), 400
 
         if cleaned_number != number:
             return redirect(url_for('view_number', number=cleaned_number))
 
         conn = _get_db('main_db', whoistel.setup_db_connection)
-        result = whoistel.get_full_info(conn, cleaned_number)
-        spam_count = history_manager.get_spam_count(cleaned_number, conn=_get_db('history_db', history_manager.get_db_connection))
+        if lookup_cache is not None:
+            lookup_cache.sync(conn)
+        result = whoistel.get_full_info(conn, cleaned_number, cache=lookup_cache)
+        with whoistel.timed_stage('spam_count'):
+            spam_count = history_manager.get_spam_count(cleaned_number, conn=_get_db('history_db', history_manager.get_db_connection))
+
+        with whoistel.timed_stage('render'):
+            return render_template('result.html', result=result, spam_count=spam_count, number=cleaned_number)
 
-        return render_template('result.html', result=result, spam_count=spam_count, number=cleaned_number)
+    @app.route('/api/lookup/<number>', methods=['GET'])
+    def api_lookup(number):
+        """Returns the lookup result as JSON; ?explain=1 adds the step-by-step explanation."""
+        explain = request.args.get('explain') == '1'
+        with whoistel.timed_stage('normalise'):
+            tel = whoistel.clean_phone_number(number)
+            valid = whoistel.is_valid_phone_format(tel)
+        if not valid:
+            error = {'error': "Le format du numéro est invalide."}
+            if explain:
+                error['explain'] = whoistel.explain_lookup(None, number)
+            return jsonify(error), 400
+
+        conn = _get_db('main_db', whoistel.setup_db_connection)
+        if lookup_cache is not None:
+            lookup_cache.sync(conn)
+        if not explain:
+            return jsonify(whoistel.get_full_info(conn, tel, cache=lookup_cache))
+        explanation = whoistel.explain_lookup(conn, number, cache=lookup_cache)
+        # Cached results are shared: copy before adding the explanation
+        result = dict(explanation.pop('result'))
+        result['explain'] = explanation
+        return jsonify(result)
 
     @app.route('/report', methods=['POST'])
     def report():
@@ -154,7 +452,29 @@ def create_app(test_config=None):
             flash("Veuillez cocher la case spam, ajouter un commentaire ou une date.", "error")
             return redirect(url_for('view_number', number=number))
 
-        history_manager.add_report(number, date, is_spam, comment, conn=_get_db('history_db', history_manager.get_db_connection))
+        content_hash = ReportGuard.content_hash(date, is_spam, comment)
+        drop_reason = report_guard.check(request.remote_addr, number, content_hash)
+        if drop_reason == DROP_DUPLICATE:
+            flash("Ce signalement a déjà été enregistré.", "info")
+            return redirect(url_for('view_number', number=number))
+        if drop_reason:
+            app.logger.warning(f"Report dropped ({drop_reason}) from {request.remote_addr}")
+            return render_template('error.html', message="Trop de signalements, veuillez réessayer plus tard."), 429
+
+        # Enrichment for the heatmap is best-effort: a missing ARCEP database must not block reports.
+        try:
+            lookup_conn = _get_db('main_db', whoistel.setup_db_connection)
+        except whoistel.DatabaseError:
+            lookup_conn = None
+
+        try:
+            with metrics.REPORT_WRITE_LATENCY.time() if metrics_enabled else nullcontext():
+                history_manager.add_report(number, date, is_spam, comment, lookup_conn=lookup_conn,
+                                           conn=_get_db('history_db', history_manager.get_db_connection))
+        except Exception:
+            # Nothing was written: a retry must not be dropped as a duplicate
+            report_guard.forget(request.remote_addr, number, content_hash)
+            raise
         flash("Signalement enregistré.", "success")
         return redirect(url_for('view_number', number=number))
 
@@ -164,9 +484,51 @@ def create_app(test_config=None):
         reports = history_manager.get_recent_reports(conn=_get_db('history_db', history_manager.get_db_connection))
         return render_template('history.html', reports=reports)
 
-    # Initialize history database schema if needed
+    @app.route('/top', methods=['GET'])
+    def top_reported():
+        """Displays the most reported numbers over a rolling window."""
+        window = request.args.get('window', history_manager.DEFAULT_LEADERBOARD_WINDOW)
+        if window not in history_manager.LEADERBOARD_WINDOWS:
+            return render_template('error.html', message="Période inconnue."), 400
+
+        entries = history_manager.get_top_reported(window, conn=_get_db('history_db', history_manager.get_db_connection))
+        return render_template('top.html', entries=entries, window=window,
+                               windows=history_manager.LEADERBOARD_WINDOWS)
+
+    @app.route('/api/report-guard', methods=['GET'])
+    def api_report_guard():
+        """Returns accepted and dropped report submission counters as JSON."""
+        return jsonify(report_guard.stats())
+
+    @app.route('/heatmap', methods=['GET'])
+    def heatmap():
+        """Displays spam counters by region, operator and ARCEP prefix block."""
+        conn = _get_db('history_db', history_manager.get_db_connection)
+        groups = {by: history_manager.get_heatmap(by, conn=conn) for by in history_manager.HEATMAP_GROUPINGS}
+        return render_template('heatmap.html', groups=groups)
+
+    @app.route('/api/heatmap', methods=['GET'])
+    def api_heatmap():
+        """Returns spam heatmap counters as JSON, grouped by ?by=prefix|operator|region."""
+        by = request.args.get('by', 'prefix')
+        if by not in history_manager.HEATMAP_GROUPINGS:
+            return jsonify({'error': f"Unknown grouping '{by}'"}), 400
+        entries = history_manager.get_heatmap(by, conn=_get_db('history_db', history_manager.get_db_connection))
+        return jsonify({'by': by, 'entries': entries})
+
+    # Initialize history database schema if needed; the ARCEP database, when
+    # present, backfills a newly created heatmap.
     with app.app_context():
-        history_manager.init_history_db()
+        if os.path.exists(whoistel.DB_FILE):
+            with closing(whoistel.setup_db_connection()) as lookup_conn:
+                history_manager.init_history_db(lookup_conn=lookup_conn)
+        else:
+            history_manager.init_history_db()
+
+    # Optional low-priority archival of old reports (HISTORY_RETENTION_DAYS)
+    retention_days = app.config.get('HISTORY_RETENTION_DAYS', history_retention.RETENTION_DAYS)
+    if retention_days:
+        history_retention.start_retention_thread(retention_days)
 
     return app
 
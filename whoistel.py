@@ -6,20 +6,28 @@ from the ARCEP database.
 """
 import sqlite3
 import argparse
+import csv
 import sys
 import os
 import logging
 import re
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from itertools import tee
+from datetime import date
 from urllib.parse import urlparse
 from email_validator import validate_email, EmailNotValidError
-from contextlib import closing
+from contextlib import closing, contextmanager
+import metrics
+import profiling
+import sqltrace
 
 class DatabaseError(Exception):
     """Custom exception raised for database-related errors."""
     pass
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(message)s') # Simplified format for CLI
 logger = logging.getLogger(__name__)
 
 DB_FILE = os.environ.get('WHOISTEL_DB_FILE', 'whoistel.sqlite3')
@@ -32,6 +40,67 @@ REGION_MAP = {
     '05': 'Sud-Ouest'
 }
 
+# Country codes (E.164) sharing the French numbering plan, with the territories they serve.
+# Mayotte moved from +269 to +262 in 2007; the old code is still accepted.
+COUNTRY_CODES = {
+    '33': 'Métropole',
+    '262': 'La Réunion / Mayotte',
+    '508': 'Saint-Pierre-et-Miquelon',
+    '590': 'Guadeloupe / Saint-Martin / Saint-Barthélemy',
+    '594': 'Guyane',
+    '596': 'Martinique',
+}
+COUNTRY_CODE_ALIASES = {'269': '262'}
+METROPOLE_CODE = '33'
+
+# National blocks (first four digits) of the overseas territories, mapped to
+# their country code: national numbers are dispatched to a partition with a
+# single dict lookup. Every other number belongs to the metropolitan partition.
+OVERSEAS_BLOCKS = {
+    '0262': '262', '0263': '262', '0692': '262', '0693': '262',  # La Réunion
+    '0269': '262', '0639': '262',                                # Mayotte
+    '0508': '508',                                               # Saint-Pierre-et-Miquelon
+    '0590': '590', '0690': '590', '0691': '590',                 # Guadeloupe, Saint-Martin, Saint-Barthélemy
+    '0594': '594', '0694': '594',                                # Guyane
+    '0596': '596', '0696': '596', '0697': '596',                 # Martinique
+}
+
+def normalize_e164(raw_tel):
+    """
+    Splits an international number (+CC... or 00CC...) into its country code
+    and national number (trunk '0' + national significant number). Country
+    codes are prefix-free, so at most three dict lookups find it.
+
+    Args:
+        raw_tel (str): Number without separators.
+
+    Returns:
+        tuple: (country_code, national_number), or (None, raw_tel) when the
+        number is not international or its country code is not part of the
+        French numbering plan.
+    """
+    if raw_tel.startswith('+'):
+        digits = raw_tel[1:]
+    elif raw_tel.startswith('00'):
+        digits = raw_tel[2:]
+    else:
+        return None, raw_tel
+    for length in (1, 2, 3):
+        code = COUNTRY_CODE_ALIASES.get(digits[:length], digits[:length])
+        if code in COUNTRY_CODES:
+            nsn = digits[length:]
+            # '+33 (0) 6...' keeps the trunk prefix once the parenthesis is removed
+            if nsn.startswith('0'):
+                nsn = nsn[1:]
+            return code, f"0{nsn}"
+    return None, raw_tel
+
+def country_code_of(tel):
+    """Returns the country code whose partition holds a cleaned national number."""
+    return OVERSEAS_BLOCKS.get(tel[:4], METROPOLE_CODE)
+
+SEPARATORS = re.compile(r'[\s.\-()/]')
+
 def clean_phone_number(raw_tel):
     """
     Cleans a raw phone number by removing separators and handling international prefixes.
@@ -45,16 +114,10 @@ def clean_phone_number(raw_tel):
     if not raw_tel:
         return ""
     # Remove separators and parenthesis (including tabs, non-breaking spaces)
-    tel = re.sub(r'[\s.\-()/]', '', raw_tel)
-
-    # Handle +33 (0) case which becomes +330... after removal
-    if tel.startswith('+330'):
-        tel = f"0{tel[4:]}"
-    elif tel.startswith('+33'):
-        tel = f"0{tel[3:]}"
-    elif tel.startswith('0033'):
-        tel = f"0{tel[4:]}"
+    tel = SEPARATORS.sub('', raw_tel)
 
+    # +33, +262, 00590... (including the '+33 (0)' form) become national numbers
+    _, tel = normalize_e164(tel)
     return tel
 
 def is_valid_phone_format(tel):
@@ -71,6 +134,23 @@ def is_valid_phone_format(tel):
         return False
     return tel.isdigit() and len(tel) == 10
 
+class Connection(sqlite3.Connection):
+    """Connection to the ARCEP database that remembers its tables (see database_tables)."""
+    tables = None
+
+def database_tables(conn):
+    """
+    Names of the tables of the ARCEP database, which select the lookup
+    engine (compact schema, LookupNumeros, overseas ranges). Read once per
+    Connection; other connections read sqlite_master on every call.
+    """
+    tables = conn.tables if isinstance(conn, Connection) else None
+    if tables is None:
+        tables = frozenset(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        if isinstance(conn, Connection):
+            conn.tables = tables
+    return tables
+
 def setup_db_connection():
     """
     Establishes a connection to the SQLite database.
@@ -81,7 +161,7 @@ def setup_db_connection():
         logger.error(msg)
         raise DatabaseError(msg)
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = sqlite3.connect(DB_FILE, factory=Connection)
         conn.row_factory = sqlite3.Row
     except sqlite3.Error as e:
         msg = f"Erreur lors de la connexion à la base de données: {e}"
@@ -90,6 +170,27 @@ def setup_db_connection():
     else:
         return conn
 
+def sanitize_contact(mail, site):
+    """
+    Validates an operator email and website, replacing malformed values
+    with None to prevent display of malformed data.
+
+    Returns:
+        tuple: (mail, site)
+    """
+    if mail:
+        try:
+            validate_email(mail, check_deliverability=False)
+        except EmailNotValidError:
+            mail = None
+
+    if site:
+        parsed = urlparse(site)
+        if not parsed.scheme or not parsed.netloc or parsed.scheme not in ['http', 'https']:
+            site = None
+
+    return mail, site
+
 def get_operator_info(conn, code_operateur):
     """
     Retrieves operator details (name, type, email, site) from the database by operator code.
@@ -102,21 +203,7 @@ def get_operator_info(conn, code_operateur):
     cursor.execute("SELECT NomOperateur, TypeOperateur, MailOperateur, SiteOperateur FROM Operateurs WHERE CodeOperateur=?", (code_operateur,))
     row = cursor.fetchone()
     if row:
-        mail = row['MailOperateur']
-        site = row['SiteOperateur']
-
-        # Validate and sanitize email/URL to prevent display of malformed data
-        if mail:
-            try:
-                validate_email(mail, check_deliverability=False)
-            except EmailNotValidError:
-                mail = None
-
-        if site:
-            parsed = urlparse(site)
-            if not parsed.scheme or not parsed.netloc or parsed.scheme not in ['http', 'https']:
-                site = None
-
+        mail, site = sanitize_contact(row['MailOperateur'], row['SiteOperateur'])
         return {
             'code': code_operateur,
             'nom': row['NomOperateur'],
@@ -147,6 +234,59 @@ def get_commune_info(conn, code_insee):
         }
     return None
 
+# Steps recorded by explain_lookup for the lookup running in this context (None otherwise).
+_explain_steps = ContextVar('whoistel_explain_steps', default=None)
+# Seconds spent per stage by the web request running in this context (None otherwise).
+_stage_timings = ContextVar('whoistel_stage_timings', default=None)
+
+@contextmanager
+def timed_stage(name):
+    """
+    Times a lookup or page stage for the metrics (when metrics.ENABLED),
+    adds it to the stage timings being collected (see
+    collect_stage_timings) and, under explain_lookup, records it as a step.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if metrics.ENABLED:
+            metrics.LOOKUP_STAGE_LATENCY.observe(elapsed, name)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+        steps = _explain_steps.get()
+        if steps is not None:
+            steps.append({'step': name, 'us': round(elapsed * 1e6, 1)})
+
+def collect_stage_timings():
+    """
+    Starts collecting the timed_stage durations of the current context.
+
+    Returns:
+        tuple: (dict stage -> seconds, filled as stages run; token for
+        stop_stage_timings).
+    """
+    timings = {}
+    return timings, _stage_timings.set(timings)
+
+def stop_stage_timings(token):
+    """Stops the collection started by collect_stage_timings."""
+    _stage_timings.reset(token)
+
+def _explain_note(step, **details):
+    """Records what a lookup decided (engine, cache outcome) when running under explain_lookup."""
+    steps = _explain_steps.get()
+    if steps is not None:
+        steps.append({'step': step, **details})
+
+def _explain_probe(table, prefixes, match):
+    """Records one prefix query a lookup ran (under explain_lookup): the prefixes it covered and the one it matched."""
+    steps = _explain_steps.get()
+    if steps is not None:
+        steps.append({'step': 'probe', 'table': table, 'prefixes': prefixes, 'match': match})
+
 def search_number(conn, tel):
     """
     Search for a phone number range in the database.
@@ -158,6 +298,15 @@ def search_number(conn, tel):
     Returns:
         dict | None: A dictionary containing 'prefix', 'code_operateur', 'code_insee', and 'type', or None if no match.
     """
+    country_code = country_code_of(tel)
+    if country_code != METROPOLE_CODE:
+        return search_number_overseas(conn, tel, country_code)
+
+    if 'PlagesCompactes' in database_tables(conn):
+        # Compact schema (generatedb.py --compact-schema): no text range tables.
+        _explain_note('engine', engine='compact')
+        return search_number_compact(conn, tel)
+
     cursor = conn.cursor()
 
     # 1. Determine if Geo or Non-Geo
@@ -170,6 +319,7 @@ def search_number(conn, tel):
     # We check prefixes from length 7 down to 2.
     best_match = None
 
+    _explain_note('engine', engine='range_tables')
     for length in range(min(len(tel), 9), 1, -1):
         prefix = tel[:length]
         # logging.debug(f"Checking prefix: {prefix} in {table}")
@@ -177,6 +327,7 @@ def search_number(conn, tel):
         if is_geo:
             cursor.execute(f"SELECT CodeOperateur, CodeInsee FROM {table} WHERE PlageTel=?", (prefix,))
             row = cursor.fetchone()
+            _explain_probe(table, [prefix], prefix if row else None)
             if row:
                 best_match = {
                     'prefix': prefix,
@@ -188,6 +339,7 @@ def search_number(conn, tel):
         else:
             cursor.execute(f"SELECT CodeOperateur FROM {table} WHERE PlageTel=?", (prefix,))
             row = cursor.fetchone()
+            _explain_probe(table, [prefix], prefix if row else None)
             if row:
                 best_match = {
                     'prefix': prefix,
@@ -199,11 +351,343 @@ def search_number(conn, tel):
 
     return best_match
 
-def get_full_info(conn, tel):
+def search_number_compact(conn, tel):
+    """
+    search_number for the compact schema, where ranges are keyed by
+    (Longueur, Prefixe) integers and operator codes live in CodesOperateurs.
+    All candidate prefixes are probed in one query. Same result format.
+    """
+    is_geo = tel.startswith('0') and len(tel) >= 2 and tel[1] in '12345'
+    lengths = [length for length in range(min(len(tel), 9), 1, -1) if tel[:length].isdigit()]
+    if not lengths:
+        return None
+    keys = [value for length in lengths for value in (length, int(tel[:length]))]
+    row = conn.execute(f'''
+        SELECT p.Longueur, o.CodeOperateur, p.CodeInsee FROM PlagesCompactes p
+        LEFT JOIN CodesOperateurs o ON o.Id = p.OperateurId
+        WHERE (p.Longueur, p.Prefixe) IN (VALUES {', '.join(['(?, ?)'] * len(lengths))}) AND p.Geographique = ?
+        ORDER BY p.Longueur DESC LIMIT 1
+    ''', (*keys, int(is_geo))).fetchone()
+    _explain_probe('PlagesCompactes', [tel[:length] for length in lengths], tel[:row[0]] if row else None)
+    if row is None:
+        return None
+    return {
+        'prefix': tel[:row[0]],
+        'code_operateur': row[1],
+        'code_insee': row[2] if is_geo else None,
+        'type': 'Geographique' if is_geo else 'Non-Geographique'
+    }
+
+def search_number_overseas(conn, tel, country_code):
+    """
+    search_number for an overseas number: all candidate prefixes are probed
+    in one query restricted to the country_code partition of PlagesOutreMer.
+    Same result format, plus 'territoire'. None if the database predates
+    overseas support.
+    """
+    _explain_note('engine', engine='overseas', country_code=country_code)
+    is_geo = tel[1] in '12345'
+    if 'PlagesOutreMer' not in database_tables(conn):
+        return None
+    prefixes = [tel[:length] for length in range(min(len(tel), 9), 3, -1)]
+    row = conn.execute(f'''
+        SELECT PlageTel, CodeOperateur, Territoire FROM PlagesOutreMer
+        WHERE Indicatif = ? AND PlageTel IN ({', '.join('?' * len(prefixes))})
+        ORDER BY length(PlageTel) DESC LIMIT 1
+    ''', (country_code, *prefixes)).fetchone()
+    _explain_probe('PlagesOutreMer', prefixes, row[0] if row else None)
+    if row is None:
+        return None
+    return {
+        'prefix': row[0],
+        'code_operateur': row[1],
+        'code_insee': None,
+        'type': 'Geographique' if is_geo else 'Non-Geographique',
+        'territoire': row[2]
+    }
+
+def parse_as_of(value):
+    """
+    Normalizes an "as of" date (date, datetime or ISO string such as
+    '2024-05-01' or '2024-05-01 13:45:00') to 'YYYY-MM-DD'.
+
+    Raises:
+        ValueError: If the value is not a date.
+    """
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()[:10]
+    return date.fromisoformat(str(value).strip()[:10]).isoformat()
+
+def search_number_as_of(conn, tel, as_of):
+    """
+    Like search_number, but against the range assignments valid on the
+    'YYYY-MM-DD' date as_of (HistoriquePlages). All candidate prefixes are
+    probed in one query on the (PlageTel, ValidFrom, ValidTo) index.
+    """
+    is_geo = tel.startswith('0') and len(tel) >= 2 and tel[1] in '12345'
+    # Overseas numbers must not fall back to a shorter metropolitan prefix.
+    shortest = 4 if country_code_of(tel) != METROPOLE_CODE else 2
+    prefixes = [tel[:length] for length in range(min(len(tel), 9), shortest - 1, -1)]
+    placeholders = ', '.join('?' * len(prefixes))
+    _explain_note('engine', engine='history')
+    try:
+        row = conn.execute(f'''
+            SELECT PlageTel, CodeOperateur FROM HistoriquePlages
+            WHERE PlageTel IN ({placeholders}) AND ValidFrom <= ? AND ValidTo > ?
+            ORDER BY length(PlageTel) DESC LIMIT 1
+        ''', (*prefixes, as_of, as_of)).fetchone()
+    except sqlite3.OperationalError as e:
+        raise DatabaseError(f"Erreur: historique des attributions indisponible ({e}). Veuillez régénérer la base.") from e
+    _explain_probe('HistoriquePlages', prefixes, row[0] if row else None)
+    if row is None:
+        return None
+    return {
+        'prefix': row[0],
+        'code_operateur': row[1],
+        'code_insee': None,
+        'type': 'Geographique' if is_geo else 'Non-Geographique'
+    }
+
+class LookupCache:
+    """
+    Thread-safe LRU cache of get_full_info results, kept consistent with the
+    database it caches: a new build_id (full rebuild) clears it, and new
+    ChangeLog rows (incremental update) evict only the numbers under the
+    changed prefixes, operators or communes. Cached results are shared and
+    must be treated as read-only.
+    """
+    def __init__(self, maxsize=10000, sync_interval=1.0):
+        self.maxsize = maxsize
+        self.sync_interval = sync_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._synced_at = None
+        self._build_id = None
+        self._last_change = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tel):
+        with self._lock:
+            result = self._entries.get(tel)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(tel)
+            self.hits += 1
+            return result
+
+    def put(self, tel, result):
+        with self._lock:
+            self._entries[tel] = result
+            self._entries.move_to_end(tel)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self, conn):
+        """
+        Checks the database for a new build or new ChangeLog rows (at most
+        once per sync_interval seconds) and invalidates accordingly.
+        """
+        now = time.monotonic()
+        if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        first_sync = self._synced_at is None
+        self._synced_at = now
+
+        try:
+            build_id, last_change = conn.execute(
+                "SELECT (SELECT Value FROM BuildInfo WHERE Key='build_id'), (SELECT MAX(Id) FROM ChangeLog)"
+            ).fetchone()
+        except sqlite3.Error:
+            # Databases without metadata tables cannot be tracked.
+            build_id, last_change = None, None
+        last_change = last_change or 0
+
+        if first_sync or build_id != self._build_id:
+            self.clear()
+            self._build_id = build_id
+            self._last_change = last_change
+            return
+        if last_change > self._last_change:
+            rows = conn.execute("SELECT TableName, KeyValue FROM ChangeLog WHERE Id > ?",
+                                (self._last_change,)).fetchall()
+            self._last_change = last_change
+            self.invalidate(rows)
+
+    def invalidate(self, changes):
+        """Evicts the entries affected by (TableName, KeyValue) change-log rows."""
+        prefixes, operators, communes = set(), set(), set()
+        for table, key in changes:
+            if table == 'Operateurs':
+                operators.add(key)
+            elif table == 'Communes':
+                communes.add(key)
+            else:
+                prefixes.add(key)
+        lengths = {len(p) for p in prefixes}
+
+        def affected(tel, result):
+            if any(tel[:length] in prefixes for length in lengths):
+                return True
+            if result.get('code_operateur') in operators:
+                return True
+            return (result.get('location') or {}).get('code_insee') in communes
+
+        with self._lock:
+            stale = [tel for tel, result in self._entries.items() if affected(tel, result)]
+            for tel in stale:
+                del self._entries[tel]
+            self.evictions += len(stale)
+        return len(stale)
+
+def get_full_info(conn, tel, cache=None, as_of=None):
     """
     Combines search results with operator and location details into a dictionary.
+    Results are served from and stored into `cache` (a LookupCache) when given.
+    With `as_of` (see parse_as_of), the range assignment valid on that date
+    is used instead of the current one; such lookups are not cached.
+    """
+    if as_of is not None:
+        return _build_full_info(conn, tel, parse_as_of(as_of))
+    if cache is not None:
+        cached = cache.get(tel)
+        _explain_note('cache', hit=cached is not None)
+        if cached is not None:
+            return cached
+        result = _build_full_info(conn, tel)
+        cache.put(tel, result)
+        return result
+    return _build_full_info(conn, tel)
+
+# How each engine answers, and labels of the explained steps.
+ENGINE_LABELS = {
+    'lookup_table': "LookupNumeros (table dénormalisée, une requête pour tous les préfixes)",
+    'range_tables': "tables de plages (une requête par préfixe, du plus long au plus court)",
+    'compact': "schéma compact PlagesCompactes (une requête pour tous les préfixes)",
+    'overseas': "partition outre-mer PlagesOutreMer (une requête pour tous les préfixes)",
+    'history': "historique HistoriquePlages (une requête pour tous les préfixes)",
+}
+STEP_LABELS = {
+    'separators': "Séparateurs",
+    'e164': "Indicatif",
+    'format': "Format",
+    'partition': "Partition",
+    'cache': "Cache",
+    'engine': "Moteur",
+    'lookup_table': "Lecture LookupNumeros",
+    'search_number': "Recherche de plage",
+    'search_number_as_of': "Recherche historique",
+    'operator': "Opérateur",
+    'commune': "Commune",
+}
+
+def explain_lookup(conn, raw_tel, cache=None, as_of=None):
     """
-    info = search_number(conn, tel)
+    Runs a lookup of a raw number and explains it: each normalisation step,
+    the cache outcome, the engine that answered, every prefix query it ran
+    (as recorded by the engine: one per prefix for the range walk, one for
+    all prefixes elsewhere) and the elapsed microseconds of every step. The
+    lookup itself is the regular get_full_info code path.
+
+    Returns:
+        dict: 'input', 'number', 'valid', 'country_code', 'engine',
+        'steps', 'probes' ({'table', 'prefixes', 'match'} per query),
+        'total_us' and 'result' (None for an invalid number).
+    """
+    steps = []
+    started = time.perf_counter()
+
+    def timed(step, since, **details):
+        steps.append({'step': step, 'us': round((time.perf_counter() - since) * 1e6, 1), **details})
+
+    t = time.perf_counter()
+    stripped = SEPARATORS.sub('', raw_tel or '')
+    timed('separators', t, detail=f"«{raw_tel}» -> «{stripped}»")
+    t = time.perf_counter()
+    country_code, tel = normalize_e164(stripped)
+    timed('e164', t, detail=f"+{country_code} -> «{tel}»" if country_code else "format national")
+    t = time.perf_counter()
+    valid = is_valid_phone_format(tel)
+    timed('format', t, detail="valide" if valid else "invalide (10 chiffres attendus)")
+    explanation = {'input': raw_tel, 'number': tel, 'valid': valid, 'country_code': None, 'engine': None,
+                   'steps': steps, 'probes': [], 'total_us': None, 'result': None}
+    if not valid:
+        explanation['total_us'] = round((time.perf_counter() - started) * 1e6, 1)
+        return explanation
+
+    t = time.perf_counter()
+    partition = country_code_of(tel)
+    timed('partition', t, detail=f"+{partition} ({COUNTRY_CODES[partition]})")
+    explanation['country_code'] = partition
+
+    token = _explain_steps.set(steps)
+    try:
+        result = get_full_info(conn, tel, cache=cache, as_of=as_of)
+    finally:
+        _explain_steps.reset(token)
+    explanation['total_us'] = round((time.perf_counter() - started) * 1e6, 1)
+    explanation['result'] = result
+
+    explanation['probes'] = [{key: value for key, value in step.items() if key != 'step'}
+                             for step in steps if step['step'] == 'probe']
+    steps[:] = [step for step in steps if step['step'] != 'probe']
+    engines = [step['engine'] for step in steps if step['step'] == 'engine']
+    explanation['engine'] = engines[-1] if engines else None
+    for step in steps:
+        if step['step'] == 'engine':
+            step['detail'] = ENGINE_LABELS[step['engine']]
+        elif step['step'] == 'cache':
+            step['detail'] = "trouvé" if step['hit'] else "absent"
+    return explanation
+
+def print_explanation(explanation, file=None):
+    """Prints an explain_lookup result (without the lookup result itself)."""
+    file = file or sys.stdout
+    print("--- Explication ---", file=file)
+    for step in explanation['steps']:
+        elapsed = f"{step['us']:9.1f} µs" if 'us' in step else ' ' * 12
+        print(f"{STEP_LABELS.get(step['step'], step['step']):<22} {elapsed}  {step.get('detail', '')}".rstrip(), file=file)
+    for number, probe in enumerate(explanation['probes'], 1):
+        label = f"Requête {number}" if len(explanation['probes']) > 1 else "Requête"
+        print(f"{label:<22} {' ' * 12}  {probe['table']}: {', '.join(probe['prefixes'])} -> {probe['match'] or 'aucun'}",
+              file=file)
+    print(f"{'Total':<22} {explanation['total_us']:9.1f} µs", file=file)
+    print(file=file)
+
+# Columns of LookupNumeros (built by generatedb.build_lookup_table), in read order.
+LOOKUP_COLUMNS = ('PlageTel', 'CodeOperateur', 'NomOperateur', 'TypeOperateur', 'MailOperateur', 'SiteOperateur',
+                  'CodeInsee', 'NomCommune', 'CodePostal', 'NomDepartement', 'Latitude', 'Longitude', 'Region')
+
+def lookup_full_info(conn, tel):
+    """
+    Builds the get_full_info result from the denormalised LookupNumeros
+    table: a single indexed read over all candidate prefixes, longest first.
+
+    Returns:
+        dict | None: The result, or None if the database has no LookupNumeros
+        table or tel is an overseas number (LookupNumeros is metropolitan only).
+    """
+    if country_code_of(tel) != METROPOLE_CODE or 'LookupNumeros' not in database_tables(conn):
+        return None
+    is_geo = tel.startswith('0') and len(tel) >= 2 and tel[1] in '12345'
+    number_type = 'Geographique' if is_geo else 'Non-Geographique'
+    prefixes = [tel[:length] for length in range(min(len(tel), 9), 1, -1)]
+    row = conn.execute(f'''
+        SELECT {', '.join(LOOKUP_COLUMNS)} FROM LookupNumeros
+        WHERE PlageTel IN ({', '.join('?' * len(prefixes))}) AND Type = ?
+        ORDER BY length(PlageTel) DESC LIMIT 1
+    ''', (*prefixes, number_type)).fetchone()
+    _explain_probe('LookupNumeros', prefixes, row[0] if row else None)
+
     result = {
         'number': tel,
         'found': False,
@@ -213,9 +697,61 @@ def get_full_info(conn, tel):
         'location': None,
         'error': None
     }
+    if row is None:
+        result['error'] = "Numéro inconnu dans la base ARCEP (pas d'opérateur assigné trouvé)."
+        return result
+
+    (prefix, code_operateur, nom, type_operateur, mail, site,
+     code_insee, commune, code_postal, departement, latitude, longitude, region) = tuple(row)
+    result['found'] = True
+    result['type'] = number_type
+    result['prefix'] = prefix
+    result['code_operateur'] = code_operateur
+    result['operator'] = {'code': code_operateur, 'nom': nom, 'type': type_operateur, 'mail': mail, 'site': site}
+    if code_insee is not None:
+        result['location'] = {
+            'code_insee': code_insee,
+            'commune': commune,
+            'code_postal': code_postal,
+            'departement': departement,
+            'latitude': latitude,
+            'longitude': longitude
+        }
+    if region is not None:
+        result['location'] = result['location'] or {}
+        result['location']['region'] = region
+    return result
+
+def _build_full_info(conn, tel, as_of=None):
+    if as_of is None:
+        with timed_stage('lookup_table'):
+            result = lookup_full_info(conn, tel)
+        if result is not None:
+            _explain_note('engine', engine='lookup_table')
+            return result
+    return normalized_full_info(conn, tel, as_of)
+
+def normalized_full_info(conn, tel, as_of=None):
+    """Builds the get_full_info result from the normalised tables (range walk, then operator and commune queries)."""
+    with timed_stage('search_number' if as_of is None else 'search_number_as_of'):
+        info = search_number(conn, tel) if as_of is None else search_number_as_of(conn, tel, as_of)
+    result = {
+        'number': tel,
+        'found': False,
+        'type': None,
+        'prefix': None,
+        'operator': None,
+        'location': None,
+        'error': None
+    }
+    if as_of is not None:
+        result['as_of'] = as_of
 
     if not info:
-        result['error'] = "Numéro inconnu dans la base ARCEP (pas d'opérateur assigné trouvé)."
+        if as_of is not None:
+            result['error'] = f"Numéro inconnu dans l'historique ARCEP au {as_of} (pas d'opérateur assigné à cette date)."
+        else:
+            result['error'] = "Numéro inconnu dans la base ARCEP (pas d'opérateur assigné trouvé)."
         return result
 
     result['found'] = True
@@ -224,7 +760,8 @@ def get_full_info(conn, tel):
     result['code_operateur'] = info['code_operateur']
 
     # Operator Info
-    op_info = get_operator_info(conn, info['code_operateur'])
+    with timed_stage('operator'):
+        op_info = get_operator_info(conn, info['code_operateur'])
     if op_info:
         result['operator'] = op_info
     else:
@@ -232,10 +769,17 @@ def get_full_info(conn, tel):
 
     # Location Info
     if info['code_insee'] and info['code_insee'] != '0':
-        result['location'] = get_commune_info(conn, info['code_insee'])
+        with timed_stage('commune'):
+            result['location'] = get_commune_info(conn, info['code_insee'])
     
+    # Overseas numbers: the territory stands in for the region, whatever the type
+    country_code = country_code_of(tel)
+    if country_code != METROPOLE_CODE:
+        if not result['location']:
+            result['location'] = {}
+        result['location']['region'] = info.get('territoire') or COUNTRY_CODES[country_code]
     # Always try to add region for Geographique numbers
-    if info['type'] == 'Geographique':
+    elif info['type'] == 'Geographique':
         region_code = tel[:2]
         if region_code in REGION_MAP:
             if not result['location']:
@@ -244,6 +788,58 @@ def get_full_info(conn, tel):
 
     return result
 
+BATCH_FIELDS = ('numero', 'date', 'trouve', 'type', 'prefixe', 'code_operateur', 'operateur', 'erreur')
+
+def enrich_batch(conn, rows, as_of=None, cache=None):
+    """
+    Looks up a batch of numbers, e.g. call detail records.
+
+    Args:
+        rows (iterable): (raw_number, row_as_of) pairs; row_as_of may be None,
+            in which case `as_of` applies (None: current assignments).
+
+    Yields:
+        dict: get_full_info results, in input order. Invalid numbers or dates
+        yield a not-found result with an error message.
+    """
+    for raw_tel, row_as_of in rows:
+        tel = clean_phone_number(raw_tel)
+        if not is_valid_phone_format(tel):
+            yield {'number': raw_tel, 'found': False, 'error': "Numéro invalide (10 chiffres attendus)."}
+            continue
+        try:
+            yield get_full_info(conn, tel, cache=cache, as_of=row_as_of or as_of)
+        except ValueError:
+            yield {'number': tel, 'found': False, 'error': f"Date invalide : {row_as_of}"}
+
+def _batch_rows(f):
+    """Reads (numero, date) pairs from a CSV file with a 'numero' column and an optional 'date' column."""
+    header = f.readline()
+    try:
+        dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    except csv.Error:
+        # A lone 'numero' column has no delimiter to detect
+        dialect = csv.excel
+    fields = [name.strip().lower() for name in next(csv.reader([header], dialect))]
+    if 'numero' not in fields:
+        raise ValueError("Le fichier doit contenir une colonne 'numero' (et optionnellement 'date').")
+    for row in csv.DictReader(f, fieldnames=fields, dialect=dialect):
+        yield row['numero'] or '', (row.get('date') or '').strip() or None
+
+def write_batch(conn, f, out, as_of=None):
+    """Enriches the numbers of CSV file f and writes one CSV line per number to out (BATCH_FIELDS)."""
+    writer = csv.writer(out)
+    writer.writerow(BATCH_FIELDS)
+    # Streamed: tee buffers a single row since both sides advance together.
+    rows, lookups = tee(_batch_rows(f))
+    for (raw_tel, row_as_of), result in zip(rows, enrich_batch(conn, lookups, as_of, cache=LookupCache())):
+        operator = result.get('operator') or {}
+        writer.writerow((
+            result['number'], result.get('as_of') or row_as_of or '', int(result['found']),
+            result.get('type') or '', result.get('prefix') or '', result.get('code_operateur') or '',
+            operator.get('nom') or '', result.get('error') or '',
+        ))
+
 def print_result(result):
     """
     Prints the formatted search result to stdout.
@@ -255,6 +851,8 @@ def print_result(result):
         bool: True if result found and printed, False otherwise.
     """
     print(f"Numéro : {result['number']}")
+    if result.get('as_of'):
+        print(f"Date de référence : {result['as_of']}")
 
     if not result['found']:
         print(f"Résultat : {result.get('error', 'Inconnu')}")
@@ -297,8 +895,72 @@ def print_result(result):
 def main():
     """CLI entry point for searching phone number information."""
     parser = argparse.ArgumentParser(description="Outil de recherche d'informations sur les numéros de téléphone français (ARCEP).")
-    parser.add_argument("numero", help="Numéro de téléphone à rechercher (ex: 0123456789, +33612345678)")
+    parser.add_argument("numero", nargs='?', help="Numéro de téléphone à rechercher (ex: 0123456789, +33612345678)")
+    parser.add_argument("--as-of", metavar="AAAA-MM-JJ",
+                        help="Recherche l'opérateur attributaire à cette date (historique des attributions).")
+    parser.add_argument("--batch", metavar="FICHIER",
+                        help="Enrichit un fichier CSV (colonnes 'numero' et optionnellement 'date', '-' pour l'entrée standard) et écrit le résultat en CSV.")
+    parser.add_argument("--explain", action='store_true',
+                        help="Détaille la recherche : normalisation, moteur, préfixes sondés et durée de chaque étape.")
+    parser.add_argument("--profile", action='store_true',
+                        help="Profile l'exécution (cProfile) et écrit le fichier pstats dans WHOISTEL_PROFILE_DIR.")
+    parser.add_argument("--trace-sql", action='store_true',
+                        help="Affiche sur la sortie d'erreur chaque requête SQL exécutée, avec sa durée et ses lignes.")
+    parser.add_argument("--sql-budget", type=int, metavar="N",
+                        help="Échoue si l'exécution lance plus de N requêtes SQL (implique --trace-sql).")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    tracer = None
+    if args.trace_sql or args.sql_budget is not None:
+        tracer = sqltrace.Tracer(budget=args.sql_budget, on_exceeded=sqltrace.BUDGET_RAISE,
+                                 label=args.batch and f"--batch {args.batch}" or args.numero or '')
+    try:
+        if args.profile:
+            label = f"cli batch {args.batch}" if args.batch else "cli"
+            with profiling.profiled(label=label, route='cli', number=args.numero, batch=args.batch):
+                _run(parser, args, tracer)
+        else:
+            _run(parser, args, tracer)
+    finally:
+        if tracer is not None:
+            try:
+                tracer.finish()
+            except sqltrace.QueryBudgetExceeded as e:
+                print(f"{e}", file=sys.stderr)
+                sys.exit(1)
+            print(tracer.format(), file=sys.stderr)
+
+def _connect(tracer):
+    conn = setup_db_connection()
+    if tracer is not None:
+        tracer.attach(conn, 'lookup')
+    return conn
+
+def _run(parser, args, tracer):
+
+    if args.as_of:
+        try:
+            args.as_of = parse_as_of(args.as_of)
+        except ValueError:
+            print(f"Erreur: La date «{args.as_of}» est invalide (format attendu AAAA-MM-JJ).", file=sys.stderr)
+            sys.exit(1)
+
+    if args.batch:
+        try:
+            with closing(_connect(tracer)) as conn:
+                if args.batch == '-':
+                    write_batch(conn, sys.stdin, sys.stdout, args.as_of)
+                else:
+                    with open(args.batch, newline='', encoding='utf-8-sig') as f:
+                        write_batch(conn, f, sys.stdout, args.as_of)
+        except (DatabaseError, OSError, ValueError, csv.Error) as e:
+            print(f"{e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if not args.numero:
+        parser.error("un numéro ou --batch est requis")
 
     raw_tel = args.numero
     
@@ -313,8 +975,13 @@ def main():
 
     # Use valid database connection
     try:
-        with closing(setup_db_connection()) as conn:
-             result = get_full_info(conn, cleaned_number)
+        with closing(_connect(tracer)) as conn:
+             if args.explain:
+                 explanation = explain_lookup(conn, raw_tel, as_of=args.as_of)
+                 print_explanation(explanation)
+                 result = explanation['result']
+             else:
+                 result = get_full_info(conn, cleaned_number, as_of=args.as_of)
              if not print_result(result):
                  sys.exit(1)
     except DatabaseError as e: